@@ -36,7 +36,7 @@ from matplotlib.font_manager import findfont
 from matplotlib import ft2font
 from matplotlib.font_manager import ttfFontProperty
 
-from autobasedoc.pdfimage import PdfImage, PdfAsset, getScaledSvg
+from autobasedoc.pdfimage import PdfImage, LazyPdfImage, PdfAsset, getScaledSvg
 
 # add color names, missing in matplotlib
 missing_names = {
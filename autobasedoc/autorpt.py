@@ -62,12 +62,17 @@ from __future__ import print_function
 
 import os
 import sys
-import random
+import copy
+import asyncio
+import inspect
+import threading
+from contextlib import contextmanager
 import string
 from hashlib import sha1
 from operator import attrgetter
 from itertools import count
-from collections import OrderedDict
+from io import BytesIO
+from collections import OrderedDict, namedtuple
 
 from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER, TA_RIGHT
 from reportlab.lib.pagesizes import A4, landscape
@@ -82,17 +87,23 @@ from reportlab.platypus.doctemplate import (
     NullActionFlowable, NotAtTopPageBreak)
 
 from reportlab.platypus.frames import Frame
+from reportlab.platypus.tableofcontents import TableOfContents
 from reportlab.platypus.flowables import SlowPageBreak, DDIndenter, PageBreakIfNotEmpty
 from reportlab.pdfgen import canvas
 from reportlab.lib.styles import ParagraphStyle
 
 # configure pdf producer
-from reportlab.pdfbase.pdfdoc import PDFInfo
+from reportlab.pdfbase.pdfdoc import PDFInfo, PDFDocument, PDFDictionary
 
 # module imports
 from autobasedoc import base_fonts, color_dict, colors
 import autobasedoc.autoplot as ap
-from autobasedoc.styledtable import StyledTable
+import autobasedoc.shardbuild as sb
+from autobasedoc.buildstats import BuildStats
+from autobasedoc.layoutcache import LayoutCache
+from autobasedoc.styledtable import StyledTable, StreamingTable, ColumnarTable
+from autobasedoc.styledtable import compileStyleCommands, StyleIndex
+from autobasedoc.styledtable import LayeredTable, DirectTable, heatmapColors, colorRectangles
 from autobasedoc.styles import StyleSheet, Styles
 from autobasedoc.pageinfo import addPlugin, PageInfo
 from autobasedoc.fonts import registerFont, setFonts, setTtfFonts, getFont
@@ -111,6 +122,112 @@ sys.path.append(_basePath)
 __font_dir__ = os.path.realpath(os.path.join(_basePath, "fonts"))
 #__assets_dir__ = os.path.realpath(os.path.join(_basePath,"assets"))
 
+# progress event of asyncBuild, remaining is the number of flowables left in the pass
+BuildProgress = namedtuple("BuildProgress", "passes page remaining")
+
+
+class _BuildCancelled(Exception):
+    """
+    raised in the layout of a cancelled asyncBuild
+    """
+
+
+# kinds of flowable classes in handle_flowable
+_PAGEBREAK, _SLOWPAGEBREAK, _ACTION, _PDFIMAGE, _FRAMEACTION, _PLAIN = range(6)
+_handleKinds = {}
+
+# markers of flowable classes in afterFlowable
+_markers = {}
+
+# the counter of the ids of Bookmarks created in this thread, see bookmarkIds
+_bookmarkIdCounter = threading.local()
+
+
+@contextmanager
+def bookmarkIds(counter):
+    """
+    Bookmarks created in the context take their ids from counter (e.g.
+    itertools.count) instead of the counter of the Bookmark class, a
+    counter of None keeps the current one
+    """
+    previous = getattr(_bookmarkIdCounter, "counter", None)
+    if counter is not None:
+        _bookmarkIdCounter.counter = counter
+    try:
+        yield
+    finally:
+        _bookmarkIdCounter.counter = previous
+
+
+def _nextBookmarkId():
+    """
+    returns the id of a new Bookmark
+    """
+    counter = getattr(_bookmarkIdCounter, "counter", None)
+    return next(counter if counter is not None else Bookmark._ids)
+
+
+def _handleKind(cls):
+    """
+    returns the kind of flowable class cls for handle_flowable,
+    resolved once per class
+    """
+    if issubclass(cls, SlowPageBreak):
+        kind = _SLOWPAGEBREAK
+    elif issubclass(cls, PageBreak):
+        kind = _PAGEBREAK
+    elif issubclass(cls, ActionFlowable):
+        kind = _ACTION
+    elif issubclass(cls, ap.PdfImage):
+        kind = _PDFIMAGE
+    elif issubclass(cls, FrameActionFlowable):
+        kind = _FRAMEACTION
+    else:
+        kind = _PLAIN
+    _handleKinds[cls] = kind
+    return kind
+
+
+def _clnMarker(cln):
+    """
+    returns the marker ("Bookmark", "Header", "Footer" or "") of the
+    result of the function cln, "" if it fails
+    """
+    try:
+        name = cln()
+        for marker in ("Bookmark", "Header", "Footer"):
+            if name.startswith(marker):
+                return marker
+    except Exception:
+        pass
+    return ""
+
+
+def _flowableMarker(flowable):
+    """
+    returns the marker of flowable for afterFlowable ("Bookmark", "Header",
+    "Footer" or ""), the prefix of its cln()
+
+    The marker of a class with a cln classmethod (or without cln) is
+    resolved once, e.g. Bookmark.cln returns the class name, so subclasses
+    with other names are not marked. A cln instance method is called for
+    every flowable.
+    """
+    cls = flowable.__class__
+    marker = _markers.get(cls)
+    if marker is not None:
+        return marker
+    cln = getattr(cls, "cln", None)
+    if cln is None:
+        marker = ""
+    elif inspect.ismethod(cln) and cln.__self__ is cls:
+        marker = _clnMarker(cln)
+    else:
+        return _clnMarker(getattr(flowable, "cln"))
+    _markers[cls] = marker
+    return marker
+
+
 def reprFrame(frame):
     _dict = vars(frame)
     for key in sorted(list(_dict.keys())):
@@ -135,7 +252,7 @@ def drawFirstPortrait(canv, doc):
     Notes
     -----
     - Automatically sets page size and font
-    - Activates addPlugin for "First" frame
+    - Activates addPlugin for the master frame of the page template
     - Canvas state is saved and restored
     
     Examples
@@ -149,12 +266,12 @@ def drawFirstPortrait(canv, doc):
     """
     canv.saveState()
     # Set page size
-    frame, pagesize = doc.getFrame(doc.template_id)
+    frame, pagesize = doc.masterFrame
 
     canv.setPageSize(pagesize)
     canv.setFont(base_fonts()["normal"], doc.fontSize)
 
-    addPlugin(canv, doc, frame="First")
+    addPlugin(canv, doc, frame=frame)
 
     canv.restoreState()
 
@@ -190,12 +307,12 @@ def drawFirstLandscape(canv, doc):
     """
     canv.saveState()
     # Set page size
-    frame, pagesize = doc.getFrame(doc.template_id)
+    frame, pagesize = doc.masterFrame
 
     canv.setPageSize(pagesize)
     canv.setFont(base_fonts().get("normal"), doc.fontSize)
 
-    addPlugin(canv, doc, frame="First")
+    addPlugin(canv, doc, frame=frame)
 
     canv.restoreState()
 
@@ -208,12 +325,12 @@ def drawLaterPortrait(canv, doc):
     canv.saveState()
     # Set page size
 
-    frame, pagesize = doc.getFrame(doc.template_id)
+    frame, pagesize = doc.masterFrame
 
     canv.setPageSize(pagesize)
     canv.setFont(base_fonts().get("normal"), doc.fontSize)
 
-    addPlugin(canv, doc, frame="Later")
+    addPlugin(canv, doc, frame=frame)
 
     canv.restoreState()
 
@@ -224,12 +341,12 @@ def drawLaterLandscape(canv, doc):
     canv.saveState()
 
     # Set page size and variables
-    frame, pagesize = doc.getFrame(doc.template_id)
+    frame, pagesize = doc.masterFrame
 
     canv.setPageSize(pagesize)
     canv.setFont(base_fonts().get("normal"), doc.fontSize)
 
-    addPlugin(canv, doc, frame="Later")
+    addPlugin(canv, doc, frame=frame)
 
     canv.restoreState()
 
@@ -240,12 +357,12 @@ def drawLaterSpecialPortrait(canv, doc):
     canv.saveState()
     # Set page size
 
-    frame, pagesize = doc.getFrame(doc.template_id)
+    frame, pagesize = doc.masterFrame
 
     canv.setPageSize(pagesize)
     canv.setFont(base_fonts().get("normal"), doc.fontSize)
 
-    addPlugin(canv, doc, frame="Later")
+    addPlugin(canv, doc, frame=frame)
 
     canv.restoreState()
 
@@ -256,12 +373,12 @@ def drawLaterSpecialLandscape(canv, doc):
     canv.saveState()
 
     # Set page size and variables
-    frame, pagesize = doc.getFrame(doc.template_id)
+    frame, pagesize = doc.masterFrame
 
     canv.setPageSize(pagesize)
     canv.setFont(base_fonts().get("normal"), doc.fontSize)
 
-    addPlugin(canv, doc, frame="Later")
+    addPlugin(canv, doc, frame=frame)
 
     canv.restoreState()
 
@@ -300,6 +417,8 @@ class AutoDocTemplate(BaseDocTemplate):
         PDF metadata
     keywords : list, optional
         PDF keywords
+    layoutCache : LayoutCache, optional
+        Cache of wrap and split results kept between runs, default: None
         
     Attributes
     ----------
@@ -357,7 +476,8 @@ class AutoDocTemplate(BaseDocTemplate):
                  creator=None,
                  keywords=[],
                  pagesize=A4,
-                 debug=False):
+                 debug=False,
+                 layoutCache=None):
 
         if producer is not None:
             PDFInfo.producer = producer
@@ -403,6 +523,28 @@ class AutoDocTemplate(BaseDocTemplate):
         self.bottomM = self.fontSize - self.topM
         self.templates={}
 
+        # prefix index of page templates and their frames, see indexTemplates
+        self._templateIndex = {}
+        self._frameIndex = {}
+
+        # page cache of the incremental multiBuild
+        self._pageCache = {}
+        self._passPages = None
+
+        # state of the shard in a sharded build
+        self._shard = None
+
+        # flowable to page map of paginate
+        self._pageMap = None
+        self._pageMapFlowable = None
+
+        # wrap and split results of former runs, see LayoutCache
+        self.layoutCache = layoutCache
+
+        # build instrumentation, see instrument
+        self.buildStats = None
+        self._statsFile = None
+
         self.templates_maker()
 
         if self.debug:
@@ -413,7 +555,53 @@ class AutoDocTemplate(BaseDocTemplate):
 
     @property
     def template_id(self):
-        return sys._getframe(1).f_code.co_name.strip("draw")
+        """
+        id of the current page template, inside a page callback this is the
+        name of the callback without 'draw'
+        """
+        pageTemplate = getattr(self, "pageTemplate", None)
+        if pageTemplate is None:
+            return None
+        return pageTemplate.id
+
+    @property
+    def masterFrame(self):
+        """
+        master frame and pagesize of the current page template,
+        resolved from the template index
+        """
+        return self._frameIndex[self.pageTemplate.id][self.pageTemplate.id]
+
+    def addPageTemplates(self, pageTemplates):
+        """
+        override base method to keep the template index up to date
+        """
+        super(AutoDocTemplate, self).addPageTemplates(pageTemplates)
+        self.indexTemplates()
+
+    def indexTemplates(self):
+        """
+        build the prefix index of the page templates and their frames
+
+        every prefix of a template id maps to the first and the last
+        template with this prefix, every prefix of a frame id maps to the
+        first frame of the template with this prefix and its pagesize.
+        getTemplate and getFrame are plain lookups in this index.
+        """
+        templateIndex = {}
+        frameIndex = {}
+        for temp in self.pageTemplates:
+            for i in range(len(temp.id) + 1):
+                first, _ = templateIndex.get(temp.id[:i], (temp, None))
+                templateIndex[temp.id[:i]] = (first, temp)
+
+            frames = frameIndex.setdefault(temp.id, {})
+            for frame in temp.frames:
+                for i in range(len(frame.id) + 1):
+                    frames.setdefault(frame.id[:i], (frame, temp.pagesize))
+
+        self._templateIndex = templateIndex
+        self._frameIndex = frameIndex
 
     def templates_maker(self):
         """
@@ -541,18 +729,22 @@ class AutoDocTemplate(BaseDocTemplate):
                 (x1,y1) <-- lower left corner
 
         """
-        def makeRandomId(length=3, chars=string.ascii_lowercase):
+        def makeFrameId(length=3, chars=string.ascii_lowercase):
             """
-            create a file id of lower case ascii characters with length
+            create a frame id of lower case ascii characters with length,
+            derived from the frame geometry to be the same in every run
             """
-            return ''.join(random.choice(chars) for _ in range(length))
+            geometry = (frame_id, x1, y1, width, height, left_padding,
+                        bottom_padding, right_padding, top_padding)
+            digest = sha1(repr(geometry).encode("utf-8")).digest()
+            return ''.join(chars[b % len(chars)] for b in digest[:length])
 
         return Frame(x1, y1, width, height,
                      leftPadding=left_padding,
                      bottomPadding=bottom_padding,
                      rightPadding=right_padding,
                      topPadding=top_padding,
-                     id=f"{frame_id}_{makeRandomId()}",
+                     id=f"{frame_id}_{makeFrameId()}",
                      showBoundary=self.showBoundary,
                      overlapAttachedSpace=overlap,
                      _debug=None)
@@ -571,69 +763,50 @@ class AutoDocTemplate(BaseDocTemplate):
         frame._rightPadding,frame._topPadding
         and pagesize:
         (x,y)
+
+        :raises KeyError: if the page template has no such frame
         """
 
-        f = attrgetter("id")
-        frame = None
+        pageTemplate = None
 
         if temp_name is not None:
 
             pageTemplate = self.getTemplate(temp_id=temp_name, last=last)
 
-        else:
+        elif self.pageTemplates:
             if last:
-                try:
-                    pageTemplate = self.pageTemplates[-1]
-                except:
-                    frame = None
+                pageTemplate = self.pageTemplates[-1]
             else:
-                try:
-                    pageTemplate = self.pageTemplates[0]
-                except:
-                    frame = None
+                pageTemplate = self.pageTemplates[0]
 
         # to get the master frame
         if orientation is None:
             orientation = temp_name
 
-        for frame in pageTemplate.frames:
-            #print(f(frame))
-            if f(frame).startswith(orientation):
-                return frame, pageTemplate.pagesize
+        if pageTemplate is not None:
+            frames = self._frameIndex.get(pageTemplate.id, {})
+            if orientation in frames:
+                return frames[orientation]
 
-        if frame is None:
-            print("Error occured accessing self.pageTemplates", temp_name)
-            raise Exception
-            #            #print ( thisTemplate.frames[0].id )
-            #            return thisTemplate.frames[0],thisTemplate.pagesize
-            #
-            #        else:
+        raise KeyError("no frame %r in page template %r" % (orientation, temp_name))
 
 
     def getTemplate(self, temp_id=None, last=False, as_name=False):
         """
         Return first page template with an id that starts with frame_name
+
+        :raises KeyError: if no page template starts with temp_id
         """
-        f = attrgetter("id")
         template = None
 
-        if not last:
-            for temp in self.pageTemplates:
-                if f(temp).startswith(temp_id):
-                    template = temp
-                    break
-
-        else:
-            for temp in self.pageTemplates[::-1]:
-                if f(temp).startswith(temp_id):
-                    template = temp
-                    break
+        if temp_id in self._templateIndex:
+            template = self._templateIndex[temp_id][1 if last else 0]
 
         if as_name and template:
-            template = f(template)
+            template = template.id
 
         if template is None:
-            print(f"Error from {self.template_id}: temp_id:{temp_id}, last:{last}, as_name:{as_name}")
+            raise KeyError("no page template with an id starting with %r" % (temp_id,))
 
         return template
 
@@ -845,12 +1018,43 @@ class AutoDocTemplate(BaseDocTemplate):
 
         return Img
 
+    def handle_documentBegin(self):
+        """
+        override base method to start a shard of a sharded build
+        with its page offset and page template
+        """
+        super(AutoDocTemplate, self).handle_documentBegin()
+        if self.buildStats is not None:
+            self.buildStats.beginPass()
+        if self._pageMap is not None:
+            self._pageMap.clear()
+            self._pageMapFlowable = None
+        if self._shard is not None:
+            if self._shard["template"]:
+                self.handle_nextPageTemplate(self._shard["template"])
+                self._setPageTemplate()
+            self.page = self._shard["offset"]
+            self.canv._pageNumber = self.page + 1
+
     def handle_pageBegin(self):
         """
         override base method to add a change of page template after the firstpage.
         by default: use Later template
         """
-        self._handle_pageBegin()
+        if self._passPages is not None:
+            self._recordPage(self.page + 1)
+            if self._passSynced:
+                return
+        if self.buildStats is not None:
+            self.buildStats.call("onPage", self.pageTemplate.id, self,
+                                 self._handle_pageBegin)
+        else:
+            self._handle_pageBegin()
+        if self._shard is not None and self.page == self._shard["offset"] + 1:
+            # placeholders for the bookmarks of the other shards,
+            # they are pointed to the real destination when merging
+            for i, key in enumerate(self._shard["foreign"]):
+                self.canv.bookmarkPage(key, fit='XYZ', left=-1, top=i)
         template = self.getTemplate(temp_id='Later', as_name=True)
         self._handle_nextPageTemplate(template)
 
@@ -863,7 +1067,15 @@ class AutoDocTemplate(BaseDocTemplate):
         added a dirty workaround to scale images
         if their boundingBox exceeds the borders of the frame.
         """
+        if self.buildStats is None or not flowables:
+            return self._handleFlowable(flowables)
+        return self.buildStats.call("handle", flowables[0].__class__.__name__,
+                                    self, self._handleFlowable, flowables)
 
+    def _handleFlowable(self, flowables):
+        """
+        handle_flowable without instrumentation
+        """
         #allow document a chance to look at, modify or ignore
         #the object(s) about to be processed
         self.filterFlowables(flowables)
@@ -873,19 +1085,25 @@ class AutoDocTemplate(BaseDocTemplate):
         del flowables[0]
         if f is None:
             return
-        if isinstance(f, PageBreak):
+        if self._pageMap is not None and id(f) in self._storyIds:
+            self._pageMapFlowable = f
+        cls = f.__class__
+        kind = _handleKinds.get(cls)
+        if kind is None:
+            kind = _handleKind(cls)
+        if kind == _PAGEBREAK or kind == _SLOWPAGEBREAK:
             npt = f.nextTemplate
             if npt and not self._samePT(npt):
                 npt = NextPageTemplate(npt)
                 npt.apply(self)
                 self.afterFlowable(npt)
-            if isinstance(f, SlowPageBreak):
+            if kind == _SLOWPAGEBREAK:
                 self.handle_pageBreak(slow=1)
             else:
                 #print( f.__class__.__name__, self.frame.id )
                 self.handle_pageBreak()
             self.afterFlowable(f)
-        elif isinstance(f, ActionFlowable):
+        elif kind == _ACTION:
             f.apply(self)
             self.afterFlowable(f)
         else:
@@ -894,12 +1112,7 @@ class AutoDocTemplate(BaseDocTemplate):
             if self.debug:
                 frame.drawBoundary(canv)
             #handle scaling to fit a PdfImage on self.frame
-            if isinstance(f, Table):
-                pass  # controls default behaviour for Table typed flowables
-                #f.setStyle([("GRID", (0, 0), (-1, -1), 0.5, colors.black)])
-            elif isinstance(f, Spacer):
-                pass
-            if isinstance(f, ap.PdfImage):
+            if kind == _PDFIMAGE:
                 #print("height of image:",f.drawHeight)
                 #print("height of frame:",frame._aH)
                 xfactor = getattr(f, "_userScaleFactor", None)
@@ -935,22 +1148,22 @@ class AutoDocTemplate(BaseDocTemplate):
                 #print(f.drawHeight)
 
                 #try to fit it then draw it
-            if frame.add(f, canv, trySplit=self.allowSplitting):
-                if not isinstance(f, FrameActionFlowable):
+            if self._frameAdd(frame, f, canv, trySplit=self.allowSplitting):
+                if kind != _FRAMEACTION:
                     self._curPageFlowableCount += 1
                     self.afterFlowable(f)
                 _addGeneratedContent(flowables, frame)
             else:
                 if self.allowSplitting:
                     # see if this is a splittable thing
-                    S = frame.split(f, canv)
+                    S = self._frameSplit(frame, f, canv)
                     n = len(S)
                 else:
                     n = 0
                 if n:
                     if not isinstance(S[0], (PageBreak, SlowPageBreak,
                                              ActionFlowable, DDIndenter)):
-                        if not frame.add(S[0], canv, trySplit=0):
+                        if not self._frameAdd(frame, S[0], canv, trySplit=0):
                             ident = "Splitting error(n==%d) on page %d in\n%s\nS[0]=%s" % \
                             (n,
                              self.page,
@@ -990,6 +1203,60 @@ class AutoDocTemplate(BaseDocTemplate):
                     self.handle_frameEnd()
 
 
+    def _frameAdd(self, frame, flowable, canv, trySplit=0):
+        """
+        frame.add, the flowable is not drawn when the story is paginated,
+        wrap results are taken from the layout cache and with
+        instrumentation wrap, drawOn and frame.add are timed
+        """
+        stats = self.buildStats
+        if self._pageMap is None and stats is None and self.layoutCache is None:
+            return frame.add(flowable, canv, trySplit=trySplit)
+
+        # the methods are shadowed by instance attributes during frame.add
+        shadowed = dict((name, flowable.__dict__[name])
+                        for name in _SHADOWED if name in flowable.__dict__)
+        if self._pageMap is not None:
+            flowable.drawOn = _drawNothing
+        if self.layoutCache is not None:
+            self.layoutCache.install(flowable, draw=self._pageMap is None)
+        if stats is not None:
+            name = flowable.__class__.__name__
+            flowable.wrap = stats.timed("wrap", name, self, flowable.wrap)
+            flowable.drawOn = stats.timed("drawOn", name, self, flowable.drawOn)
+        try:
+            if stats is not None:
+                return stats.call("add", name, self, frame.add,
+                                  flowable, canv, trySplit=trySplit)
+            return frame.add(flowable, canv, trySplit=trySplit)
+        finally:
+            for attr in _SHADOWED:
+                flowable.__dict__.pop(attr, None)
+            flowable.__dict__.update(shadowed)
+
+    def _frameSplit(self, frame, flowable, canv):
+        """
+        frame.split, split results are taken from the layout cache and
+        timed with instrumentation
+        """
+        stats = self.buildStats
+        if stats is None and self.layoutCache is None:
+            return frame.split(flowable, canv)
+
+        shadowed = dict((name, flowable.__dict__[name])
+                        for name in _SHADOWED if name in flowable.__dict__)
+        if self.layoutCache is not None:
+            self.layoutCache.install(flowable, draw=False)
+        try:
+            if stats is not None:
+                return stats.call("split", flowable.__class__.__name__, self,
+                                  frame.split, flowable, canv)
+            return frame.split(flowable, canv)
+        finally:
+            for attr in _SHADOWED:
+                flowable.__dict__.pop(attr, None)
+            flowable.__dict__.update(shadowed)
+
     def afterFlowable(self, flowable):
         """
         Registers TOC entries.
@@ -1005,19 +1272,17 @@ class AutoDocTemplate(BaseDocTemplate):
         afterFlowable(), making notification calls using the notify() method
         with appropriate data.
         """
-        try:
-            cln = flowable.cln()
-
-        except:
-            cln = ""
+        if self._pageMap is not None:
+            # split parts are mapped to the story flowable they come from
+            if id(flowable) in self._storyIds:
+                self._pageMapFlowable = flowable
+            if self._pageMapFlowable is not None:
+                self._pageMap.setdefault(self._pageMapFlowable, self.page)
 
-        if cln.startswith("Header"):
-            pass
+        if self.buildStats is not None:
+            self.buildStats.record("flowable", flowable.__class__.__name__, self.page)
 
-        if cln.startswith("Footer"):
-            pass
-
-        if cln.startswith("Bookmark"):
+        if _flowableMarker(flowable) == "Bookmark":
             #print("Bookmark",flowable.title,"created at level:",flowable.level)
 
             #This seems to be not necessary
@@ -1029,6 +1294,9 @@ class AutoDocTemplate(BaseDocTemplate):
             self.canv.bookmarkPage(flowable.key,
                                    fit='XYZ',
                                    top=self.currSpaceToBottom)
+            if self._shard is not None:
+                self._shard["bookmarks"].append(
+                    (flowable.key, flowable.title, flowable.level))
             ##            if flowable.fullpage:
             ##                flowable.key='Diagramm'+flowable.key
             #self.canv.bookmarkPage(flowable.key, fit='FitH', top=800)
@@ -1044,6 +1312,560 @@ class AutoDocTemplate(BaseDocTemplate):
             self.canv.showOutline()
 
 
+    def notify(self, kind, stuff):
+        """
+        forward to any listeners and keep the notification in the page cache
+        of the incremental multiBuild
+        """
+        if self._passPages:
+            self._passPages[self.page]["notes"].append((kind, stuff))
+        if self._shard is not None and kind == 'TOCEntry':
+            self._shard["notes"].append(tuple(stuff))
+        super(AutoDocTemplate, self).notify(kind, stuff)
+
+    def multiBuild(self, story, maxPasses=10, incremental=False, **buildKwds):
+        """
+        Makes multiple passes until all indexing flowables are happy.
+
+        With incremental=True the pagination of every pass is kept in a page
+        cache. The next pass does not lay out the story from the beginning
+        again, it restarts on the first page that holds an indexing flowable
+        (e.g. the table of contents) and replays the TOC notifications of the
+        pages before. As soon as a page starts in the same state as in the
+        cached pass, the rest of the pass is taken from the cache. The pages
+        of the restarted range are drawn over the pages of the former pass,
+        all other pages are reused from the canvas of the former pass.
+
+        Only indexing flowables derived from TableOfContents are fed by
+        notifications that can be replayed, with other indexing flowables
+        the standard multiBuild is used.
+
+        Returns number of passes
+        """
+        if not incremental:
+            return super(AutoDocTemplate, self).multiBuild(
+                story, maxPasses=maxPasses, **buildKwds)
+
+        self._indexingFlowables = [f for f in story if f.isIndexing()]
+        if not all(isinstance(f, TableOfContents)
+                   for f in self._indexingFlowables):
+            return super(AutoDocTemplate, self).multiBuild(
+                story, maxPasses=maxPasses, **buildKwds)
+
+        self._indexIds = set(id(f) for f in self._indexingFlowables)
+        self._lastIndexPos = max([i for i, f in enumerate(story)
+                                  if id(f) in self._indexIds] or [-1])
+        self._pageCache = {}
+        self._doSave = 0
+        passes = 0
+        mbe = []
+        self._multiBuildEdits = mbe.append
+        restart = None
+        while 1:
+            passes += 1
+            if self._onProgress:
+                self._onProgress('PASS', passes)
+
+            for fl in self._indexingFlowables:
+                fl.beforeBuild()
+
+            self._buildPass(story, restart=restart, **buildKwds)
+
+            for fl in self._indexingFlowables:
+                fl.afterBuild()
+
+            if self._allSatisfied():
+                break
+            if passes > maxPasses:
+                raise IndexError("Index entries not resolved after %d passes" % maxPasses)
+
+            #work through any edits
+            while mbe:
+                e = mbe.pop(0)
+                e[0](*e[1:])
+
+            restart = min(self._indexPages.values())
+
+        self.canv.save()
+        del self._multiBuildEdits
+        if self._statsFile:
+            self.buildStats.dump(self._statsFile)
+        return passes
+
+    def instrument(self, filename=None):
+        """
+        switch on the instrumentation of the following builds
+
+        wall time and call counts of handle_flowable, wrap, split, frame.add,
+        drawOn, the page callbacks and addPlugin are recorded by flowable
+        class, page and pass of multiBuild. Of a shardedBuild only the shards
+        built in this process are recorded.
+
+        :param filename: if given, the stats are written as JSON to filename
+            after every build
+
+        Returns the BuildStats object
+        """
+        self.buildStats = BuildStats()
+        self._statsFile = filename
+        return self.buildStats
+
+    def _endBuild(self):
+        """
+        override base method to write the build stats
+        """
+        super(AutoDocTemplate, self)._endBuild()
+        if self._statsFile:
+            self.buildStats.dump(self._statsFile)
+
+    def _buildPass(self, story, restart=None, filename=None,
+                   canvasmaker=canvas.Canvas):
+        """
+        one pass of the incremental multiBuild, following BaseDocTemplate.build
+
+        every page begin is recorded in self._passPages, if restart is a page
+        number, the pass resumes from the cached checkpoint of that page on
+        the canvas of the former pass.
+        """
+        flowables = story[:]
+        self._passSource = story
+        self._passStory = flowables
+        self._passPages = {}
+        self._passRestart = restart
+        self._passSynced = False
+        self._indexPages = {}
+
+        if restart is None:
+            self._startBuild(filename, canvasmaker)
+        else:
+            self._calc()
+            self.handle_documentBegin()
+            self._restorePage(restart)
+            if self._onPage:
+                self.canv.setPageCallBack(self._onPage)
+        canv = self.canv
+        self._savedInfo = canv._doc.info
+
+        try:
+            canv._doctemplate = self
+            while len(flowables):
+                if self._hanging and self._hanging[-1] is PageBegin and isinstance(flowables[0], PageBreakIfNotEmpty):
+                    npt = flowables[0].nextTemplate
+                    if npt and not self._samePT(npt):
+                        npt = NextPageTemplate(npt)
+                        npt.apply(self)
+                        self._setPageTemplate()
+                    del flowables[0]
+                self.clean_hanging()
+                if self._passSynced:
+                    break
+                if id(flowables[0]) in self._indexIds:
+                    self._indexPages.setdefault(id(flowables[0]), self.page)
+                self.handle_flowable(flowables)
+                if self._onProgress:
+                    self._onProgress('PROGRESS', len(story) - len(flowables))
+        finally:
+            del canv._doctemplate
+        canv._doc.info = self._savedInfo
+
+        if not self._passSynced:
+            self._endBuild()
+            if restart is not None:
+                canv._pageOverwrite.truncate()
+
+        pageCache = {}
+        if restart is not None:
+            for page, checkpoint in self._pageCache.items():
+                if page < restart:
+                    pageCache[page] = checkpoint
+        pageCache.update(self._passPages)
+        self._pageCache = pageCache
+        self._passPages = None
+
+    def _pageCheckpoint(self):
+        """
+        returns the state of the build at the begin of the next page
+
+        the remaining story is stored as the list of split parts in front
+        and the index of the untouched rest in the original story.
+        """
+        rest, source = self._passStory, self._passSource
+        n = len(rest)
+        offset = len(source) - n
+        i = 0
+        while i < n and (offset + i < 0 or rest[i] is not source[offset + i]):
+            i += 1
+
+        state = dict(pageTemplate=self.pageTemplate,
+                     _nextPageTemplateIndex=getattr(self, "_nextPageTemplateIndex", None),
+                     _leftExtraIndent=self._leftExtraIndent,
+                     _rightExtraIndent=self._rightExtraIndent,
+                     _frameBGs=list(self._frameBGs),
+                     _topFlowables=list(self._topFlowables),
+                     _pageTopFlowables=list(self._pageTopFlowables),
+                     _emptyPages=self._emptyPages,
+                     _pageRefs=dict(self._pageRefs))
+
+        return dict(head=rest[:i],
+                    index=offset + i,
+                    hanging=list(self._hanging),
+                    state=state,
+                    seq=copy.deepcopy(self.seq),
+                    notes=[])
+
+    def _inSync(self, checkpoint, cached):
+        """
+        True if the layout continues from checkpoint exactly as from cached
+        """
+        same = lambda a, b: len(a) == len(b) and all(x is y for x, y in zip(a, b))
+
+        if checkpoint["index"] != cached["index"]:
+            return False
+        if checkpoint["index"] <= self._lastIndexPos:
+            return False
+        if any(id(f) in self._indexIds for f in checkpoint["head"]):
+            return False
+        return (same(checkpoint["head"], cached["head"])
+                and same(checkpoint["hanging"], cached["hanging"])
+                and checkpoint["state"] == cached["state"])
+
+    def _recordPage(self, page):
+        """
+        record the checkpoint of page, or take the rest of the pass from the
+        page cache if the layout runs in sync with the cached pass again
+        """
+        checkpoint = self._pageCheckpoint()
+        cached = self._pageCache.get(page)
+        if (self._passRestart is not None and page > self._passRestart
+                and cached is not None and self._inSync(checkpoint, cached)):
+            for p in sorted(self._pageCache):
+                if p >= page:
+                    self._passPages[p] = self._pageCache[p]
+                    for kind, stuff in self._pageCache[p]["notes"]:
+                        BaseDocTemplate.notify(self, kind, stuff)
+            self._passSynced = True
+            del self._hanging[:]
+        else:
+            self._passPages[page] = checkpoint
+
+    def _restorePage(self, page):
+        """
+        set the build state to the cached begin of page
+        and replay the notifications of the pages before
+        """
+        checkpoint = self._pageCache[page]
+        for p in sorted(self._pageCache):
+            if p < page:
+                for kind, stuff in self._pageCache[p]["notes"]:
+                    BaseDocTemplate.notify(self, kind, stuff)
+
+        self._passStory[:] = checkpoint["head"] + self._passSource[checkpoint["index"]:]
+        self._hanging[:] = [PageBegin] + checkpoint["hanging"]
+
+        state = checkpoint["state"]
+        for key in ("pageTemplate", "_leftExtraIndent", "_rightExtraIndent", "_emptyPages"):
+            setattr(self, key, state[key])
+        for key in ("_frameBGs", "_topFlowables", "_pageTopFlowables"):
+            setattr(self, key, list(state[key]))
+        self._pageRefs = dict(state["_pageRefs"])
+        if state["_nextPageTemplateIndex"] is None:
+            if hasattr(self, "_nextPageTemplateIndex"):
+                del self._nextPageTemplateIndex
+        else:
+            self._nextPageTemplateIndex = state["_nextPageTemplateIndex"]
+        self.seq = copy.deepcopy(checkpoint["seq"])
+
+        self.page = page - 1
+        if getattr(self.canv, "_pageOverwrite", None) is None:
+            self.canv._pageOverwrite = PageOverwrite(self.canv)
+        self.canv._pageOverwrite.seek(page)
+
+    def shardedBuild(self, story, processes=None, shards=None, maxPasses=10):
+        """
+        Builds the story in shards on a process pool and merges them into
+        one PDF, see module shardbuild.
+
+        The story is cut behind PageBreak flowables into at most shards
+        parts (by default one per process). All shards are built in
+        parallel first, to know the number of pages of every shard. Then
+        the shards with a table of contents are built again with the
+        entries of the whole document, until the page offsets are stable.
+        At last all shards, that were built with a wrong page offset, are
+        built again in parallel and the shards are merged.
+
+        Links and outline entries across shards work for Bookmark keys,
+        TOCEntry notifications are the only notifications passed between
+        the shards. With indexing flowables other than TableOfContents the
+        standard multiBuild is used.
+
+        Returns number of pages
+        """
+        indexing = [f for f in story if f.isIndexing()]
+        if not all(isinstance(f, TableOfContents) for f in indexing):
+            self.multiBuild(story, maxPasses=maxPasses)
+            return self.page
+
+        parts = sb.splitStory(story, shards or processes or os.cpu_count() or 1)
+        later = self.getTemplate(temp_id='Later', as_name=True)
+        keys = [[f.key for f in story[start:stop] if isinstance(f, Bookmark)]
+                for start, stop in parts]
+        tocShards = [i for i, (start, stop) in enumerate(parts)
+                     if any(f.isIndexing() for f in story[start:stop])]
+
+        jobs = []
+        for i, (start, stop) in enumerate(parts):
+            template = None
+            if start:
+                template = sb.shardTemplate(story[:start]) or later
+            foreign = [k for j, ks in enumerate(keys) if j != i for k in ks]
+            jobs.append(dict(shard=i, offset=0, template=template,
+                             entries=[], foreign=foreign))
+
+        self.shardStory = story
+        results = sb.runShards(self, parts, jobs, processes)
+        for passes in range(maxPasses + 1):
+            offsets, entries = self._shardIndex(results)
+            stale = [i for i, job in enumerate(jobs)
+                     if job["offset"] != offsets[i]
+                     or (i in tocShards and job["entries"] != entries)]
+            if not stale:
+                break
+            # the page count of the other shards only changes with the
+            # table of contents, so those are settled first
+            if any(i in tocShards for i in stale):
+                stale = [i for i in stale if i in tocShards]
+            for i in stale:
+                jobs[i] = dict(jobs[i], offset=offsets[i], entries=entries)
+            built = sb.runShards(self, parts, [jobs[i] for i in stale], processes)
+            for i, result in zip(stale, built):
+                results[i] = result
+        else:
+            raise IndexError("Index entries not resolved after %d passes" % maxPasses)
+        del self.shardStory
+
+        for fl in indexing:
+            fl._entries = list(entries)
+            fl._lastEntries = list(entries)
+
+        info = dict(Title=self.title, Author=self.author,
+                    Subject=self.subject, Creator=self.creator)
+        return sb.mergeShards(results, self.filename, info)
+
+    def buildShard(self, flowables, offset=0, template=None, entries=None,
+                   foreign=()):
+        """
+        builds one shard of a sharded build into memory
+
+        :param flowables: the part of the story
+        :param offset: number of pages in front of the shard
+        :param template: id of the page template the shard starts with
+        :param entries: TOC entries of the whole document
+        :param foreign: keys of the bookmarks in the other shards
+
+        Returns dict of the shard
+        """
+        for fl in flowables:
+            if fl.isIndexing():
+                fl.beforeBuild()
+                fl._lastEntries = list(entries or [])
+
+        shard = self._shard = dict(offset=offset, template=template,
+                                   foreign=list(foreign), bookmarks=[], notes=[])
+        self._doSave = 1
+        pdf = BytesIO()
+        try:
+            self.build(list(flowables), filename=pdf)
+        finally:
+            self._shard = None
+
+        # the final destination of a bookmark, an anchor in the heading
+        # may have moved it to the next page
+        bookmarks = []
+        for key, title, level in shard["bookmarks"]:
+            dest = self.canv._destinations[key]
+            page = int(dest.page.name[len("Page"):]) + offset
+            bookmarks.append((key, title, level, page,
+                              getattr(dest.fmt, "left", "null"),
+                              getattr(dest.fmt, "top", "null")))
+        shard["bookmarks"] = bookmarks
+        shard["pages"] = len(self.canv._doc.Pages.pages)
+        shard["pdf"] = pdf.getvalue()
+        return shard
+
+    def _shardIndex(self, results):
+        """
+        returns the page offsets of the shard results and the TOC entries
+        of the whole document with these offsets
+        """
+        offsets, entries = [], []
+        offset = 0
+        for result in results:
+            offsets.append(offset)
+            shift = offset - result["offset"]
+            for stuff in result["notes"]:
+                entries.append(stuff[:2] + (stuff[2] + shift,) + stuff[3:])
+            offset += result["pages"]
+        return offsets, entries
+
+    def lazyBuild(self, story, indexing=(), maxPasses=10, lookahead=64,
+                  **buildKwds):
+        """
+        Builds the document from an iterator or generator of flowables,
+        that is consumed while the pages are laid out.
+
+        Only lookahead flowables are pulled ahead of the one being laid
+        out (plus the rest of a split flowable), so keepWithNext chains
+        longer than lookahead are cut. The memory of the flowables stays
+        flat regardless of the length of the story.
+
+        With indexing flowables (e.g. the table of contents) the document
+        is built in passes like multiBuild. Then story has to be a callable
+        that returns a new iterator for every pass, which yields the given
+        indexing flowables. The Bookmarks created by the story get the same
+        keys in every pass.
+
+        :param story: iterable of flowables, or callable returning one
+        :param indexing: indexing flowables yielded by the story
+        :param maxPasses: maximum number of passes
+        :param lookahead: number of flowables pulled ahead
+
+        Returns number of passes
+        """
+        if indexing and not callable(story):
+            raise TypeError("lazyBuild with indexing flowables needs a callable story")
+
+        self._indexingFlowables = list(indexing)
+        self._doSave = 0
+        passes = 0
+        mbe = []
+        self._multiBuildEdits = mbe.append
+        bookmarkId = next(Bookmark._ids)
+        while 1:
+            passes += 1
+            if self._onProgress:
+                self._onProgress('PASS', passes)
+
+            for fl in self._indexingFlowables:
+                fl.beforeBuild()
+
+            # the same ids in every pass, without touching other builds
+            ids = count(bookmarkId)
+            with bookmarkIds(ids):
+                flowables = story() if callable(story) else story
+            self.build(LazyStory(flowables, lookahead, bookmarkIds=ids), **buildKwds)
+
+            for fl in self._indexingFlowables:
+                fl.afterBuild()
+
+            if self._allSatisfied():
+                break
+            if passes > maxPasses:
+                raise IndexError("Index entries not resolved after %d passes" % maxPasses)
+
+            #work through any edits
+            while mbe:
+                e = mbe.pop(0)
+                e[0](*e[1:])
+
+        self.canv.save()
+        del self._multiBuildEdits
+        return passes
+
+    def paginate(self, story, maxPasses=10):
+        """
+        Lays out the story without drawing it, e.g. for preflight checks
+        or to preview the number of pages.
+
+        The passes of the standard multiBuild run against a NullCanvas,
+        flowables are wrapped, split and added to the frames as in a full
+        build, but they are not drawn and no PDF is written. A LayoutError
+        is raised like in a full build. Anything collected while drawing
+        (e.g. index terms of a SimpleIndex) is missing.
+
+        Returns a dict that maps the flowables of the story to the page
+        they start on and the number of pages. Action flowables like a
+        PageBreak are mapped to the page they are applied on.
+        """
+        self._storyIds = set(id(f) for f in story)
+        self._pageMap = pageMap = {}
+        try:
+            super(AutoDocTemplate, self).multiBuild(story, maxPasses=maxPasses,
+                                                    canvasmaker=NullCanvas)
+        finally:
+            self._pageMap = None
+            self._pageMapFlowable = None
+            del self._storyIds
+
+        return pageMap, self.page
+
+    async def asyncBuild(self, story, progress=None, executor=None,
+                         method="multiBuild", **buildKwds):
+        """
+        Builds the document in an executor without blocking the event loop.
+
+        :param story: the story, or what the build method takes
+        :param progress: function called in the event loop with a
+            BuildProgress(passes, page, remaining) at the end of every page,
+            it may be a coroutine function
+        :param executor: concurrent.futures executor, default: the executor
+            of the event loop
+        :param method: name of the build method, e.g. build, multiBuild,
+            lazyBuild
+        :param buildKwds: keyword arguments of the build method
+
+        If the awaiting task is cancelled, the layout stops at the end of
+        the current page and CancelledError is raised, the document is left
+        unfinished.
+
+        Returns the result of the build method
+        """
+        # the running loop, get_running_loop needs Python 3.7
+        loop = asyncio.get_event_loop()
+        build = getattr(self, method)
+        cancelled = threading.Event()
+        size = len(story) if hasattr(story, "__len__") else 0
+        state = dict(passes=1, size=size, remaining=size)
+        onProgress = self._onProgress
+
+        def report(event):
+            result = progress(event)
+            if inspect.isawaitable(result):
+                loop.create_task(result)
+
+        def passProgress(typ, value):
+            if onProgress:
+                onProgress(typ, value)
+            if typ == "PASS":
+                state["passes"] = value
+            elif typ == "SIZE_EST":
+                state["size"] = state["remaining"] = value
+            elif typ == "PROGRESS":
+                state["remaining"] = state["size"] - value
+            elif typ == "PAGE":
+                if cancelled.is_set():
+                    raise _BuildCancelled()
+                if progress is not None:
+                    loop.call_soon_threadsafe(report, BuildProgress(
+                        state["passes"], value, state["remaining"]))
+
+        def run():
+            self._onProgress = passProgress
+            try:
+                return build(story, **buildKwds)
+            finally:
+                self._onProgress = onProgress
+
+        future = loop.run_in_executor(executor, run)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            try:
+                await future
+            except _BuildCancelled:
+                pass
+            raise
+
     # def build(self, flowables):
     #     """
     #     build the document using the flowables.  Annotate the first page using the onFirstPage
@@ -1070,6 +1892,167 @@ class AutoDocTemplate(BaseDocTemplate):
         return str(self.figCount)
 
 
+class LazyStory(object):
+    """
+    list of flowables for the build loop, that pulls the flowables from an
+    iterator on demand
+
+    only the operations of the build loop on the front of the list are
+    supported (index, slice, del, insert and len). len is the number of
+    flowables pulled ahead, at most lookahead unless split flowables were
+    put back, and 0 only when the iterator is exhausted.
+
+    Bookmarks created by the iterator take their ids from bookmarkIds, if
+    given.
+    """
+    def __init__(self, flowables, lookahead=64, bookmarkIds=None):
+        self._source = iter(flowables)
+        self._buffer = []
+        self.lookahead = max(lookahead, 1)
+        self.bookmarkIds = bookmarkIds
+
+    def _fill(self, count=None):
+        """
+        pull flowables until count are buffered, all for count=None
+        """
+        buffer = self._buffer
+        if self._source is None:
+            return
+        with bookmarkIds(self.bookmarkIds):
+            while count is None or len(buffer) < count:
+                try:
+                    buffer.append(next(self._source))
+                except StopIteration:
+                    self._source = None
+                    break
+
+    def _fillFor(self, index):
+        if isinstance(index, slice):
+            if (index.step is not None or index.stop is None or index.stop < 0
+                    or (index.start or 0) < 0):
+                self._fill()
+            else:
+                self._fill(index.stop)
+        elif index < 0:
+            self._fill()
+        else:
+            self._fill(index + 1)
+
+    def __len__(self):
+        self._fill(self.lookahead)
+        return len(self._buffer)
+
+    def __getitem__(self, index):
+        self._fillFor(index)
+        return self._buffer[index]
+
+    def __setitem__(self, index, value):
+        self._fillFor(index)
+        self._buffer[index] = value
+
+    def __delitem__(self, index):
+        self._fillFor(index)
+        del self._buffer[index]
+
+    def insert(self, index, value):
+        self._fill(index)
+        self._buffer.insert(index, value)
+
+
+# flowable methods shadowed by instance attributes in _frameAdd and _frameSplit
+_SHADOWED = ("wrap", "split", "drawOn")
+
+
+def _drawNothing(*args, **kwargs):
+    """
+    drawOn of a flowable that is only laid out
+    """
+    pass
+
+
+class NullCanvas(canvas.Canvas):
+    """
+    canvas that discards its pages
+
+    flowables draw on it as on a normal canvas, but no pages are added to
+    the PDF document, images are not loaded and save does not write a file.
+    Used by AutoDocTemplate.paginate to lay out a story without drawing it.
+    """
+    def showPage(self):
+        if self._onPage:
+            self._onPage(self._pageNumber)
+        self._startPage()
+
+    def drawImage(self, image, x, y, width=None, height=None, *args, **kwargs):
+        return width, height
+
+    def drawInlineImage(self, image, x, y, width=None, height=None, *args, **kwargs):
+        return width, height
+
+    def save(self):
+        pass
+
+
+class PageOverwrite(object):
+    """
+    lets a canvas draw pages again, that were already shown in a former pass
+    of the incremental multiBuild
+
+    the new page takes the place (and the object name) of the former page,
+    all pages after the overwritten range are kept, outline entries are only
+    added once.
+    """
+    def __init__(self, canv):
+        self.canv = canv
+        self.doc = canv._doc
+        self.outlineKeys = set(self.doc.outline.destinationnamestotitles)
+        self._addOutlineEntry = canv.addOutlineEntry
+        canv.addOutlineEntry = self.addOutlineEntry
+        self.doc.addPage = self.addPage
+
+    def seek(self, page):
+        """
+        continue drawing on page
+        """
+        self.canv._pageNumber = page
+        self.doc.pageCounter = page
+
+    def addPage(self, page):
+        """
+        replaces PDFDocument.addPage
+        """
+        doc = self.doc
+        pages = doc.Pages.pages
+        if doc.pageCounter <= len(pages):
+            name = doc.thisPageName()
+            page.__InternalName__ = name
+            doc.idToObject[name] = page
+            pages[doc.pageCounter - 1] = page
+            doc.pageCounter += 1
+            doc.inObject = None
+        else:
+            PDFDocument.addPage(doc, page)
+
+    def addOutlineEntry(self, title, key, level=0, closed=None):
+        """
+        replaces Canvas.addOutlineEntry
+        """
+        if key in self.outlineKeys:
+            return
+        self.outlineKeys.add(key)
+        self._addOutlineEntry(title, key, level=level, closed=closed)
+
+    def truncate(self):
+        """
+        drop the pages of the former pass behind the last page drawn
+        """
+        doc = self.doc
+        pages = doc.Pages.pages
+        for n in range(doc.pageCounter, len(pages) + 1):
+            doc.idToObject["Page" + repr(n)] = PDFDictionary()
+        del pages[doc.pageCounter - 1:]
+
+
 class BottomSpacer(Spacer):
     """
     a spacer that fills the current doc unto the bottom
@@ -1160,7 +2143,7 @@ class Bookmark(NullActionFlowable):
         super(Bookmark, self).__init__()
         self.title = title
         self._level = level
-        self._id = self._ids.__next__()
+        self._id = _nextBookmarkId()
         self.key = self.createBookmarkKey()
 
     @classmethod
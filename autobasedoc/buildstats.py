@@ -0,0 +1,119 @@
+"""
+buildstats
+==========
+
+.. module:: buildstats
+   :platform: Unix, Windows
+   :synopsis: wall time and call counts of a document build
+
+A BuildStats object is filled by AutoDocTemplate when the instrumentation
+is switched on with AutoDocTemplate.instrument. The following operations
+are recorded:
+
+- handle: handle_flowable for one flowable of the story
+- add: frame.add of a flowable (includes wrap and drawOn)
+- wrap: wrap of a flowable added to a frame
+- split: frame.split of a flowable that did not fit
+- drawOn: drawOn of a flowable
+- onPage: the page begin with the page callback of the page template
+- addPlugin: the header and footer elements of pageinfo.addPlugin
+- flowable: flowables laid out (afterFlowable), counted without time
+
+The operations are nested, e.g. the time of wrap is part of add, which is
+part of handle.
+"""
+import json
+import heapq
+from time import perf_counter
+
+
+class BuildStats(object):
+    """
+    wall time and call counts of a build by flowable class, page and pass
+
+    every entry is a list [calls, seconds]::
+
+        byClass[op][class name]
+        byPage[page][op]
+        byPass[pass][op]
+
+    slowest holds the slowest handled flowables as
+    (seconds, class name, page, pass).
+    """
+
+    def __init__(self, slowest=20):
+        self.passes = 0
+        self.byClass = {}
+        self.byPage = {}
+        self.byPass = {}
+        self.slowest = []
+        self._slowestCount = slowest
+
+    def beginPass(self):
+        """
+        start the next pass of a multiBuild
+        """
+        self.passes += 1
+
+    def record(self, op, name, page, seconds=0.):
+        """
+        record one call of op on a flowable class (or template) name
+        """
+        for bucket, key in ((self.byClass.setdefault(op, {}), name),
+                            (self.byPage.setdefault(page, {}), op),
+                            (self.byPass.setdefault(self.passes, {}), op)):
+            entry = bucket.get(key)
+            if entry is None:
+                entry = bucket[key] = [0, 0.]
+            entry[0] += 1
+            entry[1] += seconds
+
+        if op == "handle":
+            item = (seconds, name, page, self.passes)
+            if len(self.slowest) < self._slowestCount:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def call(self, op, name, doc, func, *args, **kwargs):
+        """
+        call func and record its wall time on the page of doc it ends on
+        """
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(op, name, doc.page, perf_counter() - start)
+
+    def timed(self, op, name, doc, func):
+        """
+        returns func recording its wall time, see call
+        """
+        def timedFunc(*args, **kwargs):
+            return self.call(op, name, doc, func, *args, **kwargs)
+        return timedFunc
+
+    def top(self, op="handle", count=10):
+        """
+        returns the (class name, calls, seconds) with the most time in op
+        """
+        items = self.byClass.get(op, {}).items()
+        return sorted(((name, calls, seconds) for name, (calls, seconds) in items),
+                      key=lambda item: item[2], reverse=True)[:count]
+
+    def asDict(self):
+        """
+        returns the stats as a dict, that can be written as JSON
+        """
+        return dict(passes=self.passes,
+                    byClass=self.byClass,
+                    byPage=dict((str(page), ops) for page, ops in self.byPage.items()),
+                    byPass=dict((str(n), ops) for n, ops in self.byPass.items()),
+                    slowest=sorted(self.slowest, reverse=True))
+
+    def dump(self, filename):
+        """
+        write the stats as JSON to filename
+        """
+        with open(filename, "w") as fp:
+            json.dump(self.asDict(), fp, indent=1)
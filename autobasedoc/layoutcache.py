@@ -0,0 +1,423 @@
+"""
+layoutcache
+===========
+
+.. module:: layoutcache
+   :platform: Unix, Windows
+   :synopsis: on-disk cache of wrap and split results
+
+The layout of a flowable only depends on its content and the space it is
+wrapped in. The LayoutCache stores wrap results, split results and measured
+heights in a directory, keyed by a content hash of the flowable and the
+available width and height. It is kept between runs, so documents that are
+rebuilt with mostly the same content skip most of the layout work.
+
+Keys are built for Paragraph and Table flowables and for any object with a
+layoutKey method returning a deterministic description of its layout state.
+Other flowables are not cached.
+
+The size of the cache directory is limited by maxSize, the least recently
+used entries are evicted first.
+
+Sizes and heights are stored as JSON, split results as pickles. Every file
+is signed with a secret key kept outside of the cache directory (by default
+in ~/.autobasedoc), files with a wrong signature are ignored, so writing to
+the cache directory does not allow to run code in the build.
+"""
+import hmac
+import json
+import os
+import pickle
+import tempfile
+import weakref
+from collections import OrderedDict
+from hashlib import sha1, sha256
+
+import reportlab
+from reportlab.lib.colors import Color
+from reportlab.lib.styles import PropertySet
+from reportlab.platypus import Flowable, Paragraph, Table
+
+# bump to invalidate the caches of former versions
+CACHE_VERSION = 2
+
+# default location of the key signing the cache files
+SECRET_PATH = os.path.join(os.path.expanduser("~"), ".autobasedoc", "layoutcache.key")
+
+# Table attributes given by the content, attributes computed by wrap are left out
+_TABLE_ATTRS = ("_cellvalues", "_argW", "_argH", "_cellStyles", "_linecmds",
+                "_bkgrndcmds", "_spanCmds", "_nosplitCmds", "_srflcmds",
+                "_sircmds", "_minRowHeights", "_rowSplitRange",
+                "_longTableOptimize", "_cornerRadii", "repeatRows",
+                "repeatCols", "splitByRow", "splitInRow", "hAlign", "vAlign")
+
+_PRIMITIVES = (str, bytes, bool, int, float)
+# values with a deterministic repr
+_LEAVES = _PRIMITIVES + (type(None), Color)
+
+
+def canonical(obj, keys=None, styles=None):
+    """
+    returns a deterministic text representation of obj
+
+    raises TypeError if obj has none, e.g. an object with the default repr
+
+    :param keys: mapping of flowables to their content hash, it is used and
+        filled for nested flowables (e.g. a WeakKeyDictionary)
+    :param styles: dict of the texts of styles by id, valid while the
+        styles are not changed
+    """
+    if obj is None or isinstance(obj, _PRIMITIVES):
+        return repr(obj)
+    if styles is None:
+        styles = {}
+    if isinstance(obj, Flowable):
+        key = flowableKey(obj, keys, styles)
+        if key is None:
+            raise TypeError("flowable %r has no layout key" % obj.__class__.__name__)
+        return key
+    if isinstance(obj, (list, tuple)):
+        if all(isinstance(o, _LEAVES) for o in obj):
+            return repr(obj)
+        return "[%s]" % ",".join([canonical(o, keys, styles) for o in obj])
+    if isinstance(obj, dict):
+        items = sorted(obj.items(), key=lambda item: str(item[0]))
+        if all(isinstance(v, _LEAVES) for k, v in items):
+            return repr(items)
+        return "{%s}" % ",".join(["%r:%s" % (k, canonical(v, keys, styles))
+                                  for k, v in items])
+    if isinstance(obj, PropertySet):
+        text = styles.get(id(obj))
+        if text is None:
+            text = styles[id(obj)] = canonical(
+                dict((k, v) for k, v in obj.__dict__.items()
+                     if k not in ("name", "parent")), keys, styles)
+        return text
+    text = repr(obj)
+    if " at 0x" in text:
+        raise TypeError("no deterministic representation of %r" % type(obj))
+    return text
+
+
+def flowableKey(flowable, keys=None, styles=None):
+    """
+    returns the content hash of flowable or None if it can not be cached
+
+    :param keys: mapping of flowables to their content hash, see canonical
+    :param styles: dict of the texts of styles by id, see canonical
+    """
+    cached = keys is not None and isinstance(flowable, Flowable)
+    if cached:
+        key = keys.get(flowable)
+        if key is not None:
+            return key
+    layoutKey = getattr(flowable, "layoutKey", None)
+    try:
+        if layoutKey is not None:
+            state = (flowable.__class__.__name__, layoutKey())
+        elif type(flowable) is Paragraph:
+            # wrap rewrites the frags, the text is kept
+            text = flowable.text
+            state = ("Paragraph", flowable.frags if text is None else text,
+                     flowable.style, flowable.bulletText,
+                     flowable.caseSensitive)
+        elif type(flowable) is Table:
+            state = ("Table",) + tuple(getattr(flowable, name, None)
+                                       for name in _TABLE_ATTRS)
+        else:
+            return None
+        key = sha1(canonical(state, keys, styles).encode("utf-8")).hexdigest()
+    except TypeError:
+        return None
+    if cached:
+        keys[flowable] = key
+    return key
+
+
+def loadSecret(path=SECRET_PATH):
+    """
+    returns the key signing the cache files, it is created in path if
+    missing, readable by the user only
+    """
+    try:
+        with open(path, "rb") as fp:
+            return fp.read()
+    except FileNotFoundError:
+        pass
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    secret = os.urandom(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # created by another process in the meantime
+        with open(path, "rb") as fp:
+            return fp.read()
+    with os.fdopen(fd, "wb") as fp:
+        fp.write(secret)
+    return secret
+
+
+def _isPlain(value):
+    """
+    True if value is a number or a list or tuple of numbers, stored as JSON
+    """
+    if isinstance(value, (list, tuple)):
+        return all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _dumps(value):
+    """
+    returns the serialized value, a type byte and the data
+    """
+    if _isPlain(value):
+        return (b"t" if isinstance(value, tuple) else b"j") + json.dumps(value).encode("ascii")
+    return b"p" + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(data):
+    """
+    returns the value of data serialized by _dumps
+    """
+    if data[:1] == b"p":
+        return pickle.loads(data[1:])
+    value = json.loads(data[1:].decode("ascii"))
+    return tuple(value) if data[:1] == b"t" else value
+
+
+class LayoutCache(object):
+    """
+    content-addressed cache of layout results in directory
+
+    :param directory: path of the cache directory, it is created if missing
+    :param maxSize: maximal size of the cache files in bytes
+    :param maxMemory: maximal size of the results kept in memory in bytes,
+        default: maxSize
+    :param secret: key signing the cache files, default: the key in
+        SECRET_PATH, see loadSecret
+    """
+
+    def __init__(self, directory, maxSize=64 * 1024 * 1024, maxMemory=None, secret=None):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.maxMemory = maxSize if maxMemory is None else maxMemory
+        self.secret = loadSecret() if secret is None else secret
+        self.hits = 0
+        self.misses = 0
+        # results read or written in this process, serialized, least
+        # recently used first
+        self._memory = OrderedDict()
+        self._memorySize = 0
+        # content hashes of flowables, split parts get the hash of their split
+        self._keys = weakref.WeakKeyDictionary()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._sizes = {}
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".cache"):
+                self._sizes[entry.name[:-6]] = entry.stat().st_size
+        self._size = sum(self._sizes.values())
+
+    def contentKey(self, obj):
+        """
+        returns the content hash of obj or None if it can not be cached
+
+        the hash of a flowable is computed once and kept, other objects
+        like StyledTable may still change and are hashed every time
+        """
+        return flowableKey(obj, self._keys)
+
+    def key(self, obj, op, availWidth, availHeight):
+        """
+        returns the cache key of op on obj wrapped in the available space,
+        or None if obj can not be cached
+        """
+        content = self.contentKey(obj)
+        if content is None:
+            return None
+        text = "%s|%s|%s|%s|%r|%r" % (CACHE_VERSION, reportlab.Version, content,
+                                      op, availWidth, availHeight)
+        return sha1(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".cache")
+
+    def _sign(self, key, data):
+        return hmac.new(self.secret, key.encode("ascii") + data, sha256).digest()
+
+    def _remember(self, key, data):
+        """
+        keeps the serialized data of key in memory, within maxMemory
+        """
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memorySize -= len(old)
+        self._memory[key] = data
+        self._memorySize += len(data)
+        while self._memorySize > self.maxMemory and self._memory:
+            self._memorySize -= len(self._memory.popitem(last=False)[1])
+
+    def _read(self, key):
+        """
+        returns the serialized data of the file of key, None if it is
+        missing or not signed with the secret
+        """
+        try:
+            with open(self._path(key), "rb") as fp:
+                signed = fp.read()
+            os.utime(self._path(key))
+        except OSError:
+            return None
+        signature, data = signed[:32], signed[32:]
+        if not hmac.compare_digest(signature, self._sign(key, data)):
+            return None
+        return data
+
+    def get(self, key):
+        """
+        returns the cached value of key or None
+        """
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+        elif key in self._sizes:
+            data = self._read(key)
+            if data is not None:
+                self._remember(key, data)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _loads(data)
+
+    def put(self, key, value):
+        """
+        stores value under key, values that can not be pickled are skipped
+        """
+        try:
+            data = _dumps(value)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        self._remember(key, data)
+
+        data = self._sign(key, data) + data
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, self._path(key))
+        self._size += len(data) - self._sizes.get(key, 0)
+        self._sizes[key] = len(data)
+        if self._size > self.maxSize:
+            self.evict()
+
+    def evict(self, ratio=0.8):
+        """
+        removes the least recently used entries until the cache is
+        below ratio * maxSize
+        """
+        entries = []
+        for key in self._sizes:
+            try:
+                entries.append((os.stat(self._path(key)).st_mtime, key))
+            except OSError:
+                entries.append((0, key))
+        entries.sort()
+        for mtime, key in entries:
+            if self._size <= self.maxSize * ratio:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._size -= self._sizes.pop(key)
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memorySize -= len(data)
+
+    def clear(self):
+        """
+        removes all entries
+        """
+        for key in list(self._sizes):
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+        self._sizes.clear()
+        self._memory.clear()
+        self._memorySize = 0
+        self._size = 0
+
+    def measure(self, obj, availWidth, availHeight, func, op="height"):
+        """
+        returns the cached height of obj or the result of func
+
+        :param op: name of the measured value, e.g. "rowHeights"
+        """
+        key = self.key(obj, op, availWidth, availHeight)
+        height = None if key is None else self.get(key)
+        if height is None:
+            height = func()
+            if key is not None:
+                self.put(key, height)
+        return height
+
+    def install(self, flowable, draw=True):
+        """
+        shadows wrap and split of flowable with cached versions
+
+        A cached wrap only returns the size. If the flowable is drawn the
+        real wrap is done right before drawOn, flowables that do not fit are
+        never wrapped. With draw=False drawOn is not touched.
+
+        Returns the names of the shadowed methods, the instance attributes
+        have to be removed again by the caller.
+        """
+        if self.contentKey(flowable) is None:
+            return ()
+
+        wrap, split, drawOn = flowable.wrap, flowable.split, flowable.drawOn
+        pending = []
+
+        def cachedWrap(availWidth, availHeight):
+            key = self.key(flowable, "wrap", availWidth, availHeight)
+            size = self.get(key)
+            if size is None:
+                size = wrap(availWidth, availHeight)
+                self.put(key, tuple(size))
+                del pending[:]
+            else:
+                pending[:] = [(availWidth, availHeight)]
+            return size
+
+        def cachedSplit(availWidth, availHeight):
+            key = self.key(flowable, "split", availWidth, availHeight)
+            parts = self.get(key)
+            if parts is None:
+                # split may wrap the flowable itself and needs the real wrap
+                flowable.wrap = wrap
+                try:
+                    parts = split(availWidth, availHeight)
+                finally:
+                    flowable.wrap = cachedWrap
+                self.put(key, parts)
+            # the content of the parts is given by the split key
+            for i, part in enumerate(parts):
+                if isinstance(part, Flowable):
+                    self._keys[part] = sha1(("%s|%d" % (key, i)).encode("utf-8")).hexdigest()
+            return parts
+
+        def lazyDrawOn(*args, **kwargs):
+            if pending:
+                wrap(*pending.pop())
+            return drawOn(*args, **kwargs)
+
+        flowable.wrap = cachedWrap
+        flowable.split = cachedSplit
+        if not draw:
+            return ("wrap", "split")
+        flowable.drawOn = lazyDrawOn
+        return ("wrap", "split", "drawOn")
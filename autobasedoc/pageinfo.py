@@ -26,6 +26,17 @@ def addPlugin(canv, doc, frame=None, talkative=False):
     If you don't want to decorate your Later pages,
     please define an empty pageTemplate with frame='Later'
 
+    """
+    stats = getattr(doc, "buildStats", None)
+    if stats is not None and frame is not None:
+        return stats.call("addPlugin", getattr(doc, "template_id", None), doc,
+                          _addPlugin, canv, doc, frame=frame, talkative=talkative)
+    return _addPlugin(canv, doc, frame=frame, talkative=talkative)
+
+
+def _addPlugin(canv, doc, frame=None, talkative=False):
+    """
+    places the page info items of doc on the canvas, see addPlugin
     """
     _left_margin = False
     _right_margin = False
@@ -237,7 +248,7 @@ def addPlugin(canv, doc, frame=None, talkative=False):
                     break
 
         if len(lkeys) == 0:
-            addPlugin(canv, doc, frame=None)
+            _addPlugin(canv, doc, frame=None)
     else:
         pass
         #print("going through the pageInfo items:",lkeys)
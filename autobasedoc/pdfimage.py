@@ -19,13 +19,16 @@ SVG images can currently only be returned as a Drawing::
     reportlab.lib.utils.ImageReader
 
 """
+import os
+from collections import OrderedDict
 from io import BytesIO, open
+from hashlib import sha1
 
 from reportlab.platypus import Image, Flowable
 from reportlab.lib.units import inch,cm,mm
 
 from pdfrw import PdfReader,PdfDict #,PdfFileWriter
-from pdfrw.buildxobj import pagexobj
+from pdfrw.buildxobj import pagexobj, getrects, get_rotation, ViewInfo
 from pdfrw.toreportlab import makerl
 
 from reportlab.pdfgen import canvas
@@ -56,6 +59,174 @@ def form_xo_reader(imgdata: BytesIO):
     page, = PdfReader(imgdata).pages
     return pagexobj(page)
 
+def contentDigest(xobj):
+    """Hash the content of a form XObject.
+
+    The hash covers the content stream and everything it references (fonts,
+    images, ...), but not the document info of the file, so figures saved
+    twice with different creation dates get the same hash.
+
+    Parameters
+    ----------
+    xobj : pdfrw.PdfDict
+        Form XObject, e.g. from :func:`form_xo_reader`.
+
+    Returns
+    -------
+    str
+        Hex digest of the content, it is kept on ``xobj``.
+    """
+    known = vars(xobj).get("contentDigest")
+    if known is not None:
+        return known
+    digests = {}
+
+    def digest(obj):
+        key = id(obj)
+        known = digests.get(key)
+        if known is not None:
+            return known
+        # references back to an object being hashed
+        digests[key] = b"cycle"
+        h = sha1()
+        if isinstance(obj, PdfDict):
+            h.update(b"<<")
+            for name, value in sorted(obj.iteritems()):
+                h.update(name.encode("latin-1"))
+                h.update(digest(value))
+            if obj.stream is not None:
+                h.update(b"stream")
+                h.update(obj.stream.encode("latin-1"))
+        elif isinstance(obj, list):
+            h.update(b"[")
+            for value in obj:
+                h.update(digest(value))
+        else:
+            h.update(str(obj).encode("utf-8", "surrogateescape"))
+        digests[key] = h.digest()
+        return digests[key]
+
+    known = xobj.private.contentDigest = digest(xobj).hex()
+    return known
+
+def documentForms(canv):
+    """Return the registry of forms of the document of ``canv``, a dict of
+    form names by content digest."""
+    rldoc = getattr(canv, "_doc", canv)
+    return rldoc.__dict__.setdefault("_pdfForms", {})
+
+def registerForm(canv, xobj, digest=None):
+    """Return the name of the form XObject ``xobj`` in the document of ``canv``.
+
+    Every document keeps a registry of its forms by content digest, images
+    with the same digest are written once and referenced everywhere else.
+
+    Parameters
+    ----------
+    canv : reportlab.pdfgen.canvas.Canvas
+        Canvas the form is drawn on.
+    xobj : pdfrw.PdfDict
+        Form XObject.
+    digest : str, optional
+        Content hash of ``xobj``, default: :func:`contentDigest` of it.
+
+    Returns
+    -------
+    str
+        Name of the form for ``canv.doForm``.
+    """
+    if digest is None:
+        digest = contentDigest(xobj)
+    forms = documentForms(canv)
+    name = forms.get(digest)
+    if name is None:
+        name = forms[digest] = makerl(canv, xobj)
+        # the registry holds the form, the (possibly cached) xobj must not
+        # keep the document alive
+        releaseDocument(xobj, getattr(canv, "_doc", canv))
+    return name
+
+def releaseDocument(xobj, rldoc):
+    """Remove the reportlab objects of the document ``rldoc`` that ``makerl``
+    keeps on ``xobj`` and on the objects it references."""
+    seen = set()
+    todo = [xobj]
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen or not isinstance(obj, (PdfDict, list)):
+            continue
+        seen.add(id(obj))
+        derived = vars(obj).get("derived_rl_obj")
+        if derived is not None:
+            derived.pop(rldoc, None)
+        if isinstance(obj, PdfDict):
+            todo.extend(value for name, value in obj.iteritems())
+        else:
+            todo.extend(obj)
+
+class PdfCache(object):
+    """
+    process-wide LRU cache of parsed pdf pages
+
+    Files are keyed by their path, modification time and size, buffers by a
+    digest of their bytes. Images of the same source share the parsed page
+    and its form XObject, which must not be changed.
+
+    :param maxSize: maximal size of the cached sources in bytes
+    """
+
+    def __init__(self, maxSize=64 * 1024 * 1024):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        # (page, xobj, size) by source key, least recently used first
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, source):
+        """
+        returns (page, xobj) of the first page of source, a path or a
+        file-like object
+        """
+        if hasattr(source, 'read'):
+            source.seek(0)
+            data = source.read()
+            key = ("data", sha1(data).hexdigest())
+            size = len(data)
+        else:
+            stat = os.stat(source)
+            key = ("path", os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+            data, size = None, stat.st_size
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[:2]
+        self.misses += 1
+        if data is None:
+            page = PdfReader(fname=source, decompress=False).pages[0]
+        else:
+            page = PdfReader(fdata=data, decompress=False).pages[0]
+        entry = self._entries[key] = (page, pagexobj(page), size)
+        self._size += size
+        while self._size > self.maxSize and self._entries:
+            self._size -= self._entries.popitem(last=False)[1][2]
+        return entry[:2]
+
+    def clear(self):
+        """
+        removes all entries, the counters are kept
+        """
+        self._entries.clear()
+        self._size = 0
+
+# parsed pages shared by all PdfImage and PdfAsset objects
+pdfCache = PdfCache()
+
 def getSvg(path: str):
     """Load an SVG file into a ReportLab :class:`~reportlab.graphics.shapes.Drawing`."""
     return svg2rlg(path)
@@ -98,16 +269,18 @@ class PdfImage(Flowable):
     """
 
     def __init__(self, filename_or_object, width=None, height=None, kind='direct'):
-        # If using StringIO buffer, set pointer to begining
-        if hasattr(filename_or_object, 'read'):
-            filename_or_object.seek(0)
-            #print("read")
-        self.page = PdfReader(filename_or_object, decompress=False).pages[0]
-        self.xobj = pagexobj(self.page)
+        # buffers are read from the begining
+        self.page, self.xobj = pdfCache.load(filename_or_object)
+        self._digest = None
+        self._setSize(self.xobj.BBox, width, height, kind)
 
+    def _setSize(self, bbox, width, height, kind):
+        """
+        sets the draw size from the bounding box of the page
+        """
+        self._bbox = x1, y1, x2, y2 = [float(v) for v in bbox]
         self.imageWidth = width
         self.imageHeight = height
-        x1, y1, x2, y2 = self.xobj.BBox
 
         self._w, self._h = x2 - x1, y2 - y1
         if not self.imageWidth:
@@ -123,6 +296,16 @@ class PdfImage(Flowable):
             self.drawWidth = self._w*factor
             self.drawHeight = self._h*factor
 
+    @property
+    def digest(self):
+        """
+        content hash of the image, identical images are embedded once
+        per document
+        """
+        if self._digest is None:
+            self._digest = contentDigest(self.xobj)
+        return self._digest
+
     def wrap(self, availableWidth, availableHeight):
         """
         returns draw- width and height
@@ -132,6 +315,12 @@ class PdfImage(Flowable):
         """
         return self.drawWidth, self.drawHeight
 
+    def _formName(self, canv):
+        """
+        returns the name of the form of the image in the document of canv
+        """
+        return registerForm(canv, self.xobj, self.digest)
+
     def drawOn(self, canv, x, y, _sW=0):
         """
         translates Bounding Box and scales the given canvas
@@ -145,14 +334,13 @@ class PdfImage(Flowable):
             elif a not in ('LEFT', TA_LEFT):
                 raise ValueError("Bad hAlign value " + str(a))
 
-        #xobj_name = makerl(canv._doc, self.xobj)
-        xobj_name = makerl(canv, self.xobj)
+        xobj_name = self._formName(canv)
 
         xscale = self.drawWidth/self._w
         yscale = self.drawHeight/self._h
 
-        x -= self.xobj.BBox[0] * xscale
-        y -= self.xobj.BBox[1] * yscale
+        x -= self._bbox[0] * xscale
+        y -= self._bbox[1] * yscale
 
         canv.saveState()
         canv.translate(x, y)
@@ -160,6 +348,77 @@ class PdfImage(Flowable):
         canv.doForm(xobj_name)
         canv.restoreState()
 
+class LazyPdfImage(PdfImage):
+    """
+    PdfImage that parses its page only when it is drawn
+
+    Only the bounding box of the page is read on construction: the source is
+    opened with PdfReader, but pdfrw resolves its objects lazily, so only the
+    cross-reference table, the page tree and the page dictionary are read, not
+    the content streams or resources. The whole page is parsed when the image
+    is drawn into a document for the first time and released again as soon
+    as its form is written, only the source (the path or the bytes of the
+    buffer) and the content digest are kept. Later draws into the same
+    document reuse the form without parsing::
+
+        story = [LazyPdfImage(buf) for buf in figureBuffers]
+
+    """
+
+    def __init__(self, filename_or_object, width=None, height=None, kind='direct'):
+        if hasattr(filename_or_object, 'read'):
+            filename_or_object.seek(0)
+            self.source = filename_or_object.read()
+        else:
+            self.source = filename_or_object
+        inheritable = self._parse().inheritable
+        mbox, bbox = getrects(inheritable, ViewInfo(), get_rotation(inheritable.Rotate))
+        self._digest = None
+        self._setSize(bbox, width, height, kind)
+
+    def _parse(self):
+        """
+        returns the parsed first page of the source
+        """
+        if isinstance(self.source, bytes):
+            return PdfReader(fdata=self.source, decompress=False).pages[0]
+        return PdfReader(fname=self.source, decompress=False).pages[0]
+
+    @property
+    def page(self):
+        """
+        the first page of the source, parsed again on every use
+        """
+        return self._parse()
+
+    @property
+    def xobj(self):
+        """
+        the form XObject of the page, built again on every use
+        """
+        return pagexobj(self._parse())
+
+    @property
+    def digest(self):
+        """
+        content hash of the image, the page is parsed for it once
+        """
+        if self._digest is None:
+            self._digest = contentDigest(self.xobj)
+        return self._digest
+
+    def _formName(self, canv):
+        """
+        returns the name of the form of the image in the document of canv,
+        the page is only parsed if the document does not have it yet
+        """
+        name = documentForms(canv).get(self._digest)
+        if name is None:
+            xobj = self.xobj
+            self._digest = contentDigest(xobj)
+            name = registerForm(canv, xobj, self._digest)
+        return name
+
 class PdfAsset(Flowable):
     """
     read in the first page of a PDF file from file
@@ -168,8 +427,8 @@ class PdfAsset(Flowable):
     """
     def __init__(self, fname, width=None, height=None, kind='direct'):
 
-        self.page = PdfReader(fname=fname, decompress=False).pages[0]
-        self.xobj = pagexobj(self.page)
+        self.page, self.xobj = pdfCache.load(fname)
+        self._digest = None
 
         self.imageWidth = width
         self.imageHeight = height
@@ -191,6 +450,16 @@ class PdfAsset(Flowable):
         self.width = self.drawWidth
         self.height = self.drawHeight
 
+    @property
+    def digest(self):
+        """
+        content hash of the asset, identical assets are embedded once
+        per document
+        """
+        if self._digest is None and isinstance(self.xobj, PdfDict):
+            self._digest = contentDigest(self.xobj)
+        return self._digest
+
     def wrap(self, width, height):
         return self.imageWidth, self.imageHeight
 
@@ -210,7 +479,7 @@ class PdfAsset(Flowable):
             yscale = self.imageHeight / img.BBox[3]
             canv.translate(x, y)
             canv.scale(xscale, yscale)
-            canv.doForm(makerl(canv, img))
+            canv.doForm(registerForm(canv, img, self.digest))
         else:
             #canv.drawInlineImage(img, x, y-self.imageHeight, self.imageWidth, self.imageHeight)
             canv.drawImage(img, x, y, self.imageWidth, self.imageHeight)
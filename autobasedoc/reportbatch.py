@@ -0,0 +1,183 @@
+"""
+reportbatch
+===========
+
+.. module:: reportbatch
+   :platform: Unix, Windows
+   :synopsis: render many documents of one kind with warmed resources
+
+Many small documents built from the same template spend most of their time
+in the setup: importing, registering fonts, building styles and parsing
+shared images like logos. A ReportBatch does the setup once in the warm
+function and then renders the documents on a process pool, the workers are
+forked after the warm-up and inherit the warm state::
+
+    def warm():
+        setFonts('sans-serif-afm')
+        styles = Styles()
+        styles.registerStyles()
+        return dict(styles=styles, logo=PdfImage("logo.pdf"))
+
+    def makeStory(doc, data, resources):
+        doc.addPageInfo(typ="header", pos="l", image=resources["logo"])
+        return [Paragraph(data["name"], resources["styles"].normal)]
+
+    with ReportBatch(makeStory, warm=warm,
+                     docKwds=dict(onFirstPage=(drawFirstPortrait, 0),
+                                  onLaterPages=(drawLaterPortrait, 0))) as batch:
+        report = batch.run((customer.pdfName, customer.data)
+                           for customer in customers)
+    print(report.throughput, report.latency(0.95))
+
+On platforms without fork the documents are rendered one after another in
+the calling process.
+"""
+import multiprocessing
+from time import perf_counter
+
+from autobasedoc.autorpt import AutoDocTemplate
+
+# the running batch, inherited by forked workers
+_batch = None
+
+
+def renderJob(job):
+    """
+    worker function, renders one job of the running batch
+    """
+    return _batch.render(job)
+
+
+class BatchReport(object):
+    """
+    per-document latency and throughput of a batch run
+
+    documents holds (filename, seconds, pages, error) in the order of the
+    jobs, error is None for documents that were rendered.
+    """
+
+    def __init__(self, documents, seconds):
+        self.documents = documents
+        self.seconds = seconds
+
+    @property
+    def failed(self):
+        """
+        the documents that raised an error
+        """
+        return [d for d in self.documents if d[3] is not None]
+
+    @property
+    def throughput(self):
+        """
+        documents per second of the whole run
+        """
+        if not self.seconds:
+            return 0.
+        return len(self.documents) / self.seconds
+
+    def latency(self, quantile=0.5):
+        """
+        returns the render time of a document at quantile, e.g. 0.95
+        """
+        seconds = sorted(d[1] for d in self.documents)
+        if not seconds:
+            return 0.
+        return seconds[min(int(quantile * len(seconds)), len(seconds) - 1)]
+
+
+class ReportBatch(object):
+    """
+    renders documents of the same kind with resources warmed once
+
+    :param makeStory: function(doc, data, resources) returning the story of
+        one document, it may also add page infos to doc
+    :param warm: function returning the shared resources (styles, images,
+        ...), it is called once before the workers are forked. Fonts
+        registered here are known in the workers.
+    :param docKwds: keyword arguments of AutoDocTemplate
+    :param processes: number of worker processes, default: cpu count
+    :param multiBuild: build the documents with multiBuild, for documents
+        with a table of contents
+    """
+
+    def __init__(self, makeStory, warm=None, docKwds=None, processes=None,
+                 multiBuild=False):
+        self.makeStory = makeStory
+        self.warm = warm
+        self.docKwds = docKwds or {}
+        self.processes = processes
+        self.multiBuild = multiBuild
+        self.resources = None
+        self._pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def warmUp(self):
+        """
+        creates the shared resources, if not done before
+        """
+        if self.resources is None:
+            self.resources = self.warm() if self.warm is not None else {}
+        return self.resources
+
+    def start(self):
+        """
+        warms up and forks the worker processes
+        """
+        global _batch
+        self.warmUp()
+        if (self._pool is None and self.processes != 1
+                and "fork" in multiprocessing.get_all_start_methods()):
+            _batch = self
+            self._pool = multiprocessing.get_context("fork").Pool(self.processes)
+
+    def close(self):
+        """
+        stops the worker processes
+        """
+        global _batch
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            _batch = None
+
+    def render(self, job):
+        """
+        renders one job (filename, data), returns (filename, seconds, pages, error)
+        """
+        filename, data = job
+        start = perf_counter()
+        try:
+            doc = AutoDocTemplate(filename, **self.docKwds)
+            story = self.makeStory(doc, data, self.resources)
+            if self.multiBuild:
+                doc.multiBuild(story)
+            else:
+                doc.build(story)
+        except Exception as err:
+            return filename, perf_counter() - start, 0, "%s: %s" % (err.__class__.__name__, err)
+        return filename, perf_counter() - start, doc.page, None
+
+    def run(self, jobs, chunksize=4):
+        """
+        renders the jobs, an iterable of (filename, data)
+
+        filename has to be a path, documents rendered in worker processes
+        can not be returned in file-like objects.
+
+        Returns a BatchReport
+        """
+        self.start()
+        start = perf_counter()
+        if self._pool is not None:
+            documents = list(self._pool.imap(renderJob, jobs, chunksize))
+        else:
+            documents = [self.render(job) for job in jobs]
+        return BatchReport(documents, perf_counter() - start)
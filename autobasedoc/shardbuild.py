@@ -0,0 +1,207 @@
+"""
+shardbuild
+==========
+
+.. module:: shardbuild
+   :platform: Unix, Windows
+   :synopsis: build one document in shards on a process pool and merge them
+
+The story is cut into shards behind PageBreak flowables. Every shard is built
+as a document of its own (in worker processes where the platform can fork)
+and the page streams are merged with pdfrw into one PDF.
+
+Across the shards the following is fixed up:
+
+- page numbers, every shard starts with the page offset of the shards before
+- the page template the shard starts with
+- TOCEntry notifications, they are collected from all shards and fed into
+  the table of contents of the shard that holds it
+- Bookmark outline entries and links to bookmarks of other shards
+
+On platforms without fork the shards are built one after another.
+"""
+import multiprocessing
+from io import BytesIO
+
+from pdfrw import PdfReader, PdfWriter, PdfArray, PdfName, PdfObject, PdfString
+from pdfrw.objects import IndirectPdfDict
+
+from reportlab.lib.rl_accel import fp_str
+from reportlab.platypus import PageBreak
+from reportlab.platypus.doctemplate import NextPageTemplate
+
+# (doc, parts) of the running sharded build, inherited by forked workers
+_shardJob = None
+
+
+def splitStory(story, count):
+    """
+    returns (start, stop) index pairs of at most count shards
+
+    the story is only cut behind PageBreak flowables, the shards are
+    balanced by the number of flowables.
+    """
+    cuts = [i + 1 for i, f in enumerate(story) if isinstance(f, PageBreak)]
+    target = len(story) / float(max(count, 1))
+
+    bounds = []
+    start = 0
+    for cut in cuts:
+        if cut >= len(story):
+            break
+        if cut - start >= target and len(bounds) < count - 1:
+            bounds.append((start, cut))
+            start = cut
+    bounds.append((start, len(story)))
+    return bounds
+
+
+def shardTemplate(flowables):
+    """
+    returns the page template requested for the page behind flowables,
+    or None if the default template follows
+    """
+    for i, f in enumerate(reversed(flowables)):
+        if i > 0 and isinstance(f, PageBreak):
+            break
+        npt = getattr(f, "nextTemplate", None)
+        if isinstance(f, NextPageTemplate):
+            npt = f.action[1]
+        if npt:
+            return npt
+
+
+def buildShard(job):
+    """
+    worker function, builds the shard job["shard"] of the running job
+    """
+    doc, parts = _shardJob
+    start, stop = parts[job["shard"]]
+    return doc.buildShard(doc.shardStory[start:stop],
+                          offset=job["offset"],
+                          template=job["template"],
+                          entries=job["entries"],
+                          foreign=job["foreign"])
+
+
+def runShards(doc, parts, jobs, processes=None):
+    """
+    build the shard jobs on a process pool
+
+    returns the results in the order of jobs
+    """
+    global _shardJob
+    _shardJob = doc, parts
+    try:
+        if (processes != 1 and len(jobs) > 1
+                and "fork" in multiprocessing.get_all_start_methods()):
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                return pool.map(buildShard, jobs)
+        return [buildShard(job) for job in jobs]
+    finally:
+        _shardJob = None
+
+
+def pdfNumber(value):
+    """
+    returns value as pdfrw object, formatted like reportlab does
+    """
+    if isinstance(value, str):
+        return PdfObject(value)
+    return PdfObject(fp_str(value))
+
+
+def isPlaceholder(dest):
+    """
+    True if dest is the placeholder of a bookmark in another shard
+    """
+    try:
+        return dest[1] == PdfName.XYZ and float(dest[2]) == -1
+    except (TypeError, IndexError, ValueError):
+        return False
+
+
+def outlineTree(bookmarks, dests):
+    """
+    returns the pdfrw outline dictionary of bookmarks
+
+    :param bookmarks: list of (key, title, level) in document order
+    :param dests: destination arrays by bookmark key
+    """
+    root = IndirectPdfDict(Type=PdfName.Outlines)
+    stack = [(root, -1)]
+    children = {}
+
+    for key, title, level in bookmarks:
+        while stack[-1][1] >= level:
+            stack.pop()
+        parent = stack[-1][0]
+        item = IndirectPdfDict(Title=PdfString.encode(title),
+                               Parent=parent,
+                               Dest=dests[key])
+        if parent.Last is not None:
+            parent.Last.Next = item
+            item.Prev = parent.Last
+        else:
+            parent.First = item
+        parent.Last = item
+        children[id(parent)] = children.get(id(parent), 0) + 1
+        stack.append((item, level))
+
+    # bookmarks are closed, only the top level entries are visible
+    root.Count = children.get(id(root), 0)
+    item = root.First
+    todo = [item] if item is not None else []
+    while todo:
+        item = todo.pop()
+        if item.First is not None:
+            item.Count = -children[id(item)]
+            todo.append(item.First)
+        if item.Next is not None:
+            todo.append(item.Next)
+
+    return root
+
+
+def mergeShards(results, filename, info=None):
+    """
+    merge the PDF streams of the shard results into filename
+
+    :param results: shard results in document order, see AutoDocTemplate.buildShard
+    :param filename: path or file-like object
+    :param info: dict of document info entries (Title, Author, ...)
+    """
+    writer = PdfWriter()
+    ranges = []
+    for result in results:
+        pages = PdfReader(BytesIO(result["pdf"])).pages
+        ranges.append((len(writer.pagearray), len(writer.pagearray) + len(pages)))
+        writer.addpages(pages)
+    pages = writer.pagearray
+
+    dests = {}
+    bookmarks = []
+    for result in results:
+        for key, title, level, page, left, top in result["bookmarks"]:
+            dests[key] = PdfArray([pages[page - 1], PdfName.XYZ,
+                                   pdfNumber(left), pdfNumber(top), 0])
+            bookmarks.append((key, title, level))
+
+    # point the links to bookmarks of other shards to their real destination
+    for (first, last), result in zip(ranges, results):
+        foreign = result["foreign"]
+        for page in pages[first:last]:
+            for annot in page.Annots or []:
+                if isPlaceholder(annot.Dest):
+                    annot.Dest = dests[foreign[int(float(annot.Dest[3]))]]
+
+    trailer = writer.trailer
+    if bookmarks:
+        trailer.Root.Outlines = outlineTree(bookmarks, dests)
+        trailer.Root.PageMode = PdfName.UseOutlines
+    if info:
+        trailer.Info = IndirectPdfDict(**dict(
+            (k, PdfString.encode(v)) for k, v in info.items() if v))
+
+    writer.write(filename, trailer=trailer)
+    return len(pages)
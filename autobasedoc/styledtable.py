@@ -8,15 +8,425 @@ styledtable
 
 .. moduleauthor:: Oliver Braun
 """
-import random
 import string
 import copy
+import re
+import numpy as np
+from hashlib import sha1
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate, count, zip_longest
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.platypus import TableStyle, Table, Flowable
+from reportlab.platypus.tables import LINECAPS, LINEJOINS, _baseFontName
 from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER, TA_RIGHT
 from reportlab.lib.units import inch, cm, mm
 from autobasedoc import base_fonts, color_dict, colors
 from collections import OrderedDict, defaultdict
 from autobasedoc.fonts import getFont
+from autobasedoc.layoutcache import _TABLE_ATTRS
+
+@lru_cache(maxsize=65536)
+def textWidth(text, fontName, fontSize):
+    """
+    Returns the width of text in points, the widths are cached per
+    (text, font, size).
+    """
+    return stringWidth(text, fontName, fontSize)
+
+
+@lru_cache(maxsize=64)
+def _asciiAdvances(fontName):
+    """
+    Returns the advances of the ASCII characters of the font in 1/1000 of
+    the font size.
+    """
+    return np.array([round(stringWidth(chr(c), fontName, 1000), 6) for c in range(128)])
+
+
+def _isAscii(text):
+    """
+    Returns True if text only holds ASCII characters (str.isascii of
+    Python 3.7).
+    """
+    return not text or max(text) < "\x80"
+
+
+def textWidths(texts, fontName, fontSize):
+    """
+    Returns the widths of texts in points.
+
+    The widths of ASCII texts are summed up from the advances of their
+    characters all at once, the other texts are measured one by one.
+    """
+    isAscii = np.fromiter(map(_isAscii, texts), dtype=bool, count=len(texts))
+    widths = np.zeros(len(texts))
+    for i in np.flatnonzero(~isAscii):
+        widths[i] = textWidth(texts[i], fontName, fontSize)
+    ascii = texts if isAscii.all() else [t for t, a in zip(texts, isAscii) if a]
+    lengths = np.fromiter(map(len, ascii), dtype=np.int64, count=len(ascii))
+    codes = np.frombuffer("".join(ascii).encode("ascii"), dtype=np.uint8)
+    if len(codes):
+        # empty texts have the width 0, reduceat sums up the others
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        nonEmpty = lengths > 0
+        sums = np.zeros(len(ascii))
+        sums[nonEmpty] = np.add.reduceat(_asciiAdvances(fontName)[codes], starts[nonEmpty])
+        widths[isAscii] = sums * 0.001 * fontSize
+    return widths
+
+
+def longestLine(text):
+    """
+    Returns the line of text with the most characters, the last one of
+    equally long lines.
+    """
+    if "\n" not in text:
+        return text
+    return sorted(text.split("\n"), key=len)[-1]
+
+
+# style commands overriding each other, or drawn over each other, if their
+# cells overlap; the order of commands of different groups does not matter
+_STYLE_GROUPS = {
+    "FONT": "font", "FONTNAME": "font", "FACE": "font", "FONTSIZE": "font",
+    "SIZE": "font", "LEADING": "font", "TEXTCOLOR": "textcolor",
+    "ALIGN": "align", "HALIGN": "align", "VALIGN": "valign",
+    "LEFTPADDING": "leftpadding", "RIGHTPADDING": "rightpadding",
+    "TOPPADDING": "toppadding", "BOTTOMPADDING": "bottompadding",
+    "BACKGROUND": "background", "ROWBACKGROUNDS": "background",
+    "COLBACKGROUNDS": "background",
+    "GRID": "line", "BOX": "line", "OUTLINE": "line", "INNERGRID": "line",
+    "LINEBELOW": "line", "LINEABOVE": "line", "LINEBEFORE": "line",
+    "LINEAFTER": "line"}
+
+# commands that do the same on two adjacent ranges as on their union
+_MERGEABLE = frozenset(op for op in _STYLE_GROUPS
+                       if op not in ("ROWBACKGROUNDS", "COLBACKGROUNDS",
+                                     "BOX", "OUTLINE", "INNERGRID"))
+_LINES = frozenset(("GRID", "LINEBELOW", "LINEABOVE", "LINEBEFORE", "LINEAFTER"))
+
+# cell alignments drawn by DirectTable
+_DIRECT_ALIGNMENTS = {"LEFT": 0, "RIGHT": 1, "CENTRE": 2, "CENTER": 2}
+_DIRECT_VALIGNMENTS = {"BOTTOM": 0, "TOP": 1, "MIDDLE": 2}
+
+
+def compileStyleCommands(commands, rows=None, cols=None):
+    """
+    Returns the table style commands in a short form with the same result.
+
+    - repeated commands are removed, the last one is kept
+    - commands that only differ in adjacent rows or columns are merged
+      into one range, e.g. the LINEBELOW of every row
+    - BACKGROUND commands of adjacent single rows with different colors
+      become ROWBACKGROUNDS with the shortest cycle of colors
+
+    A command is only merged into an earlier one if no command of the same
+    kind (e.g. FONT and FONTSIZE) between them touches its cells. Commands
+    with negative indices are kept as they are.
+
+    :param commands: the style commands in the order they are applied
+    :param rows: number of rows, used for commands with negative indices
+    :param cols: number of columns, used for commands with negative indices
+    """
+    def hashable(value):
+        try:
+            hash(value)
+        except TypeError:
+            return repr(value)
+        return value
+
+    # the last occurrence of repeated commands
+    seen = set()
+    unique = []
+    for cmd in reversed(commands):
+        if cmd:
+            key = hashable(cmd)
+            if key not in seen:
+                seen.add(key)
+                unique.append(cmd)
+    unique.reverse()
+
+    def cells(cmd):
+        """
+        the cells (c0, r0, c1, r1) of cmd or None if unknown
+        """
+        try:
+            (c0, r0), (c1, r1) = cmd[1], cmd[2]
+        except (TypeError, ValueError, IndexError):
+            return None
+        if min(c0, c1) < 0:
+            if cols is None:
+                return None
+            c0, c1 = c0 % cols if c0 < 0 else c0, c1 % cols if c1 < 0 else c1
+        if min(r0, r1) < 0:
+            if rows is None:
+                return None
+            r0, r1 = r0 % rows if r0 < 0 else r0, r1 % rows if r1 < 0 else r1
+        return min(c0, c1), min(r0, r1), max(c0, c1), max(r0, r1)
+
+    out = []
+    # (op, args, c0, r0, c1, r1) of the commands in out as given, None if
+    # the command is not mergeable
+    shapes = []
+    groups = defaultdict(list)
+    # indices in out by the range they can be extended in
+    byCols, byRows, byBackground = {}, {}, {}
+    cycles = {}
+
+    def conflicts(k, group, area):
+        for j in groups[group][bisect_right(groups[group], k):]:
+            other = cells(out[j])
+            if other is None or (other[0] <= area[2] and area[0] <= other[2]
+                                 and other[1] <= area[3] and area[1] <= other[3]):
+                return True
+        return False
+
+    for cmd in unique:
+        op = cmd[0]
+        group = _STYLE_GROUPS.get(op, op)
+        args = cmd[3:]
+        area = cells(cmd) if op in _MERGEABLE else None
+        if area is None or op in _LINES and len(args) > 3 and args[3]:
+            groups[group].append(len(out))
+            out.append(cmd)
+            shapes.append(None)
+            continue
+        key = hashable(args)
+        (c0, r0), (c1, r1) = cmd[1], cmd[2]
+
+        # extend the rows of a command on the same columns
+        k = byCols.get((op, key, c0, c1)) if 0 <= r0 <= r1 else None
+        if (k is not None and shapes[k][:3] == (op, key, c0) and shapes[k][4] == c1
+                and shapes[k][5] + 1 == r0 and not conflicts(k, group, area)):
+            shapes[k] = (op, key, c0, shapes[k][3], c1, r1)
+        else:
+            # extend the columns of a command on the same rows
+            k = byRows.get((op, key, r0, r1)) if 0 <= c0 <= c1 else None
+            if (k is not None and shapes[k][:2] == (op, key) and shapes[k][3] == r0
+                    and shapes[k][5] == r1 and shapes[k][4] + 1 == c0
+                    and not conflicts(k, group, area)):
+                shapes[k] = (op, key, shapes[k][2], r0, c1, r1)
+            else:
+                # a new color of the next row
+                k = (byBackground.get((c0, c1)) if op == "BACKGROUND" and 0 <= r0 == r1
+                     and len(args) == 1 and not isinstance(args[0], (list, tuple)) else None)
+                if (k is not None and shapes[k][2] == c0 and shapes[k][4] == c1
+                        and (k in cycles or shapes[k][0] == "BACKGROUND"
+                             and shapes[k][3] == shapes[k][5])
+                        and shapes[k][5] + 1 == r0 and not conflicts(k, group, area)):
+                    if k not in cycles:
+                        cycles[k] = [out[k][3]]
+                    cycles[k].append(args[0])
+                    shapes[k] = ("ROWBACKGROUNDS", None, c0, shapes[k][3], c1, r1)
+                else:
+                    k = None
+        if k is None:
+            k = len(out)
+            groups[group].append(k)
+            out.append(cmd)
+            shapes.append((op, key, c0, r0, c1, r1))
+        else:
+            shape = shapes[k]
+            out[k] = (out[k][0], (shape[2], shape[3]), (shape[4], shape[5])) + tuple(out[k][3:])
+
+        # only the last command of a range can be extended
+        op, key, c0, r0, c1, r1 = shapes[k]
+        if k in cycles:
+            byBackground[(c0, c1)] = k
+        else:
+            byCols[(op, key, c0, c1)] = k
+            byRows[(op, key, r0, r1)] = k
+            if (op == "BACKGROUND" and r0 == r1 and len(args) == 1
+                    and not isinstance(args[0], (list, tuple))):
+                byBackground[(c0, c1)] = k
+
+    for k, colors in cycles.items():
+        # the shortest period of the colors
+        period = next(p for p in range(1, len(colors) + 1)
+                      if all(colors[i] == colors[i % p] for i in range(len(colors))))
+        out[k] = ("ROWBACKGROUNDS", out[k][1], out[k][2], colors[:period])
+    return out
+
+
+def _toColor(color):
+    """
+    returns the reportlab color of a Color or a color name
+    """
+    if isinstance(color, str):
+        return color_dict().get(color) or colors.toColor(color)
+    return color
+
+
+def heatmapColors(values, colormap=None, rules=None, vmin=None, vmax=None, levels=None):
+    """
+    Returns the colors of a matrix of values as (indices, palette), the
+    cell i, j gets palette[indices[i, j]], cells with missing values (None,
+    NaN) or below all rules get the index -1.
+
+    The colors are computed for all cells at once with NumPy.
+
+    :param values: 2-d array, nested lists or a pandas DataFrame of numbers
+    :param colormap: list of colors evenly spaced from vmin to vmax, or a
+        function mapping an array of values in 0..1 to an array of RGB(A)
+        values in 0..1, like a matplotlib colormap. Default: white to red
+    :param rules: list of (threshold, color), a value gets the color of the
+        largest threshold not above it, it replaces the colormap
+    :param vmin: value of the first color, default: the smallest value
+    :param vmax: value of the last color, default: the largest value
+    :param levels: number of colors of the colormap, fewer colors give
+        larger areas of one color and fewer style commands
+    """
+    if hasattr(values, "to_numpy"):
+        values = values.to_numpy()
+    values = np.atleast_2d(np.array(values, dtype=float))
+    missing = np.isnan(values)
+
+    if rules is not None:
+        rules = sorted(rules, key=lambda rule: rule[0])
+        bounds = np.array([rule[0] for rule in rules], dtype=float)
+        indices = np.searchsorted(bounds, values, side="right") - 1
+        indices[missing] = -1
+        return indices, [_toColor(rule[1]) for rule in rules]
+
+    if missing.all():
+        return np.full(values.shape, -1), []
+    low = np.nanmin(values) if vmin is None else vmin
+    high = np.nanmax(values) if vmax is None else vmax
+    norm = np.zeros(values.shape)
+    if high > low:
+        norm = np.clip((np.where(missing, low, values) - low) / (high - low), 0., 1.)
+    if levels:
+        norm = np.rint(norm * (levels - 1)) / max(levels - 1, 1)
+
+    if callable(colormap):
+        rgb = np.asarray(colormap(norm), dtype=float)[..., :3]
+    else:
+        stops = [_toColor(color) for color in (colormap or (colors.white, colors.red))]
+        stops = np.array([color.rgb() for color in stops], dtype=float)
+        positions = np.linspace(0., 1., len(stops))
+        rgb = np.stack([np.interp(norm, positions, stops[:, i]) for i in range(3)], axis=-1)
+
+    # equal colors of the PDF get one palette entry
+    rgb = np.rint(rgb * 255).astype(np.int64)
+    codes = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+    codes[missing] = -1
+    unique, indices = np.unique(codes, return_inverse=True)
+    indices = indices.reshape(values.shape)
+    if unique[0] < 0:
+        unique = unique[1:]
+        indices -= 1
+    palette = [colors.Color(((code >> 16) & 255) / 255., ((code >> 8) & 255) / 255.,
+                            (code & 255) / 255.) for code in unique.tolist()]
+    return indices, palette
+
+
+def colorRectangles(indices):
+    """
+    Returns the rectangles (r0, c0, r1, c1, index) of cells with the same
+    color index, runs of a row are merged with the same runs of the next
+    rows. Cells with a negative index are left out.
+    """
+    indices = np.asarray(indices)
+    if indices.size == 0:
+        return []
+    cols = indices.shape[1]
+    starts = np.ones(indices.shape, dtype=bool)
+    starts[:, 1:] = indices[:, 1:] != indices[:, :-1]
+    rows, firsts = np.nonzero(starts)
+    lasts = np.empty_like(firsts)
+    lasts[:-1] = np.where(rows[1:] == rows[:-1], firsts[1:] - 1, cols - 1)
+    lasts[-1:] = cols - 1
+    keys = indices[rows, firsts]
+
+    rectangles = []
+    # open rectangles by (c0, c1, index), [r0, r1]
+    opened = {}
+    for row, first, last, key in zip(rows.tolist(), firsts.tolist(), lasts.tolist(),
+                                     keys.tolist()):
+        if key < 0:
+            continue
+        rect = opened.get((first, last, key))
+        if rect is not None and rect[1] == row - 1:
+            rect[1] = row
+            continue
+        if rect is not None:
+            rectangles.append((rect[0], first, rect[1], last, key))
+        opened[(first, last, key)] = [row, row]
+    rectangles.extend((r0, c0, r1, c1, key) for (c0, c1, key), (r0, r1) in opened.items())
+    return rectangles
+
+
+def _selectLayerRows(layers, rows):
+    """
+    Returns the background layers of a table made of the given rows.
+
+    :param layers: list of (row, col, indices, palette)
+    :param rows: the row of the former table for every row of the new one
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    selected = []
+    for row, col, indices, palette in layers:
+        inside = (rows >= row) & (rows < row + len(indices))
+        if not inside.any():
+            continue
+        first = int(np.argmax(inside))
+        last = len(inside) - int(np.argmax(inside[::-1]))
+        part = np.full((last - first,) + indices.shape[1:], -1, dtype=indices.dtype)
+        inside = inside[first:last]
+        part[inside] = indices[rows[first:last][inside] - row]
+        selected.append((first, col, part, palette))
+    return selected
+
+
+def _selectColumns(commands, columns, ncols):
+    """
+    Returns the style commands of a table made of the given columns.
+
+    Commands on all columns are kept, the others are clipped to the runs of
+    consecutive columns and moved to their columns in the new table.
+
+    :param commands: the style commands of the former table
+    :param columns: the column of the former table for every column of the
+        new one, ascending
+    :param ncols: number of columns of the former table
+    """
+    # runs of consecutive columns as (first, end, position in the new table)
+    runs = []
+    for position, column in enumerate(columns):
+        if runs and runs[-1][1] == column:
+            runs[-1][1] = column + 1
+        else:
+            runs.append([column, column + 1, position])
+    selected = []
+    for cmd in commands:
+        if not cmd or len(cmd) < 3:
+            selected.append(cmd)
+            continue
+        (c0, r0), (c1, r1) = cmd[1], cmd[2]
+        c0, c1 = c0 + ncols if c0 < 0 else c0, c1 + ncols if c1 < 0 else c1
+        if c0 <= 0 and c1 >= ncols - 1:
+            selected.append(cmd)
+            continue
+        for first, end, position in runs:
+            a, b = max(c0, first), min(c1, end - 1)
+            if a > b:
+                continue
+            rest = tuple(cmd[3:])
+            if cmd[0] == "COLBACKGROUNDS" and rest and rest[0]:
+                shift = (a - c0) % len(rest[0])
+                rest = (list(rest[0][shift:]) + list(rest[0][:shift]),) + rest[1:]
+            selected.append((cmd[0], (a - first + position, r0), (b - first + position, r1)) + rest)
+    return selected
+
+
+def _layersKey(layers):
+    """
+    deterministic description of background layers, for layout keys
+    """
+    return [(row, col, indices.shape, sha1(np.ascontiguousarray(indices).tobytes()).hexdigest(),
+             palette) for row, col, indices, palette in layers]
+
 
 def getTableStyle(tSty=None, tSpaceAfter=0, tSpaceBefore=0):
     """
@@ -102,6 +512,9 @@ class StyledTable(object):
 
     """
 
+    # sequence of the table titles, the same in every run
+    _titleIds = count(1)
+
     def __init__(self, gridded=False, leftTablePadding=0, hTableAlignment=None, colWidths=None):
         """
         :param gridded: if True, the table style is gridded, default is False
@@ -114,11 +527,19 @@ class StyledTable(object):
         self.rightPadding = 0
         self.spaceBefore = 0
         self.spaceAfter = 0
+        # changes of the table not seen in the size of its lists
+        self._version = 0
         self.tableData = list()
         self.tableStyleCommands = list()
         # for finalizing specific cell formats
         self.tableExtraStyleCommands = list()
         self.fontsize = 10
+        # height of every row in points, None if the rows are measured
+        self.fixedRowHeight = None
+        # draw plain tables with DirectTable instead of a reportlab Table
+        self.directDraw = False
+        # width of every column in points, None if the columns are measured
+        self.fixedColWidths = None
         self.font = getFont(base_fonts()["normal"])
         self.addTableStyleCommand(('FONT', (0, 0), (-1, -1),
                                    base_fonts()["normal"]))
@@ -132,14 +553,62 @@ class StyledTable(object):
             self.offsetCol = 0
             self.leftTablePadding = 0
         self.headerRow = 0
-        self.title = ''.join(random.choice(
-            string.ascii_uppercase + string.digits) for _ in range(5))
+        # cell colors painted by LayeredTable, see addConditionalFormat
+        self.backgroundLayers = list()
+        self.title = "T%04d" % next(StyledTable._titleIds)
         # BUG: VALIGN does not work with different font sizes !!!
         self.addTableStyleCommand(
             ('VALIGN', (0, 0), (-1, -1), 'BOTTOM'))
         self.addTableStyleCommand(
             ('FONTSIZE', (0, 0), (-1, -1), self.fontsize))
 
+    @property
+    def tableData(self):
+        """
+        the rows of the table, a list of lists of cells
+        """
+        return self._tableData
+
+    @tableData.setter
+    def tableData(self, data):
+        self._tableData = data
+        self.invalidateLayout()
+
+    def invalidateLayout(self):
+        """
+        Drops the measured sizes of the table.
+
+        Adding lines or style commands is detected by the table itself, this
+        is only needed after cells or style commands were changed in place.
+        """
+        self._version = self.__dict__.get("_version", 0) + 1
+
+    def setFixedRowHeight(self, rowHeight=None):
+        """
+        Declares that all rows have the same height, e.g. tables of single
+        line texts in one font size.
+
+        The table height and the split points are computed from the number
+        of rows and reportlab does not measure the cells for the row heights.
+        Cells higher than the row height overflow. Set fixedRowHeight to
+        None to measure the rows again.
+
+        :param rowHeight: the row height in points, default: one line of
+            fontsize with the default top and bottom padding
+        :type rowHeight: float
+        """
+        if rowHeight is None:
+            rowHeight = 1.2 * self.fontsize + 2 * 3
+        self.fixedRowHeight = rowHeight
+
+    def _fixedRowHeights(self):
+        """
+        Returns the row heights in fixed row height mode, else None.
+        """
+        if not self.fixedRowHeight:
+            return None
+        return [self.fixedRowHeight] * max(self.linesCount(), 1)
+
     def setFontSizeColor(self, size, color, row, col):
         """
         FONTSIZE (or SIZE)      - takes fontsize in points; leading may get out of sync.
@@ -163,6 +632,44 @@ class StyledTable(object):
         self.addTableExtraStyleCommand(cmd_padding_top)
         self.addTableExtraStyleCommand(cmd_padding_right)
 
+    def addConditionalFormat(self, values, colormap=None, rules=None, vmin=None, vmax=None,
+                             levels=None, row=None, col=0, textColor=False, layer=False):
+        """
+        Colors a block of cells by their values, e.g. as a heatmap.
+
+        The colors are computed with heatmapColors, cells of one color are
+        merged into rectangles and added as one BACKGROUND (or TEXTCOLOR)
+        command per rectangle. With layer=True the background colors are
+        not added as style commands but painted by the table flowable in
+        one pass per color, for large grids of many colors.
+
+        :param values: 2-d array, nested lists or a pandas DataFrame of numbers
+        :param colormap: see heatmapColors
+        :param rules: list of (threshold, color), see heatmapColors
+        :param vmin: value of the first color of the colormap
+        :param vmax: value of the last color of the colormap
+        :param levels: number of colors of the colormap
+        :param row: table row of the first values, default: the first row below the header
+        :type row: int
+        :param col: column of the first values
+        :type col: int
+        :param textColor: if True, the text is colored instead of the background
+        :type textColor: bool
+        :param layer: if True, the background is painted directly
+        :type layer: bool
+        """
+        indices, palette = heatmapColors(values, colormap=colormap, rules=rules,
+                                         vmin=vmin, vmax=vmax, levels=levels)
+        if row is None:
+            row = self.headerRow
+        col += self.offsetCol
+        if layer and not textColor:
+            self.backgroundLayers.append((row, col, indices, palette))
+            return
+        op = "TEXTCOLOR" if textColor else "BACKGROUND"
+        self.addTableExtraStyleCommand([(op, (col + c0, row + r0), (col + c1, row + r1), palette[k])
+                                        for r0, c0, r1, c1, k in colorRectangles(indices)])
+
     def addTableExtraStyleCommand(self, cmd):
         """Insert additional style commands.
 
@@ -317,20 +824,30 @@ class StyledTable(object):
         """
         return len(self.tableData[0])
 
-    def handleStyleCommands(self):
+    def handleStyleCommands(self, layoutCommands=()):
         """
         Creates real tableStyle from tableStyleCommands.
 
+        :param layoutCommands: commands applied after tableStyleCommands
+            and before the extra style commands, e.g. of layoutTable
         """
         tableStyle = getTableStyle()
-        for cmd in self.tableStyleCommands:
-            if not len(cmd) == 0:
-                tableStyle.add(*cmd)
-        for cmd in self.tableExtraStyleCommands:
-            if not len(cmd) == 0:
-                tableStyle.add(*cmd)
+        for cmd in self.compileStyleCommands(layoutCommands):
+            tableStyle.add(*cmd)
         return tableStyle
 
+    def compileStyleCommands(self, layoutCommands=()):
+        """
+        Returns the style commands and the extra style commands merged into
+        ranges, see compileStyleCommands.
+
+        :param layoutCommands: commands applied between both
+        """
+        data = self.tableData
+        return compileStyleCommands(self.tableStyleCommands + list(layoutCommands)
+                                    + self.tableExtraStyleCommands,
+                                    rows=len(data), cols=max(map(len, data)) if data else None)
+
     @property
     def as_flowable(self):
         """
@@ -340,6 +857,22 @@ class StyledTable(object):
             self.tableData = [[""]]
         return self.layoutTable()
 
+    def streamingTable(self, rows, colWidths=None, batchSize=64):
+        """
+        Returns a flowable that lays out the rows of an iterator, e.g. a csv
+        reader or a DB cursor, below the header and the styles of this table.
+
+        :param rows: iterable of table lines, a sequence or a function
+            returning an iterator is needed for multiBuild
+        :param colWidths: the columns width in cm
+        :type colWidths: list
+        :param batchSize: number of rows pulled at once
+        :type batchSize: int
+
+        :returns: a StreamingTable flowable
+        """
+        return StreamingTable(self, rows, colWidths=colWidths, batchSize=batchSize)
+
     def layoutTable(self, hTableAlignment=None, colWidths=None):
         """
         Returns a table flowable with automatically estimated column width.
@@ -357,21 +890,72 @@ class StyledTable(object):
 
         :returns: a table flowable element
         """
-        self.addTableStyleCommand(
-            ('LEFTPADDING', (0, 0), (-1, -1), 0.1 * cm))
-        self.addTableStyleCommand(
-            ('VALIGN', (0, 0), (-1, -1), 'BOTTOM'))
         if colWidths:
             colWidths = [x * cm for x in colWidths]
-        table = Table(self.tableData, colWidths=colWidths,
-                         spaceBefore=0, spaceAfter=0)
-        table.setStyle(self.handleStyleCommands())
-        if hTableAlignment is not None:
-            table.hAlign = hTableAlignment
+        return self._tableFlowable(colWidths, self._layoutTableCommands(),
+                                   self.hTableAlignment if hTableAlignment is None
+                                   else hTableAlignment)
+
+    def _tableFlowable(self, colWidths, layoutCommands, hAlign, spaceBefore=0, spaceAfter=0):
+        """
+        Returns the flowable of the table: a DirectTable if directDraw is
+        set and the table is plain, a LayeredTable if it has background
+        layers, else a Table.
+
+        :param colWidths: the columns width in points, default: fixedColWidths
+        :param layoutCommands: commands applied after tableStyleCommands,
+            see handleStyleCommands
+        :param hAlign: the table alignment on the frame
+        :param spaceBefore: the space above the table in points
+        :param spaceAfter: the space below the table in points
+        """
+        if not colWidths:
+            colWidths = self.fixedColWidths
+        rowHeights = self._fixedRowHeights()
+        if self.directDraw:
+            commands = self.compileStyleCommands(layoutCommands)
+            if DirectTable.supports(self.tableData, commands):
+                return DirectTable(self.tableData, commands, colWidths=colWidths,
+                                   rowHeights=rowHeights, backgroundLayers=self.backgroundLayers,
+                                   hAlign=hAlign, spaceBefore=spaceBefore, spaceAfter=spaceAfter)
+        if self.backgroundLayers:
+            table = LayeredTable(self.tableData, colWidths=colWidths, rowHeights=rowHeights,
+                                 spaceBefore=spaceBefore, spaceAfter=spaceAfter,
+                                 backgroundLayers=self.backgroundLayers)
         else:
-            table.hAlign = self.hTableAlignment
+            table = Table(self.tableData, colWidths=colWidths, rowHeights=rowHeights,
+                          spaceBefore=spaceBefore, spaceAfter=spaceAfter)
+        table.setStyle(self.handleStyleCommands(layoutCommands))
+        table.hAlign = hAlign
         return table
 
+    def _layoutTableCommands(self):
+        """
+        Returns the style commands applied by layoutTable.
+        """
+        return [('LEFTPADDING', (0, 0), (-1, -1), 0.1 * cm),
+                ('VALIGN', (0, 0), (-1, -1), 'BOTTOM')]
+
+    def layoutKey(self):
+        """
+        Returns the layout state of the table flowable built by as_flowable,
+        used as key in a LayoutCache.
+
+        Of repeated style commands only the last one is kept, the former
+        ones are overridden by it.
+        """
+        commands = []
+        seen = set()
+        for cmd in reversed(self.tableStyleCommands + self._layoutTableCommands()
+                            + self.tableExtraStyleCommands):
+            if cmd and repr(cmd) not in seen:
+                seen.add(repr(cmd))
+                commands.append(cmd)
+        commands.reverse()
+        return (self.tableData or [[""]], commands, self.hTableAlignment,
+                _layersKey(self.backgroundLayers), self.fixedRowHeight,
+                self.fixedColWidths)
+
     def layoutFullWidthTable(self,
                              frameInfo,
                              hTableAlignment=TA_CENTER,
@@ -386,9 +970,8 @@ class StyledTable(object):
         :returns: a table flowable element
         """
         # workaround for any too large leftpadding --->
-        self.addTableStyleCommand(
-            ('LEFTPADDING', (0, 0), (-1, -1), 0 * cm))
-        tableStyle = self.handleStyleCommands()
+        tableStyle = self.handleStyleCommands(
+            [('LEFTPADDING', (0, 0), (-1, -1), 0 * cm)])
         # columnWidths = self.columnWidthEstim(self.tableData)
         frameWidth = frameInfo._aW - (frameInfo._x1 * 2.)  # -(frameInfo._leftPadding+frameInfo._rightPadding)
         #if self.reportType == "campaign" or self.reportType == "release":
@@ -439,8 +1022,7 @@ class StyledTable(object):
         # general right padding in cells:
         if rightPadding:
             self.rightPadding = rightPadding
-        self.addTableStyleCommand(
-            ('RIGHTPADDING', (0, 0), (-1, -1), self.rightPadding * cm))
+        layoutCommands = [('RIGHTPADDING', (0, 0), (-1, -1), self.rightPadding * cm)]
         # BUG: VALIGN does not work with different font sizes !!!
         # styledTable.addTableStyleCommand(
         #    ('VALIGN', (0, 0), (-1, -1), 'BOTTOM'))
@@ -456,7 +1038,7 @@ class StyledTable(object):
         # repair here the leftTablePadding option and the fact that the table data is
         # provided with an additional empty column at the left side
         if colWidths is not None:
-            estColWidths = self.columnWidthEstim(self.tableData)
+            estColWidths = self.columnWidthEstim()
             if self.colsCount() > len(colWidths):
                 if isinstance(colWidths, tuple):
                     colWidths = list(colWidths)
@@ -480,31 +1062,45 @@ class StyledTable(object):
             # NOTE returns the style table again
             return self
         else:
-            table = Table(self.tableData, colWidths=colWidthsResult,
-                            spaceBefore=self.spaceBefore * cm, spaceAfter=self.spaceAfter * cm)
-            tableStyle = self.handleStyleCommands()
-            table.setStyle(tableStyle)
-            table.hAlign = self.hTableAlignment
-            return table
+            return self._tableFlowable(colWidthsResult, layoutCommands, self.hTableAlignment,
+                                       spaceBefore=self.spaceBefore * cm,
+                                       spaceAfter=self.spaceAfter * cm)
 
-    def columnWidthEstim(self, data):
+    def columnWidthEstim(self, data=None):
         """
         Returns minimum column width for all lines in the column.
 
-        :param data: the table data
+        :param data: the table data, default: tableData
         :type data: list of list
 
         :returns: list of cell width estimations
         """
-        cell_widths = defaultdict(int)
+        if data is None:
+            data = self.tableData
+        return [self._columnWidth(column) for column in zip_longest(*data)]
 
-        for line in data:
-            for i, cell in enumerate(line):
-                cell_width_est = self.widthEstim(cell)
-                if cell_width_est > cell_widths[i]:
-                    cell_widths[i] = cell_width_est
-
-        return [cell_widths[i] for i in range(len(list(cell_widths)))]
+    def _columnWidth(self, column):
+        """
+        Returns the largest widthEstim of the cells of column, every
+        distinct cell is measured once and all texts at once.
+        """
+        try:
+            # 1, 1.0 and True are equal but formatted differently
+            cells = [cell for kind, cell in set((type(cell), cell) for cell in column)]
+        except TypeError:
+            # unhashable cells, e.g. lists
+            cells = column
+        texts = [cell for cell in cells if isinstance(cell, str)]
+        lines = set(text if "\n" not in text else longestLine(text) for text in texts)
+        lines.update(map(str, [cell for cell in cells if isinstance(cell, (float, int))]))
+        width = 0
+        for cell in cells:
+            if cell is not None and not isinstance(cell, (str, float, int)):
+                width = max(width, self.widthEstim(cell))
+        if lines:
+            widths = textWidths(list(lines), self.font.fontName, self.fontsize)
+            width = max(width, int(widths.max()))
+        return width
 
 
     def widthEstim(self, obj, name="table"):
@@ -522,13 +1118,10 @@ class StyledTable(object):
         """
         if isinstance(obj, (float, int)):
             return int(
-                self.font.stringWidth("%s" % obj, self.fontsize))
+                textWidth("%s" % obj, self.font.fontName, self.fontsize))
         elif isinstance(obj, str):
-            # print(obj,np.ceil(self.font.stringWidth(obj,self.fontsizes[name])))
-            largestStr = sorted(obj.split("\n"), key=lambda x: len(x))[-1]
-            # print(largestStr)
             return int(
-                self.font.stringWidth(largestStr, self.fontsize))
+                textWidth(longestLine(obj), self.font.fontName, self.fontsize))
         elif isinstance(obj, Flowable):
             return obj.minWidth()
         elif obj is None:
@@ -538,14 +1131,59 @@ class StyledTable(object):
         else:
             raise (NotImplementedError(type(obj)))
 
-    def getTableHeight(self, frameInfo):
+    def _layoutState(self):
+        """
+        Returns the state of the table the measured sizes depend on.
+        """
+        return (self.__dict__.get("_version", 0), self.linesCount(),
+                self.tableStyleCommands, len(self.tableStyleCommands),
+                self.tableExtraStyleCommands, len(self.tableExtraStyleCommands),
+                self.backgroundLayers, len(self.backgroundLayers))
+
+    def _measure(self, availWidth, availHeight):
+        """
+        Returns (width, height, rowHeights) of the table flowable wrapped in
+        the available space, kept until the table is changed.
+        """
+        measured = self.__dict__.get("_measured")
+        if measured is None or measured[0] != self._layoutState():
+            measured = None
+        else:
+            size = measured[1].get((availWidth, availHeight))
+            if size is not None:
+                return size
+        table = self.as_flowable
+        width, height = table.wrap(availWidth, availHeight)
+        size = (width, height, list(table._rowHeights))
+        if measured is None:
+            measured = self._measured = (self._layoutState(), {})
+        measured[1][(availWidth, availHeight)] = size
+        return size
+
+    def wrapTable(self, availWidth, availHeight):
+        """
+        Returns the size of the table flowable wrapped in the available space.
+
+        The sizes are kept for every available space until lines or style
+        commands are added, see invalidateLayout.
+        """
+        return self._measure(availWidth, availHeight)[:2]
+
+    def getTableHeight(self, frameInfo, cache=None):
         """
         Returns height of table hint
 
-        :param table: the table object
-        :type table: Table
+        :param frameInfo: the frame the table is wrapped in
+        :type frameInfo: Frame
+        :param cache: measured heights of former runs, optional
+        :type cache: LayoutCache
         """
-        return self.as_flowable.wrap(frameInfo._aW, frameInfo._aH)[1]
+        if self.fixedRowHeight:
+            return self.fixedRowHeight * max(self.linesCount(), 1)
+        if cache is None:
+            return self.wrapTable(frameInfo._aW, frameInfo._aH)[1]
+        return cache.measure(self, frameInfo._aW, frameInfo._aH,
+                             lambda: self.wrapTable(frameInfo._aW, frameInfo._aH)[1])
 
 
     def split_table(self, n):
@@ -558,20 +1196,53 @@ class StyledTable(object):
 
         Returns
         -------
-        tuple of StyledTable
-            Two new ``StyledTable`` instances containing the upper and
-            lower part of the table.
-        """
-        table_copy_up = copy.deepcopy(self)
-        table_copy_down = copy.deepcopy(self)
-        table_copy_down.tableData = self.tableData[n:]
-        table_copy_down.tableData.insert(0, self.tableData[0])
-        table_copy_up.tableData = self.tableData[0:n]
+        tuple of StyledTableView
+            Two views of the table for the upper and the lower part, the
+            lower part repeats the first row.
+        """
+        table_copy_up = StyledTableView(self, 0, n)
+        table_copy_down = StyledTableView(self, n, self.linesCount(), headerRows=1)
         return table_copy_up, table_copy_down
 
+    def _rowSegments(self):
+        """
+        Returns the rows of the table as list of (rows, start, end).
+        """
+        return [(self.tableData, 0, len(self.tableData))]
+
+    def _rows(self, start, end):
+        """
+        Returns the rows start:end of the table.
+        """
+        rows = []
+        for segment, first, last in _sliceSegments(self._rowSegments(), start, end):
+            rows.extend(segment[first:last])
+        return rows
 
-    def split_table_iterative(self, frameInfo, availableHeight):
-        """Recursively split the table to fit ``availableHeight``.
+
+    def rowHeights(self, frameInfo, cache=None):
+        """
+        Returns the heights of all rows, measured with one wrap of the table.
+
+        :param frameInfo: the frame the table is wrapped in
+        :type frameInfo: Frame
+        :param cache: measured heights of former runs, optional
+        :type cache: LayoutCache
+        """
+        def measure():
+            return list(self._measure(frameInfo._aW, frameInfo._aH)[2])
+        if self.fixedRowHeight:
+            return self._fixedRowHeights()
+        if cache is None:
+            return measure()
+        return cache.measure(self, frameInfo._aW, frameInfo._aH, measure,
+                             op="rowHeights")
+
+    def split_table_iterative(self, frameInfo, availableHeight, cache=None):
+        """Split the table to fit ``availableHeight``.
+
+        The row heights are measured once, the split row is found with a
+        binary search on their prefix sums.
 
         Parameters
         ----------
@@ -579,39 +1250,271 @@ class StyledTable(object):
             Frame used to calculate available width for wrapping.
         availableHeight : float
             Vertical space that should not be exceeded.
+        cache : LayoutCache, optional
+            Measured row heights of former runs.
 
         Returns
         -------
         tuple of StyledTable
-            Two ``StyledTable`` instances for the upper and lower parts.
+            Two ``StyledTable`` instances for the upper and lower parts,
+            the lower part repeats the first row. The row ranges of the
+            style commands are moved to the rows of the parts.
         """
         maxHeight = availableHeight - self.spaceBefore * cm - self.spaceAfter * cm
-        n = len(self.tableData) - 1
-        table_copy_up, table_copy_down = self.split_table(n)
-        while table_copy_up.getTableHeight(frameInfo) > maxHeight * 0.9:
-            n -= 1
-            if n >= 1:
-                table_copy_up, table_copy_down = self.split_table(n)
-            else:
-                break
-        table_copy_down.shift_background_styles(n-1)
-        table_copy_up.snip_background_styles(n)
+        heights = [0] + list(accumulate(self.rowHeights(frameInfo, cache)))
+        # largest n < len(rows) with rows[0:n] not higher than 90% of maxHeight
+        n = min(bisect_right(heights, maxHeight * 0.9) - 1, self.linesCount() - 1)
+        n = max(n, 1)
+        table_copy_up = self._table_part(0, n, 0)
+        table_copy_down = self._table_part(n, self.linesCount(), 1)
         return table_copy_up, table_copy_down
 
+    def split_table_pages(self, frameInfo, availableHeight=None, cache=None, fill=0.9):
+        """Split the table into all of its page sized parts in one go.
+
+        The header rows (see ``headerRow``) are repeated on top of every
+        part and the row ranges of the style commands are moved to the rows
+        of the parts.
+        The row heights are measured once, the rows of every part are found
+        with a binary search on their prefix sums.
+
+        Parameters
+        ----------
+        frameInfo : Frame
+            Frame the parts are wrapped in, every part but the first one
+            fits its full height.
+        availableHeight : float, optional
+            Vertical space left for the first part, default: the frame height
+        cache : LayoutCache, optional
+            Measured row heights of former runs.
+        fill : float
+            Fraction of the space filled by a part, default: 0.9
+
+        Returns
+        -------
+        list of StyledTable
+            The parts of the table, every part has at least one row below
+            the header, even if it does not fit.
+        """
+        headerRows = min(self.headerRow, self.linesCount())
+        return [self._table_part(start, end, headerRows) for start, end in
+                self._pageRows(frameInfo, self.rowHeights(frameInfo, cache),
+                               availableHeight, fill)]
+
+    def _pageRows(self, frameInfo, rowHeights, availableHeight=None, fill=0.9):
+        """
+        Returns the rows (start, end) below the header of the page parts,
+        see split_table_pages.
+        """
+        spacing = self.spaceBefore * cm + self.spaceAfter * cm
+        pageHeight = (frameInfo._aH - spacing) * fill
+        if availableHeight is None:
+            maxHeight = pageHeight
+        else:
+            maxHeight = (availableHeight - spacing) * fill
+
+        headerRows = min(self.headerRow, len(rowHeights))
+        headerHeight = sum(rowHeights[:headerRows])
+        heights = [0] + list(accumulate(rowHeights))
+
+        pages = []
+        start = headerRows
+        rows = len(rowHeights)
+        while start < rows or not pages:
+            # largest end with rows[start:end] and the header in maxHeight
+            end = bisect_right(heights, heights[start] + maxHeight - headerHeight) - 1
+            end = min(max(end, start + 1), rows)
+            pages.append((start, end))
+            start = end
+            maxHeight = pageHeight
+        return pages
+
+    def columnWidths(self):
+        """
+        Returns the widths of the columns in points, estimated with
+        columnWidthEstim plus the cell paddings. The header rows are
+        estimated in the bold font.
+        """
+        widths = np.array(self.columnWidthEstim(), dtype=float)
+        ncols = len(widths)
+        bold = base_fonts()["bold"]
+        for row in self._rows(0, min(self.headerRow, self.linesCount())):
+            for c, cell in enumerate(row[:ncols]):
+                if isinstance(cell, str) and cell:
+                    widths[c] = max(widths[c], textWidth(longestLine(cell), bold, self.fontsize))
+
+        # left and right padding, the largest one of a column
+        padding = np.full((2, ncols), 6.)
+        rows = self.linesCount()
+        for cmd in self.tableStyleCommands + self._layoutTableCommands() + self.tableExtraStyleCommands:
+            if cmd and cmd[0] in ("LEFTPADDING", "RIGHTPADDING"):
+                (c0, r0), (c1, r1) = cmd[1], cmd[2]
+                c0, c1 = c0 + ncols if c0 < 0 else c0, c1 + ncols if c1 < 0 else c1
+                side = padding[0 if cmd[0] == "LEFTPADDING" else 1, c0:c1 + 1]
+                if r0 in (0, -rows) and r1 in (-1, rows - 1):
+                    side[:] = cmd[3]
+                else:
+                    np.maximum(side, cmd[3], out=side)
+        return (widths + padding.sum(axis=0)).tolist()
+
+    def _columnBands(self, availableWidth, keyColumns=None):
+        """
+        Returns the columns of the bands fitting in availableWidth and the
+        column widths, see split_table_columns.
+        """
+        widths = self.columnWidths()
+        ncols = len(widths)
+        if keyColumns is None:
+            keyColumns = self.offsetCol + 1
+        keyColumns = min(keyColumns, ncols)
+        keys = list(range(keyColumns))
+        keyWidth = sum(widths[:keyColumns])
+        prefix = [0] + list(accumulate(widths))
+
+        bands = []
+        start = keyColumns
+        while start < ncols or not bands:
+            # largest end with columns[start:end] and the keys in availableWidth
+            end = bisect_right(prefix, prefix[start] + availableWidth - keyWidth) - 1
+            end = min(max(end, start + 1), ncols)
+            bands.append(keys + list(range(start, end)))
+            start = end
+        return bands, widths
+
+    def _column_band(self, columns, widths):
+        """
+        Returns a table of the given columns with fixed column widths.
+        """
+        band = StyledTable.__new__(StyledTable)
+        band.__dict__.update((key, value) for key, value in self.__dict__.items()
+                             if key not in ("_tableData", "_measured", "_styleIndexes"))
+        band.tableData = [[row[c] if c < len(row) else "" for c in columns]
+                          for row in self.tableData]
+        ncols = len(widths)
+        band.tableStyleCommands = _selectColumns(self.tableStyleCommands, columns, ncols)
+        band.tableExtraStyleCommands = _selectColumns(self.tableExtraStyleCommands, columns, ncols)
+        # columns are the rows of the transposed layers
+        band.backgroundLayers = [
+            (row, col, indices.T, palette) for col, row, indices, palette in _selectLayerRows(
+                [(col, row, indices.T, palette)
+                 for row, col, indices, palette in self.backgroundLayers], columns)]
+        band.fixedColWidths = [widths[c] for c in columns]
+        return band
+
+    def split_table_columns(self, frameInfo, availableWidth=None, keyColumns=None):
+        """Split a wide table into bands of columns fitting the frame width.
+
+        The column widths are estimated once with ``columnWidthEstim``, the
+        columns of every band are found with a binary search on their prefix
+        sums. The key columns are repeated on the left of every band and the
+        column ranges of the style commands are moved to the columns of the
+        bands. The bands keep the estimated widths (see ``fixedColWidths``).
+
+        Parameters
+        ----------
+        frameInfo : Frame
+            Frame the bands are wrapped in.
+        availableWidth : float, optional
+            Horizontal space of a band, default: the frame width
+        keyColumns : int, optional
+            Number of columns repeated in every band, default: the
+            leftTablePadding column and the first data column
+
+        Returns
+        -------
+        list of StyledTable
+            The bands of the table, every band has at least one column
+            besides the key columns, even if it does not fit.
+        """
+        if availableWidth is None:
+            availableWidth = frameInfo._aW
+        bands, widths = self._columnBands(availableWidth, keyColumns)
+        return [self._column_band(columns, widths) for columns in bands]
+
+    def split_table_grid(self, frameInfo, availableWidth=None, availableHeight=None,
+                         keyColumns=None, cache=None, fill=0.9):
+        """Split a wide and long table into page sized parts.
+
+        The table is cut into column bands as by ``split_table_columns``
+        and into row parts as by ``split_table_pages``. The rows of the
+        parts are found once for all bands, with the row heights of the
+        table in the estimated column widths, every band keeps the
+        measured row heights.
+
+        Parameters
+        ----------
+        frameInfo : Frame
+            Frame the parts are wrapped in.
+        availableWidth : float, optional
+            Horizontal space of a band, default: the frame width
+        availableHeight : float, optional
+            Vertical space left for the first parts, default: the frame height
+        keyColumns : int, optional
+            Number of columns repeated in every band
+        cache : LayoutCache, optional
+            Measured row heights of former runs.
+        fill : float
+            Fraction of the height filled by a part, default: 0.9
+
+        Returns
+        -------
+        list of StyledTable
+            The parts in the page order: the bands of the first rows, then
+            the bands of the following rows.
+        """
+        if availableWidth is None:
+            availableWidth = frameInfo._aW
+        bands, widths = self._columnBands(availableWidth, keyColumns)
+        whole = self._column_band(list(range(len(widths))), widths)
+        rowHeights = whole.rowHeights(frameInfo, cache)
+        bands = [self._column_band(columns, widths) for columns in bands]
+        headerRows = min(self.headerRow, len(rowHeights))
+        parts = []
+        for start, end in whole._pageRows(frameInfo, rowHeights, availableHeight, fill):
+            for band in bands:
+                parts.append(band._table_part(start, end, headerRows))
+        return parts
+
+    def _table_part(self, start, end, headerRows):
+        """
+        Returns a view of the table with the header rows and rows[start:end].
+        """
+        part = StyledTableView(self, start, end, headerRows)
+        styleIndex, extraIndex = self.styleIndexes()
+        part.tableStyleCommands = styleIndex.remap(start, end, headerRows)
+        part.tableExtraStyleCommands = extraIndex.remap(start, end, headerRows)
+        return part
+
+    def styleIndexes(self):
+        """
+        Returns the StyleIndex of the style commands and of the extra style
+        commands, they are kept until a command is added.
+        """
+        cached = self.__dict__.get("_styleIndexes")
+        state = (self.tableStyleCommands, len(self.tableStyleCommands),
+                 self.tableExtraStyleCommands, len(self.tableExtraStyleCommands),
+                 self.linesCount())
+        if (cached is None or cached[0][0] is not state[0] or cached[0][2] is not state[2]
+                or cached[0][1::2] != state[1::2]):
+            rows = state[4]
+            cached = self._styleIndexes = (state, (StyleIndex(state[0], rows),
+                                                   StyleIndex(state[2], rows)))
+        return cached[1]
+
     def shift_background_styles(self, n):
         """Shift background style commands after splitting."""
         out_styles = []
         tableStyleCommands = []
         for command in self.tableStyleCommands:
             if command[0] == "BACKGROUND":
-                new_command = list(command)
-                new_command[1][1] -= n
-                new_command[2][1] -= n
-                if new_command[1][1] > 0 and new_command[2][1]> 0:
-                    tableStyleCommands.append(new_command)
+                (c0, r0), (c1, r1) = command[1], command[2]
+                if r0 - n > 0 and r1 - n > 0:
+                    tableStyleCommands.append((command[0], (c0, r0 - n), (c1, r1 - n))
+                                              + tuple(command[3:]))
             else:
                 tableStyleCommands.append(command)
         self.tableStyleCommands = tableStyleCommands
+        self.invalidateLayout()
 
     def snip_background_styles(self, n):
         """Trim background style commands at split position."""
@@ -625,3 +1528,1190 @@ class StyledTable(object):
             else:
                 tableStyleCommands.append(command)
         self.tableStyleCommands = tableStyleCommands
+        self.invalidateLayout()
+
+
+class StyleIndex(object):
+    """
+    interval index of the row ranges of style commands
+
+    The commands on given rows are kept in an interval tree, the commands
+    of a row range are found in O(log n + k) for n commands and k matches.
+    Commands on all rows, and with rows=None commands on rows counted from
+    the end, apply to any part of the table and are not indexed.
+    """
+
+    def __init__(self, commands, rows=None):
+        """
+        :param commands: the style commands
+        :type commands: list
+        :param rows: number of rows of the table, if known
+        :type rows: int
+        """
+        self.commands = commands
+        # indices of the commands on all rows
+        self._everywhere = []
+        intervals = []
+        for i, cmd in enumerate(commands):
+            if not cmd:
+                continue
+            try:
+                r0, r1 = cmd[1][1], cmd[2][1]
+            except (TypeError, IndexError):
+                self._everywhere.append(i)
+                continue
+            if min(r0, r1) < 0:
+                if rows is None:
+                    self._everywhere.append(i)
+                    continue
+                r0, r1 = r0 + rows if r0 < 0 else r0, r1 + rows if r1 < 0 else r1
+            r0, r1 = min(r0, r1), max(r0, r1)
+            if rows is not None and r0 <= 0 and r1 >= rows - 1:
+                self._everywhere.append(i)
+            else:
+                intervals.append((r0, r1, i))
+        self._rows = dict((i, (r0, r1)) for r0, r1, i in intervals)
+        self._tree = _intervalTree(sorted(intervals))
+
+    def find(self, first, last):
+        """
+        Returns the indices of the commands on the rows first to last, in
+        the order of the commands.
+        """
+        found = []
+        stack = [self._tree]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            center, byStart, byEnd, left, right = node
+            if last < center:
+                for interval in byStart:
+                    if interval[0] > last:
+                        break
+                    found.append(interval[2])
+                stack.append(left)
+            elif first > center:
+                for interval in byEnd:
+                    if interval[1] < first:
+                        break
+                    found.append(interval[2])
+                stack.append(right)
+            else:
+                found.extend(interval[2] for interval in byStart)
+                stack.append(left)
+                stack.append(right)
+        found.sort()
+        return found
+
+    def remap(self, start, end, headerRows=0):
+        """
+        Returns the commands of the part of the table with the header rows
+        and rows[start:end], the row ranges are clipped and moved to the
+        rows of the part.
+        """
+        found = set(self.find(start, end - 1))
+        if headerRows:
+            found.update(self.find(0, headerRows - 1))
+        out = []
+        shift = headerRows - start
+        for i in sorted(found.union(self._everywhere)):
+            cmd = self.commands[i]
+            if i not in self._rows:
+                out.append(cmd)
+                continue
+            r0, r1 = self._rows[i]
+            (c0, _), (c1, _) = cmd[1], cmd[2]
+            if r0 < headerRows:
+                out.append(self._clip(cmd, c0, c1, r0, min(r1, headerRows - 1), 0, r0))
+            first, last = max(r0, start), min(r1, end - 1)
+            if first <= last:
+                out.append(self._clip(cmd, c0, c1, first, last, shift, r0))
+        return out
+
+    @staticmethod
+    def _clip(cmd, c0, c1, first, last, shift, r0):
+        """
+        returns cmd on the rows first to last moved by shift
+        """
+        args = tuple(cmd[3:])
+        if cmd[0] == "ROWBACKGROUNDS" and args and args[0]:
+            # keep the colors of the rows
+            phase = (first - r0) % len(args[0])
+            args = (list(args[0][phase:]) + list(args[0][:phase]),) + args[1:]
+        return (cmd[0], (c0, first + shift), (c1, last + shift)) + args
+
+
+def _intervalTree(intervals):
+    """
+    Returns the centered interval tree (center, byStart, byEnd, left, right)
+    of the intervals (first, last, index) sorted by first.
+    """
+    if not intervals:
+        return None
+    center = intervals[len(intervals) // 2][0]
+    here, left, right = [], [], []
+    for interval in intervals:
+        if interval[1] < center:
+            left.append(interval)
+        elif interval[0] > center:
+            right.append(interval)
+        else:
+            here.append(interval)
+    return (center, here, sorted(here, key=lambda interval: -interval[1]),
+            _intervalTree(left), _intervalTree(right))
+
+
+def _sliceSegments(segments, start, end):
+    """
+    Returns the row segments (rows, start, end) of the rows start:end of
+    the rows given by segments.
+    """
+    out = []
+    offset = 0
+    for rows, first, last in segments:
+        size = last - first
+        lo, hi = max(start - offset, 0), min(end - offset, size)
+        if lo < hi:
+            out.append((rows, first + lo, first + hi))
+        offset += size
+        if offset >= end:
+            break
+    return out
+
+
+class StyledTableView(StyledTable):
+    """
+    rows of a StyledTable sharing its cells and style commands
+
+    A view is made of the header rows and the rows start:end of its table.
+    The list of rows is only built when tableData is used and holds the row
+    lists of the table, cells are never copied. The style command lists are
+    shared with the table until a command is added to the view.
+
+    The table must not be changed while its views are in use.
+    """
+
+    def __init__(self, table, start, end, headerRows=0):
+        """
+        :param table: the table, a StyledTable or another view
+        :type table: StyledTable
+        :param start: first row of the view below the header rows
+        :type start: int
+        :param end: end of the rows of the view
+        :type end: int
+        :param headerRows: number of rows of table repeated on top
+        :type headerRows: int
+        """
+        segments = table._rowSegments()
+        self.__dict__.update((key, value) for key, value in table.__dict__.items()
+                             if key not in ("tableData", "_tableData", "_segments", "_measured"))
+        self._segments = (_sliceSegments(segments, 0, headerRows)
+                          + _sliceSegments(segments, start, end))
+        if self.backgroundLayers:
+            self.backgroundLayers = _selectLayerRows(
+                self.backgroundLayers, list(range(headerRows)) + list(range(start, end)))
+        self._tableData = None
+        self._ownCommands = False
+
+    @property
+    def tableData(self):
+        """
+        the rows of the view, built on first use
+        """
+        if self._tableData is None:
+            rows = []
+            for segment, first, last in self._segments:
+                rows.extend(segment[first:last])
+            self._tableData = rows
+        return self._tableData
+
+    @tableData.setter
+    def tableData(self, data):
+        self._tableData = data
+        self.invalidateLayout()
+
+    def _rowSegments(self):
+        if self._tableData is not None:
+            return StyledTable._rowSegments(self)
+        return self._segments
+
+    def _copyCommands(self):
+        """
+        Copies the shared style command lists before they are changed.
+        """
+        if not self._ownCommands:
+            self.tableStyleCommands = list(self.tableStyleCommands)
+            self.tableExtraStyleCommands = list(self.tableExtraStyleCommands)
+            self._ownCommands = True
+
+    def addTableExtraStyleCommand(self, cmd):
+        self._copyCommands()
+        StyledTable.addTableExtraStyleCommand(self, cmd)
+
+    def addTableStyleCommand(self, cmd, extra=False):
+        self._copyCommands()
+        StyledTable.addTableStyleCommand(self, cmd, extra)
+
+    def addDoubleLine(self, color="blue", line=0):
+        self._copyCommands()
+        StyledTable.addDoubleLine(self, color, line)
+
+    def addTableHeader(self, line, fonttype="bold", color="blue"):
+        self._copyCommands()
+        StyledTable.addTableHeader(self, line, fonttype, color)
+
+    def linesCount(self):
+        if self._tableData is not None:
+            return len(self._tableData)
+        return sum(last - first for segment, first, last in self._segments)
+
+    def colsCount(self):
+        if self._tableData is None and self._segments:
+            segment, first, last = self._segments[0]
+            return len(segment[first])
+        return StyledTable.colsCount(self)
+
+
+class LayeredTable(Table):
+    """
+    reportlab Table painting background layers of cell colors
+
+    A layer (row, col, indices, palette) colors the cells from row, col on
+    with palette[indices[i, j]], cells with a negative index are left out.
+    The layers are painted after the BACKGROUND commands, with one fill
+    color per color of the palette and one rectangle per area of a color.
+    Split parts keep the layers of their rows.
+    """
+
+    def __init__(self, data, backgroundLayers=(), **kwargs):
+        """
+        :param data: the table cells
+        :param backgroundLayers: list of (row, col, indices, palette)
+        :param kwargs: see reportlab Table
+        """
+        Table.__init__(self, data, **kwargs)
+        self.backgroundLayers = list(backgroundLayers)
+
+    def layoutKey(self):
+        """
+        Returns the layout state of the table, used as key in a LayoutCache.
+        """
+        return (tuple(getattr(self, name, None) for name in _TABLE_ATTRS),
+                _layersKey(self.backgroundLayers))
+
+    def split(self, availWidth, availHeight):
+        parts = Table.split(self, availWidth, availHeight)
+        if len(parts) == 2 and self.backgroundLayers:
+            repeatRows = self.repeatRows
+            header = (list(range(repeatRows)) if isinstance(repeatRows, int)
+                      else list(repeatRows))
+            rows = len(self._cellvalues)
+            body = len(parts[1]._cellvalues) - len(header)
+            parts[0].backgroundLayers = _selectLayerRows(
+                self.backgroundLayers, range(len(parts[0]._cellvalues)))
+            parts[1].backgroundLayers = _selectLayerRows(
+                self.backgroundLayers, header + list(range(rows - body, rows)))
+        return parts
+
+    def _drawBkgrnd(self):
+        Table._drawBkgrnd(self)
+        canv = self.canv
+        colpositions = self._colpositions
+        rowpositions = self._rowpositions
+        for row, col, indices, palette in self.backgroundLayers:
+            rectangles = defaultdict(list)
+            for r0, c0, r1, c1, k in colorRectangles(
+                    indices[:max(self._nrows - row, 0), :max(self._ncols - col, 0)]):
+                rectangles[k].append((row + r0, col + c0, row + r1, col + c1))
+            for k, areas in sorted(rectangles.items()):
+                canv.setFillColor(palette[k])
+                for r0, c0, r1, c1 in areas:
+                    x0, y0 = colpositions[c0], rowpositions[r0]
+                    canv.rect(x0, y0, colpositions[c1 + 1] - x0, rowpositions[r1 + 1] - y0,
+                              stroke=0, fill=1)
+
+
+def _sliceRowRanges(ranges, start, end):
+    """
+    Returns the row ranges (first, last) of the rows start:end of a table
+    made of ranges, adjacent ranges are merged.
+    """
+    sliced = []
+    pos = 0
+    for first, last in ranges:
+        a, b = max(start - pos, 0), min(end - pos, last - first)
+        if a < b:
+            if sliced and sliced[-1][1] == first + a:
+                sliced[-1] = (sliced[-1][0], first + b)
+            else:
+                sliced.append((first + a, first + b))
+        pos += last - first
+    return sliced
+
+
+class DirectTable(Flowable):
+    """
+    lightweight table flowable drawing plain cells directly
+
+    For tables of strings and numbers with the style commands of
+    _STYLE_GROUPS, e.g. large tabular appendices. The cell styles are
+    resolved once per command and not per cell, the texts of a page are
+    drawn in one text object and the lines of one style in one path.
+    Splitting only selects the rows of the parts, they share the cells
+    and the resolved styles.
+
+    Use supports to check a table, StyledTable falls back to a reportlab
+    Table for cells like Paragraphs, spans and other commands.
+    """
+
+    def __init__(self, data, commands=(), colWidths=None, rowHeights=None,
+                 repeatRows=0, backgroundLayers=(), hAlign="CENTER",
+                 spaceBefore=0, spaceAfter=0):
+        """
+        :param data: the rows of cells, strings, numbers or None
+        :param commands: the style commands, see getTableStyle
+        :param colWidths: widths of the columns in points, None entries are
+            measured
+        :param rowHeights: heights of the rows in points, None entries are
+            measured
+        :param repeatRows: number of header rows repeated on split parts
+        :param backgroundLayers: list of (row, col, indices, palette), see
+            LayeredTable
+        :param spaceBefore: the space above the table in points
+        :param spaceAfter: the space below the table in points
+        """
+        Flowable.__init__(self)
+        self.spaceBefore = spaceBefore
+        self.spaceAfter = spaceAfter
+        self._nrows = len(data)
+        self._ncols = max(map(len, data)) if data else 0
+        self._texts = [["" if cell is None else str(cell) for cell in row]
+                       + [""] * (self._ncols - len(row)) for row in data]
+        self._argW = list(colWidths) if colWidths else [None] * self._ncols
+        self._argH = list(rowHeights) if rowHeights else [None] * self._nrows
+        self._commands = list(commands)
+        self.repeatRows = repeatRows
+        self.backgroundLayers = list(backgroundLayers)
+        self.hAlign = hAlign
+        self._ranges = [(0, self._nrows)] if self._nrows else []
+        self._colpositions = None
+        self._offsets = None
+        self._resolveStyles()
+
+    @staticmethod
+    def supports(data, commands):
+        """
+        Returns True if the cells and the style commands can be drawn by a
+        DirectTable.
+        """
+        for cmd in commands:
+            op = cmd[0]
+            if op not in _STYLE_GROUPS or op == "HALIGN":
+                return False
+            try:
+                (c0, r0), (c1, r1) = cmd[1], cmd[2]
+            except (TypeError, ValueError, IndexError):
+                return False
+            if not all(isinstance(x, int) for x in (c0, r0, c1, r1)):
+                return False
+            if op in ("ALIGN", "ALIGNMENT") and cmd[3] not in _DIRECT_ALIGNMENTS:
+                return False
+            if op == "VALIGN" and cmd[3] not in _DIRECT_VALIGNMENTS:
+                return False
+            if op == "BACKGROUND" and (callable(cmd[3]) or isinstance(cmd[3], (list, tuple))):
+                return False
+        for row in data:
+            for cell in row:
+                if cell is not None and not isinstance(cell, (str, int, float)):
+                    return False
+        return True
+
+    def _area(self, cmd):
+        """
+        Returns the cells (c0, r0, c1, r1) of cmd inside the table or None.
+        """
+        (c0, r0), (c1, r1) = cmd[1], cmd[2]
+        c0, c1 = c0 + self._ncols if c0 < 0 else c0, c1 + self._ncols if c1 < 0 else c1
+        r0, r1 = r0 + self._nrows if r0 < 0 else r0, r1 + self._nrows if r1 < 0 else r1
+        c0, r0 = max(c0, 0), max(r0, 0)
+        c1, r1 = min(c1, self._ncols - 1), min(r1, self._nrows - 1)
+        if c0 > c1 or r0 > r1:
+            return None
+        return c0, r0, c1, r1
+
+    def _resolveStyles(self):
+        """
+        Applies the style commands to arrays of the cell styles, keeps the
+        background and line commands.
+        """
+        shape = (self._nrows, self._ncols)
+        fonts, textColors = [_baseFontName], [colors.black]
+        font = np.zeros(shape, dtype=np.int64)
+        color = np.zeros(shape, dtype=np.int64)
+        fontSize = np.full(shape, 10.)
+        leading = np.full(shape, 12.)
+        align = np.zeros(shape, dtype=np.int64)
+        valign = np.zeros(shape, dtype=np.int64)
+        # left, right, top and bottom padding
+        padding = np.empty((4,) + shape)
+        padding[:2], padding[2:] = 6., 3.
+        paddings = {"LEFTPADDING": 0, "RIGHTPADDING": 1, "TOPPADDING": 2, "BOTTOMPADDING": 3}
+
+        def index(values, value):
+            if value not in values:
+                values.append(value)
+            return values.index(value)
+
+        self._backgrounds = []
+        self._lines = []
+        for cmd in self._commands:
+            area = self._area(cmd)
+            if area is None:
+                continue
+            op, values = cmd[0], cmd[3:]
+            c0, r0, c1, r1 = area
+            cells = (slice(r0, r1 + 1), slice(c0, c1 + 1))
+            if op == "FONT":
+                font[cells] = index(fonts, values[0])
+                if len(values) > 1:
+                    fontSize[cells] = values[1]
+                    leading[cells] = values[2] if len(values) > 2 else values[1] * 1.2
+            elif op in ("FONTNAME", "FACE"):
+                font[cells] = index(fonts, values[0])
+            elif op in ("FONTSIZE", "SIZE"):
+                fontSize[cells] = values[0]
+            elif op == "LEADING":
+                leading[cells] = values[0]
+            elif op == "TEXTCOLOR":
+                color[cells] = index(textColors, colors.toColor(values[0], colors.black))
+            elif op in ("ALIGN", "ALIGNMENT"):
+                align[cells] = _DIRECT_ALIGNMENTS[values[0]]
+            elif op == "VALIGN":
+                valign[cells] = _DIRECT_VALIGNMENTS[values[0]]
+            elif op in paddings:
+                padding[(paddings[op],) + cells] = values[0]
+            elif op in ("BACKGROUND", "ROWBACKGROUNDS", "COLBACKGROUNDS"):
+                self._backgrounds.append((op, area, values[0]))
+            elif op in _STYLE_GROUPS and _STYLE_GROUPS[op] == "line":
+                weight, lineColor = values[0], colors.toColor(values[1])
+                cap = LINECAPS.get(values[2], values[2]) if len(values) > 2 else 1
+                dash = values[3] if len(values) > 3 else None
+                join = LINEJOINS.get(values[4], values[4]) if len(values) > 4 else 1
+                count = values[5] if len(values) > 5 and values[5] else 1
+                space = values[6] if len(values) > 6 else weight
+                self._lines.append((op, area, (weight, lineColor, cap, tuple(dash or ()), join),
+                                    count, space))
+
+        self._fonts, self._textColors = fonts, textColors
+        self._font, self._fontSize, self._leading = font, fontSize, leading
+        self._color, self._align, self._valign, self._padding = color, align, valign, padding
+
+    def _calc(self):
+        """
+        Measures the columns and rows without a given size.
+        """
+        if self._colpositions is not None:
+            return
+        lines = np.array([[text.count("\n") + 1 for text in row] for row in self._texts],
+                         dtype=float).reshape(self._nrows, self._ncols)
+        left, right, top, bottom = self._padding
+
+        heights = (self._leading * lines + top + bottom).max(axis=1) if self._ncols else \
+            np.zeros(self._nrows)
+        self._heights = [h if arg is None else arg for h, arg in zip(heights.tolist(), self._argH)]
+        self._offsets = np.concatenate(([0.], np.cumsum(self._heights)))
+
+        widths = list(self._argW)
+        if None in widths:
+            textWidth = np.zeros((self._nrows, self._ncols))
+            groups = defaultdict(lambda: ([], []))
+            for r, (row, fontRow, sizeRow) in enumerate(zip(self._texts, self._font.tolist(),
+                                                            self._fontSize.tolist())):
+                for c, (text, font, size) in enumerate(zip(row, fontRow, sizeRow)):
+                    if text and widths[c] is None:
+                        texts, cells = groups[(font, size)]
+                        texts.extend(text.split("\n"))
+                        cells.extend([r * self._ncols + c] * (text.count("\n") + 1))
+            for (font, size), (texts, cells) in groups.items():
+                np.maximum.at(textWidth.reshape(-1), cells,
+                              textWidths(texts, self._fonts[font], size))
+            measured = (textWidth + left + right).max(axis=0) if self._nrows else \
+                np.zeros(self._ncols)
+            widths = [w if arg is None else arg for w, arg in zip(measured.tolist(), widths)]
+        self._colWidths = widths
+        self._colpositions = [0.] + list(accumulate(widths))
+
+    @property
+    def _rowHeights(self):
+        self._calc()
+        return [h for first, last in self._ranges for h in self._heights[first:last]]
+
+    def _height(self):
+        return sum(self._offsets[last] - self._offsets[first] for first, last in self._ranges)
+
+    def rowCount(self):
+        """
+        Returns the number of rows of this part.
+        """
+        return sum(last - first for first, last in self._ranges)
+
+    def layoutKey(self):
+        """
+        Returns the layout state of the table, used as key in a LayoutCache.
+        """
+        return (self._texts, self._commands, self._argW, self._argH, self.repeatRows,
+                self._ranges, _layersKey(self.backgroundLayers), self.hAlign)
+
+    def wrap(self, availWidth, availHeight):
+        self._calc()
+        self.width, self.height = self._colpositions[-1], float(self._height())
+        return self.width, self.height
+
+    def _part(self, ranges):
+        part = copy.copy(self)
+        # state of the layout of this flowable in the document
+        for name in ("_postponed", "_frame", "canv"):
+            part.__dict__.pop(name, None)
+        part._ranges = ranges
+        return part
+
+    def split(self, availWidth, availHeight):
+        """
+        Returns the parts of the rows that fit in availHeight and of the
+        following rows with the repeated header rows.
+        """
+        self._calc()
+        offsets, count = self._offsets, 0
+        remaining = availHeight + 1e-6
+        for first, last in self._ranges:
+            height = offsets[last] - offsets[first]
+            if height <= remaining:
+                remaining -= height
+                count += last - first
+                continue
+            count += int(np.searchsorted(offsets, offsets[first] + remaining,
+                                         side="right")) - 1 - first
+            break
+        total = self.rowCount()
+        if count >= total:
+            return [self]
+        if count <= self.repeatRows:
+            return []
+        upper = self._part(_sliceRowRanges(self._ranges, 0, count))
+        lower = self._part(_sliceRowRanges(self._ranges, 0, self.repeatRows)
+                           + _sliceRowRanges(self._ranges, count, total))
+        # like Table, the space above stays with the first part
+        upper.spaceAfter = lower.spaceBefore = 0
+        return [upper, lower]
+
+    def _segments(self):
+        """
+        Returns (first, last, top) of the row ranges of this part, top is
+        the y position of the upper edge of row first.
+        """
+        segments = []
+        top = self._height()
+        for first, last in self._ranges:
+            segments.append((first, last, top))
+            top -= self._offsets[last] - self._offsets[first]
+        return segments
+
+    def draw(self):
+        self._calc()
+        canv = self.canv
+        canv.saveState()
+        segments = self._segments()
+        self._drawBackgrounds(segments)
+        self._drawTexts(segments)
+        self._drawLines(segments)
+        canv.restoreState()
+
+    def _drawBackgrounds(self, segments):
+        canv, cols, offsets = self.canv, self._colpositions, self._offsets
+        current = [None]
+
+        def rect(color, c0, c1, top, bottom):
+            if color is None:
+                return
+            if color is not current[0]:
+                canv.setFillColor(color)
+                current[0] = color
+            canv.rect(cols[c0], bottom, cols[c1 + 1] - cols[c0], top - bottom, stroke=0, fill=1)
+
+        for first, last, top in segments:
+            y = lambda r: top - (offsets[r] - offsets[first])
+            for op, (c0, r0, c1, r1), arg in self._backgrounds:
+                a, b = max(r0, first), min(r1, last - 1)
+                if a > b:
+                    continue
+                if op == "BACKGROUND":
+                    rect(colors.toColorOrNone(arg), c0, c1, y(a), y(b + 1))
+                elif op == "ROWBACKGROUNDS":
+                    cycle = [colors.toColorOrNone(color) for color in arg]
+                    for r in range(a, b + 1):
+                        rect(cycle[(r - r0) % len(cycle)], c0, c1, y(r), y(r + 1))
+                else:
+                    cycle = [colors.toColorOrNone(color) for color in arg]
+                    for c in range(c0, c1 + 1):
+                        rect(cycle[(c - c0) % len(cycle)], c, c, y(a), y(b + 1))
+            for row, col, indices, palette in self.backgroundLayers:
+                a, b = max(row, first), min(row + len(indices), last)
+                if a >= b or col >= self._ncols:
+                    continue
+                for q0, p0, q1, p1, k in colorRectangles(indices[a - row:b - row,
+                                                                 :self._ncols - col]):
+                    rect(palette[k], col + p0, col + p1, y(a + q0), y(a + q1 + 1))
+
+    def _drawTexts(self, segments):
+        canv, cols, offsets = self.canv, self._colpositions, self._offsets
+        cells = []
+        # the lines not aligned left are measured at once, by font and size
+        measure = defaultdict(set)
+        for first, last, top in segments:
+            for r in range(first, last):
+                rowTop = top - (offsets[r] - offsets[first])
+                row = (self._texts[r], self._font[r].tolist(), self._fontSize[r].tolist(),
+                       self._leading[r].tolist(), self._color[r].tolist(),
+                       self._align[r].tolist(), self._valign[r].tolist(),
+                       *self._padding[:, r].tolist())
+                for c, cell in enumerate(zip(*row)):
+                    if cell[0]:
+                        if cell[5]:
+                            measure[(cell[1], cell[2])].update(cell[0].split("\n"))
+                        cells.append((c, rowTop, offsets[r + 1] - offsets[r]) + cell)
+        widths = {}
+        for (font, size), texts in measure.items():
+            texts = list(texts)
+            for line, width in zip(texts, textWidths(texts, self._fonts[font], size).tolist()):
+                widths[(font, size, line)] = width
+
+        text = canv.beginText()
+        fontState = colorState = None
+        for (c, rowTop, rowHeight, value, font, size, leading, color, align, valign,
+             left, right, top, bottom) in cells:
+            if fontState != (font, size, leading):
+                fontState = (font, size, leading)
+                text.setFont(self._fonts[font], size, leading)
+            if colorState != color:
+                colorState = color
+                text.setFillColor(self._textColors[color])
+            lines = value.split("\n")
+            if valign == 0:
+                y = rowTop - rowHeight + bottom + len(lines) * leading - size
+            elif valign == 1:
+                y = rowTop - top - size
+            else:
+                y = rowTop - rowHeight + (bottom + rowHeight - top + len(lines) * leading) / 2.0 - size
+            for line in lines:
+                if align == 0:
+                    x = cols[c] + left
+                elif align == 1:
+                    x = cols[c + 1] - right - widths[(font, size, line)]
+                else:
+                    x = (cols[c] + cols[c + 1] + left - right) * 0.5 - widths[(font, size, line)] * 0.5
+                text.setTextOrigin(x, y)
+                text.textOut(line)
+                y -= leading
+        canv.drawText(text)
+
+    def _drawLines(self, segments):
+        canv, cols, offsets = self.canv, self._colpositions, self._offsets
+        paths = OrderedDict()
+
+        def add(style, count, space, x0, y0, x1, y1):
+            path = paths.get(style)
+            if path is None:
+                path = paths[style] = canv.beginPath()
+            step = style[0] + space
+            offset = 0.5 * (count - 1) * step
+            for i in range(count):
+                d = offset - i * step
+                if y0 == y1:
+                    path.moveTo(x0, y0 + d)
+                    path.lineTo(x1, y1 + d)
+                else:
+                    path.moveTo(x0 + d, y0)
+                    path.lineTo(x1 + d, y1)
+
+        for op, (c0, r0, c1, r1), style, count, space in self._lines:
+            # rows with a line above, with a line below and pairs of rows
+            # with a line between them, as (first, last) of the rows
+            above = below = between = None
+            columns = ()
+            if op in ("BOX", "OUTLINE", "GRID"):
+                above, below, columns = (r0, r0), (r1, r1), (c0, c1 + 1)
+            if op in ("INNERGRID", "GRID"):
+                between, columns = (r0, r1 - 1), columns + tuple(range(c0 + 1, c1 + 1))
+            if op == "LINEABOVE":
+                above = (r0, r1)
+            elif op == "LINEBELOW":
+                below = (r0, r1)
+            elif op == "LINEBEFORE":
+                columns = range(c0, c1 + 1)
+            elif op == "LINEAFTER":
+                columns = range(c0 + 1, c1 + 2)
+            x0, x1 = cols[c0], cols[c1 + 1]
+            for first, last, top in segments:
+                y = lambda r: top - (offsets[r] - offsets[first])
+                if above:
+                    for r in range(max(above[0], first), min(above[1], last - 1) + 1):
+                        add(style, count, space, x0, y(r), x1, y(r))
+                if below:
+                    for r in range(max(below[0], first), min(below[1], last - 1) + 1):
+                        add(style, count, space, x0, y(r + 1), x1, y(r + 1))
+                if between:
+                    # the lines at the edges of a part are drawn too
+                    for r in range(max(between[0], first - 1), min(between[1], last - 1) + 1):
+                        add(style, count, space, x0, y(r + 1), x1, y(r + 1))
+                a, b = max(r0, first), min(r1, last - 1)
+                if a <= b:
+                    for c in columns:
+                        add(style, count, space, cols[c], y(a), cols[c], y(b + 1))
+
+        for (weight, color, cap, dash, join), path in paths.items():
+            canv.saveState()
+            canv.setLineWidth(weight)
+            canv.setStrokeColor(color)
+            if cap is not None:
+                canv.setLineCap(cap)
+            if join is not None:
+                canv.setLineJoin(join)
+            if dash:
+                canv.setDash(list(dash))
+            canv.drawPath(path, stroke=1, fill=0)
+            canv.restoreState()
+
+
+class StreamingTable(Flowable):
+    """
+    table flowable pulling its rows from an iterator
+
+    The rows are read while the frames are filled, every frame gets a
+    reportlab Table of the rows that fit, with the header rows of the
+    StyledTable on top. Only the rows of about one frame are held at a
+    time, so the memory stays bounded for any number of rows.
+
+    The style commands of the StyledTable apply to every part, commands on
+    given rows are moved to the part holding these rows. Rows are counted
+    with the header rows, like in the StyledTable.
+
+    A split returns a new StreamingTable for the remaining rows. Laying out
+    the flowable again, e.g. in the next pass of a multiBuild, restarts the
+    rows, which is only possible if they are given by a sequence or by a
+    function returning an iterator. A plain iterator raises a ValueError.
+    """
+
+    # attributes set on a flowable while it is laid out
+    _transient = ("_postponed", "_frame", "canv", "_table")
+
+    def __init__(self, styledTable, rows, colWidths=None, batchSize=64):
+        """
+        :param styledTable: the header rows and the styles of the table
+        :type styledTable: StyledTable
+        :param rows: iterable of table lines or a function returning one
+        :param colWidths: the columns width in cm
+        :type colWidths: list
+        :param batchSize: number of rows pulled at once
+        :type batchSize: int
+        """
+        Flowable.__init__(self)
+        self.styledTable = styledTable
+        self.colWidths = [x * cm for x in colWidths] if colWidths else None
+        self.hAlign = styledTable.hTableAlignment
+        self.batchSize = batchSize
+        self.rowHeight = styledTable.fixedRowHeight
+        self.header = styledTable._rows(0, styledTable.headerRow)
+        self.commands = (styledTable.tableStyleCommands
+                         + styledTable._layoutTableCommands()
+                         + styledTable.tableExtraStyleCommands)
+        # the number of rows is not known, commands on rows counted from
+        # the end apply to every part
+        self._styleIndex = StyleIndex(self.commands)
+        self.source = rows
+        # the iterator of the rows, started on the first wrap
+        self._rows = None
+        self._exhausted = False
+        # rows pulled but not laid out, the first has the index start
+        self._pending = []
+        self._start = len(self.header)
+        self._table = None
+        # True once the rows were drawn or passed on to a remainder
+        self._consumed = False
+
+    def _restart(self):
+        """
+        starts the rows from the beginning
+        """
+        if callable(self.source):
+            self._rows = iter(self.source())
+        elif self._rows is not None and iter(self.source) is self.source:
+            raise ValueError("the rows of a StreamingTable given by an iterator can only be "
+                             "laid out once, pass a sequence or a function for multiBuild")
+        else:
+            self._rows = iter(self.source)
+        self._exhausted = False
+        self._pending = []
+        self._start = len(self.header)
+        self._table = None
+        self._consumed = False
+
+    def _remainder(self, done):
+        """
+        returns a StreamingTable of the rows after the first done pending
+        rows, it continues the iterator of this one
+        """
+        rest = StreamingTable.__new__(StreamingTable)
+        rest.__dict__.update((key, value) for key, value in self.__dict__.items()
+                             if key not in self._transient)
+        rest._pending = self._pending[done:]
+        rest._start = self._start + done
+        rest._table = None
+        self._consumed = True
+        return rest
+
+    def _pull(self, count):
+        """
+        pulls count more rows from the iterator
+        """
+        padding = self.styledTable.leftTablePadding > 0
+        for i in range(count):
+            try:
+                line = next(self._rows)
+            except StopIteration:
+                self._exhausted = True
+                break
+            line = list(line)
+            if padding:
+                line.insert(0, "")
+            self._pending.append(line)
+
+    def _makeTable(self):
+        """
+        returns a Table of the header and the pending rows
+        """
+        headerRows = len(self.header)
+        rowHeights = None
+        if self.rowHeight:
+            rowHeights = [self.rowHeight] * (headerRows + len(self._pending))
+        commands = self._styleIndex.remap(self._start, self._start + len(self._pending),
+                                          headerRows)
+        layers = self.styledTable.backgroundLayers
+        if layers:
+            rows = list(range(headerRows)) + list(range(self._start,
+                                                         self._start + len(self._pending)))
+            table = LayeredTable(self.header + self._pending, colWidths=self.colWidths,
+                                 rowHeights=rowHeights, repeatRows=headerRows,
+                                 spaceBefore=0, spaceAfter=0,
+                                 backgroundLayers=_selectLayerRows(layers, rows))
+        else:
+            table = Table(self.header + self._pending, colWidths=self.colWidths,
+                          rowHeights=rowHeights, repeatRows=headerRows,
+                          spaceBefore=0, spaceAfter=0)
+        tableStyle = getTableStyle()
+        for cmd in commands:
+            if cmd:
+                tableStyle.add(*cmd)
+        table.setStyle(tableStyle)
+        table.hAlign = self.hAlign
+        return table
+
+    def wrap(self, availWidth, availHeight):
+        """
+        pulls rows until they exceed availHeight, returns the size of the
+        table of the pulled rows
+        """
+        if self._rows is None or self._consumed:
+            self._restart()
+        if self.rowHeight:
+            # the rows of the frame and one more are pulled at once
+            missing = int(availHeight / self.rowHeight) + 1 - len(self.header) - len(self._pending)
+            if missing > 0:
+                self._pull(missing)
+        while True:
+            if not self._pending and not self._exhausted:
+                self._pull(self.batchSize)
+            self._table = self._makeTable()
+            width, height = self._table.wrap(availWidth, availHeight)
+            if height > availHeight or self._exhausted:
+                return width, height
+            self._pull(max(len(self._pending), self.batchSize))
+
+    def split(self, availWidth, availHeight):
+        """
+        returns the Table of the rows that fit in availHeight and a
+        StreamingTable of the following rows
+        """
+        if self._table is None:
+            self.wrap(availWidth, availHeight)
+        parts = self._table.split(availWidth, availHeight)
+        self._table = None
+        if not parts:
+            return []
+        done = len(parts[0]._cellvalues) - len(self.header)
+        if done <= 0:
+            return []
+        if done >= len(self._pending) and self._exhausted:
+            self._consumed = True
+            return parts[:1]
+        return [parts[0], self._remainder(done)]
+
+    def draw(self):
+        self._table.drawOn(self.canv, 0, 0)
+        self._pending = []
+        self._consumed = True
+
+
+# % formats of a number with a text length growing with its magnitude
+_monotonicFormat = re.compile(r"^[^%]*%[-+ 0#]*\d*(\.\d+)?[dif][^%]*$")
+
+
+class _ColumnRows(object):
+    """
+    the body rows of a ColumnarTable, formatted when they are sliced
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.bodyCount()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self.table.rows(start, stop)[::step]
+        if index < 0:
+            index += len(self)
+        return self.table.rows(index, index + 1)[0]
+
+
+class ColumnarTable(StyledTable):
+    """
+    StyledTable holding its body as columns, e.g. NumPy arrays or the
+    columns of a pandas DataFrame
+
+    The header rows are added with addTableHeader as in a StyledTable. The
+    body is given by setColumns, the columns are formatted one at a time
+    and only for the rows that are needed. Splitting the table,
+    views and streamingTable format only the rows of their part::
+
+        table = ColumnarTable(gridded=True)
+        table.setColumns(dataFrame, formats={"price": "%.3f"}, header=True)
+        story.append(table.streamingTable())
+
+    Numeric columns are right aligned. The texts of a column are built
+    from one conversion of its values (ndarray.tolist or astype), which is
+    faster than the element wise string functions of NumPy, and the column
+    widths of numeric columns are estimated from their minimum and maximum.
+    """
+
+    #: default format of float columns
+    floatFormat = "%.2f"
+    #: default format of integer columns
+    intFormat = "%d"
+
+    def __init__(self, gridded=False, leftTablePadding=0, hTableAlignment=None, colWidths=None):
+        """
+        see StyledTable
+        """
+        self.columns = []
+        self.formats = []
+        self._tableData = None
+        StyledTable.__init__(self, gridded=gridded, leftTablePadding=leftTablePadding,
+                             hTableAlignment=hTableAlignment, colWidths=colWidths)
+
+    @property
+    def tableData(self):
+        """
+        the header rows and, if columns are set, all body rows formatted
+        """
+        if not self.columns:
+            return self._head
+        if self._tableData is None:
+            self._tableData = self._head + self.rows(0, self.bodyCount())
+        return self._tableData
+
+    @tableData.setter
+    def tableData(self, data):
+        self._head = data
+        self.columns = []
+        self.formats = []
+        self._tableData = None
+        self.invalidateLayout()
+
+    def setColumns(self, data, formats=None, header=False):
+        """
+        Sets the columns of the body.
+
+        :param data: a pandas DataFrame, a dict of columns, a 2-d array or
+            a list of columns, columns are anything numpy.asarray accepts
+        :param formats: formats of the columns by name or index, a % format
+            string or a function returning the text of a value
+        :type formats: dict
+        :param header: if True, the column names are added as header
+        :type header: bool
+        """
+        if hasattr(data, "columns") and hasattr(data, "iloc"):
+            names = [str(name) for name in data.columns]
+            columns = [data.iloc[:, i].to_numpy() for i in range(len(names))]
+        elif isinstance(data, dict):
+            names = [str(name) for name in data]
+            columns = [np.asarray(column) for column in data.values()]
+        elif isinstance(data, np.ndarray) and data.ndim == 2:
+            names = [str(i) for i in range(data.shape[1])]
+            columns = [data[:, i] for i in range(data.shape[1])]
+        else:
+            columns = [np.asarray(column) for column in data]
+            names = [str(i) for i in range(len(columns))]
+        if len(set(len(column) for column in columns)) > 1:
+            raise ValueError("columns of different length")
+
+        formats = formats or {}
+        self.formats = []
+        for i, (name, column) in enumerate(zip(names, columns)):
+            fmt = formats.get(name, formats.get(i))
+            if fmt is None and column.dtype.kind in "iu":
+                fmt = self.intFormat
+            elif fmt is None and column.dtype.kind == "f":
+                fmt = self.floatFormat
+            self.formats.append(fmt)
+            if column.dtype.kind in "iuf":
+                self.addTableStyleCommand(("ALIGN", (self.offsetCol + i, 0),
+                                           (self.offsetCol + i, -1), "RIGHT"))
+        self.columns = columns
+        self._tableData = None
+        self.invalidateLayout()
+        if header:
+            self.addTableHeader(names)
+
+    def addTableHeader(self, line, fonttype="bold", color="blue"):
+        columns, self.columns = self.columns, []
+        try:
+            StyledTable.addTableHeader(self, line, fonttype, color)
+        finally:
+            self.columns = columns
+            self._tableData = None
+
+    def addTableLine(self, line):
+        if self.columns:
+            raise TypeError("the body of a ColumnarTable is set by setColumns")
+        StyledTable.addTableLine(self, line)
+
+    def bodyCount(self):
+        """
+        Returns the number of body rows.
+        """
+        return len(self.columns[0]) if self.columns else 0
+
+    def _formatColumn(self, i, start, end):
+        """
+        Returns the texts of the rows start:end of column i.
+        """
+        column, fmt = self.columns[i][start:end], self.formats[i]
+        kind = column.dtype.kind
+        if fmt == "%d" and kind in "iu":
+            return column.astype(str).tolist()
+        if kind == "f":
+            missing = np.isnan(column)
+            if missing.any():
+                texts = self._formatValues(fmt, column.tolist())
+                return [("" if m else t) for m, t in zip(missing.tolist(), texts)]
+        if kind == "O":
+            # None and NaN of missing values
+            return ["" if value is None or value != value else self._formatValue(fmt, value)
+                    for value in column]
+        return self._formatValues(fmt, column.tolist())
+
+    @staticmethod
+    def _formatValue(fmt, value):
+        if fmt is None:
+            return str(value)
+        if callable(fmt):
+            return fmt(value)
+        return fmt % value
+
+    @staticmethod
+    def _formatValues(fmt, values):
+        if fmt is None:
+            return [str(value) for value in values]
+        if callable(fmt):
+            return [fmt(value) for value in values]
+        return [fmt % value for value in values]
+
+    def rows(self, start, end, padding=True):
+        """
+        Returns the body rows start:end as table lines, the columns are
+        formatted for these rows only.
+
+        :param padding: if True, the empty column of leftTablePadding is
+            inserted
+        """
+        start, end = max(start, 0), min(end, self.bodyCount())
+        if start >= end:
+            return []
+        columns = [self._formatColumn(i, start, end) for i in range(len(self.columns))]
+        if padding and self.leftTablePadding > 0:
+            columns.insert(0, [""] * (end - start))
+        return list(map(list, zip(*columns)))
+
+    def iterRows(self, batchSize=256):
+        """
+        Yields the body rows without padding, formatted in batches.
+        """
+        for start in range(0, self.bodyCount(), batchSize):
+            for row in self.rows(start, start + batchSize, padding=False):
+                yield row
+
+    def streamingTable(self, rows=None, colWidths=None, batchSize=64):
+        """
+        see StyledTable.streamingTable, the rows default to the columns
+        """
+        if rows is None:
+            rows = self.iterRows
+        return StyledTable.streamingTable(self, rows, colWidths=colWidths,
+                                          batchSize=batchSize)
+
+    def _rowSegments(self):
+        if not self.columns or self._tableData is not None:
+            return StyledTable._rowSegments(self)
+        return [(self._head, 0, len(self._head)),
+                (_ColumnRows(self), 0, self.bodyCount())]
+
+    def linesCount(self):
+        return len(self._head) + self.bodyCount()
+
+    def colsCount(self):
+        if not self.columns:
+            return StyledTable.colsCount(self)
+        return len(self.columns) + self.offsetCol
+
+    def columnWidthEstim(self, data=None):
+        """
+        Returns minimum column width for all lines in the column.
+
+        Without data the widths of the body are estimated per column from
+        its longest text, numeric columns only format their minimum and
+        maximum.
+        """
+        if data is not None or not self.columns:
+            return StyledTable.columnWidthEstim(self, data)
+        widths = StyledTable.columnWidthEstim(self, self._head) if self._head else []
+        widths += [0] * (self.colsCount() - len(widths))
+        for i in range(len(self.columns)):
+            column, fmt = self.columns[i], self.formats[i]
+            if not len(column):
+                continue
+            if (column.dtype.kind in "iuf" and isinstance(fmt, str)
+                    and _monotonicFormat.match(fmt)):
+                # the longest text is the one of the smallest or largest value
+                values = column[~np.isnan(column)] if column.dtype.kind == "f" else column
+                if not len(values):
+                    continue
+                texts = [fmt % values.min(), fmt % values.max()]
+            else:
+                texts = self._formatColumn(i, 0, len(column))
+            longest = max(texts, key=len)
+            col = self.offsetCol + i
+            widths[col] = max(widths[col], self.widthEstim(longest))
+        return widths
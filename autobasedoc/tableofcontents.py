@@ -10,7 +10,7 @@ tableofcontents
 
 """
 from reportlab import rl_config
-from reportlab.platypus import Table, Paragraph, PageBreak
+from reportlab.platypus import Table, Paragraph, PageBreak, Spacer
 from reportlab.platypus.tableofcontents import TableOfContents, drawPageNumbers
 
 class AutoTableOfContents(TableOfContents):
@@ -41,7 +41,11 @@ class AutoTableOfContents(TableOfContents):
                 dot = ''
             if self.formatter: page = self.formatter(page)
             drawPageNumbers(canvas, style, [(page, key)], availWidth, availHeight, dot)
-        self.canv.drawTOCEntryEnd = drawTOCEntryEnd
+        # newer reportlab versions look up onDraw callbacks by name
+        if hasattr(self.canv, 'setNamedCB'):
+            self.canv.setNamedCB('drawTOCEntryEnd', drawTOCEntryEnd)
+        else:
+            self.canv.drawTOCEntryEnd = drawTOCEntryEnd
 
         tableData = []
         for (level, text, pageNum, key) in _tempEntries:
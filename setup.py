@@ -120,6 +120,6 @@ setup(name=name,
       scripts=scripts,
       data_files=data_files,
       #test_suite='setup.my_test_suite', 
-      install_requires=['reportlab','pdfrw','svglib', 'cycler', 'matplotlib>=3.5','img2pdf'],
+      install_requires=['reportlab','pdfrw','svglib', 'cycler', 'matplotlib>=3.5','img2pdf','numpy'],
       include_package_data=True,
       )
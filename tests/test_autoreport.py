@@ -4,9 +4,12 @@ Created on Wed Oct 14 16:50:28 2015
 
 @author: ecksjoh
 """
+import json
 import numpy as np
 import os
 import sys
+import shutil
+import tempfile
 import unittest
 from faker import Faker
 
@@ -117,6 +120,18 @@ def drawLaterLandscape(canv, doc):
     canv.restoreState()
 
 
+def portraitDoc(name=None, **kwargs):
+    """
+    returns a document of portrait pages written to name in the examples
+    folder, or to memory if name is None
+    """
+    target = ap.BytesIO() if name is None else os.path.join(__examples__, name)
+    return ar.AutoDocTemplate(target,
+                              onFirstPage=(drawFirstPortrait, 0),
+                              onLaterPages=(drawLaterPortrait, 0),
+                              **kwargs)
+
+
 class Test_AutoBaseDoc(unittest.TestCase):
     """
     Haupttestklasse für AutoBaseDoc-Funktionalität.
@@ -291,6 +306,1118 @@ class Test_AutoBaseDoc(unittest.TestCase):
         """
         self.doc.multiBuild(self.contents)
 
+    def test_missing(self):
+        """
+        unknown page templates and frames raise a KeyError naming them
+        """
+        self.assertEqual(self.doc.getTemplate("Later").id, "LaterPortrait")
+        with self.assertRaisesRegex(KeyError, "Missing"):
+            self.doc.getTemplate("Missing")
+        with self.assertRaisesRegex(KeyError, "Missing"):
+            self.doc.getFrame("Missing")
+        with self.assertRaisesRegex(KeyError, "Landscape"):
+            self.doc.getFrame("First", orientation="Landscape")
+
+
+class Test_IncrementalMultiBuild(unittest.TestCase):
+    """
+    compares the incremental multiBuild with the standard multiBuild
+    """
+
+    def setUp(self):
+        self.fake = Faker()
+        Faker.seed(4711)
+
+        self.styles = ar.Styles()
+        self.styles.registerStyles()
+
+        self.contents = [ar.Paragraph(u"Minimal Example Title", self.styles.title),
+                         ar.PageBreak(),
+                         ar.Paragraph(u"Inhaltsverzeichnis", self.styles.h1),
+                         ar.doTabelOfContents(),
+                         ar.PageBreak()]
+
+        for i in range(40):
+            self.contents.extend(ar.doHeading(self.fake.word(), self.styles.h1))
+            self.contents.append(ar.Paragraph(self.fake.text(max_nb_chars=1200),
+                                              self.styles.normal))
+            self.contents.extend(ar.doHeading(self.fake.word(), self.styles.h2))
+            self.contents.append(ar.Paragraph(self.fake.text(max_nb_chars=1200),
+                                              self.styles.normal))
+
+    def buildDoc(self, incremental):
+        """
+        returns toc entries, number of pages and number of pages drawn
+        """
+        doc = portraitDoc("test_incremental_%d.pdf" % incremental)
+        drawn = []
+        doc.setPageCallBack(drawn.append)
+        toc = [f for f in self.contents if f.isIndexing()][0]
+
+        doc.multiBuild(self.contents, incremental=incremental)
+
+        return [e[:3] for e in toc._entries], doc.canv.getPageNumber(), len(drawn)
+
+    def test_incrementalBuild(self):
+        """
+        same toc and pages, but fewer pages laid out
+        """
+        entries, pages, drawn = self.buildDoc(incremental=False)
+        entriesInc, pagesInc, drawnInc = self.buildDoc(incremental=True)
+
+        self.assertEqual(entries, entriesInc)
+        self.assertEqual(pages, pagesInc)
+        self.assertLess(drawnInc, drawn)
+
+
+class Test_ShardedBuild(unittest.TestCase):
+    """
+    compares the sharded build with the standard multiBuild
+    """
+
+    def makeContents(self):
+        fake = Faker()
+        Faker.seed(4711)
+
+        styles = ar.Styles()
+        styles.registerStyles()
+
+        contents = [ar.Paragraph(u"Minimal Example Title", styles.title),
+                    ar.PageBreak(),
+                    ar.Paragraph(u"Inhaltsverzeichnis", styles.h1),
+                    ar.doTabelOfContents(),
+                    ar.PageBreak()]
+
+        for i in range(12):
+            contents.extend(ar.doHeading(fake.word(), styles.h1))
+            contents.append(ar.Paragraph(fake.text(max_nb_chars=1200),
+                                         styles.normal))
+            contents.extend(ar.doHeading(fake.word(), styles.h2))
+            contents.append(ar.Paragraph(fake.text(max_nb_chars=1200),
+                                         styles.normal))
+            contents.append(ar.PageBreak())
+
+        # a link from the table of contents shard into the last shard
+        key = [f.key for f in contents if isinstance(f, ar.Bookmark)][-1]
+        contents.insert(2, ar.Paragraph(u'<a href="#%s">last</a>' % key,
+                                        styles.normal))
+        return contents
+
+    def test_shardedBuild(self):
+        """
+        same toc and pages as multiBuild
+        """
+        from pdfrw import PdfReader
+
+        contents = self.makeContents()
+        doc = portraitDoc("test_sharded_0.pdf")
+        doc.multiBuild(contents)
+        entries = [f for f in contents if f.isIndexing()][0]._entries
+        pages = doc.page
+
+        contents = self.makeContents()
+        doc = portraitDoc("test_sharded_1.pdf")
+        fname = doc.filename
+        pagesShard = doc.shardedBuild(contents, processes=2, shards=3)
+        entriesShard = [f for f in contents if f.isIndexing()][0]._entries
+
+        self.assertEqual([e[:3] for e in entries], [e[:3] for e in entriesShard])
+        self.assertEqual(pages, pagesShard)
+
+        pdf = PdfReader(fname)
+        self.assertEqual(len(pdf.pages), pages)
+        self.assertEqual(int(pdf.Root.Outlines.Count), 12)
+        link = pdf.pages[1].Annots[0].Dest
+        self.assertIs(link[0], pdf.pages[-1])
+
+
+class Test_Paginate(unittest.TestCase):
+    """
+    compares the pagination dry-run with the standard multiBuild
+    """
+
+    def setUp(self):
+        fake = Faker()
+        Faker.seed(4711)
+
+        styles = ar.Styles()
+        styles.registerStyles()
+
+        self.contents = [ar.Paragraph(u"Inhaltsverzeichnis", styles.h1),
+                         ar.doTabelOfContents(),
+                         ar.PageBreak()]
+
+        for i in range(20):
+            self.contents.extend(ar.doHeading(fake.word(), styles.h1))
+            self.contents.append(ar.Paragraph(fake.text(max_nb_chars=2000),
+                                              styles.normal))
+            table = ar.StyledTable(gridded=True)
+            for row in range(30):
+                table.addTableLine(["%d" % row, fake.word()])
+            self.contents.append(table.layoutStyledTable())
+
+        self.doc = portraitDoc("test_paginate.pdf")
+
+    def test_paginate(self):
+        """
+        same pages and bookmark pages as multiBuild
+        """
+        pageMap, pages = self.doc.paginate(self.contents)
+        bookmarks = [(f.key, page) for f, page in pageMap.items()
+                     if isinstance(f, ar.Bookmark)]
+
+        self.doc.multiBuild(self.contents)
+        entries = [f for f in self.contents if f.isIndexing()][0]._entries
+
+        self.assertEqual(pages, self.doc.page)
+        self.assertEqual(bookmarks, [(e[3], e[2]) for e in entries])
+        self.assertEqual(len(pageMap), len(self.contents))
+        self.assertEqual(pageMap[self.contents[0]], 1)
+
+
+class Chapter(ar.Bookmark):
+    """
+    Bookmark subclass, cln returns its own class name
+    """
+
+
+class Section(ar.Bookmark):
+    """
+    Bookmark subclass marked by an instance method cln
+    """
+
+    def cln(self):
+        return "Bookmark" + self.__class__.__name__
+
+
+class Test_HandleFlowable(unittest.TestCase):
+    """
+    page breaks, actions, images and markers in handle_flowable and afterFlowable
+    """
+
+    def test_kinds(self):
+        """
+        every kind of flowable is handled as before
+        """
+        styles = ar.Styles()
+        styles.registerStyles()
+        doc = portraitDoc("test_handleflowable.pdf")
+        notes = []
+        doc.notify = lambda kind, stuff: notes.append((kind, stuff[1], stuff[2]))
+        image = ap.PdfImage(savePdfFigure([1, 2]), width=40 * ar.cm, height=30 * ar.cm)
+        story = [ar.Paragraph("one", styles.normal), ar.PageBreak(),
+                 ar.Paragraph("two", styles.normal), ar.SlowPageBreak(),
+                 ar.Paragraph("three", styles.normal), ar.ActionFlowable(("frameEnd",)),
+                 ar.Bookmark("Intro"), Chapter("Hidden"), Section("Shown"),
+                 ar.Header(), ar.Footer(), image]
+        doc.build(story)
+
+        self.assertEqual(doc.page, 4)
+        self.assertEqual(notes, [("TOCEntry", "Intro", 4), ("TOCEntry", "Shown", 4)])
+        frame = doc.getFrame("Later")[0]
+        self.assertLessEqual(image.drawWidth, frame._aW)
+        self.assertAlmostEqual(image.drawWidth / image.drawHeight, 4. / 3)
+
+
+class Test_LazyBuild(unittest.TestCase):
+    """
+    builds from a generator, that is consumed on demand
+    """
+
+    def setUp(self):
+        self.styles = ar.Styles()
+        self.styles.registerStyles()
+        self.toc = ar.doTabelOfContents()
+
+        self.doc = portraitDoc("test_lazy.pdf")
+
+    def makeStory(self, handled=None, ahead=None):
+        """
+        generator of the story, records how far it runs ahead
+        """
+        fake = Faker()
+        Faker.seed(4711)
+
+        yield self.toc
+        yield ar.PageBreak()
+        for i in range(200):
+            if ahead is not None:
+                ahead.append(i - len(handled))
+            if i % 10 == 0:
+                for f in ar.doHeading(fake.word(), self.styles.h1):
+                    yield f
+            yield ar.Paragraph(fake.text(max_nb_chars=400), self.styles.normal)
+
+    def test_lazyBuild(self):
+        """
+        same pages as multiBuild, with bounded lookahead
+        """
+        self.doc.multiBuild(list(self.makeStory()))
+        pages = self.doc.page
+        entries = [e[:3] for e in self.toc._entries]
+
+        handled, ahead = [], []
+        self.doc.setProgressCallBack(
+            lambda typ, value: typ == 'PROGRESS' and handled.append(value))
+        passes = self.doc.lazyBuild(lambda: self.makeStory(handled, ahead),
+                                    indexing=[self.toc], lookahead=8)
+
+        self.assertEqual(pages, self.doc.page)
+        self.assertEqual(entries, [e[:3] for e in self.toc._entries])
+        self.assertGreater(passes, 1)
+        self.assertLessEqual(max(ahead), 8 + 1)
+
+    def test_bookmarkIds(self):
+        """
+        the same Bookmark keys in every pass, with another lazyBuild and
+        Bookmarks created in between
+        """
+        ids = ar.Bookmark._ids
+        keys = []
+
+        def story():
+            passKeys = []
+            keys.append(passKeys)
+            yield self.toc
+            for i in range(30):
+                bookmark = ar.Bookmark("Chapter %d" % i)
+                passKeys.append(bookmark.key)
+                yield bookmark
+                yield ar.Paragraph("text " * 200, self.styles.normal)
+                if i == 10:
+                    ar.Bookmark("outside")
+                    other = portraitDoc("test_lazy_other.pdf")
+                    otherToc = ar.doTabelOfContents()
+                    other.lazyBuild(lambda: iter([otherToc, ar.Bookmark("other")]),
+                                    indexing=[otherToc])
+
+        passes = self.doc.lazyBuild(story, indexing=[self.toc])
+        self.assertEqual(len(keys), passes)
+        self.assertEqual(keys[-1], keys[0])
+        self.assertEqual([e[3] for e in self.toc._entries], keys[0])
+        self.assertIs(ar.Bookmark._ids, ids)
+
+
+class Test_BuildStats(unittest.TestCase):
+    """
+    instrumentation of a multiBuild
+    """
+
+    def test_instrument(self):
+        """
+        calls are recorded by flowable class, page and pass
+        """
+        fake = Faker()
+        Faker.seed(4711)
+
+        styles = ar.Styles()
+        styles.registerStyles()
+
+        contents = [ar.doTabelOfContents(), ar.PageBreak()]
+        for i in range(5):
+            contents.extend(ar.doHeading(fake.word(), styles.h1))
+            contents.append(ar.Paragraph(fake.text(max_nb_chars=3000),
+                                         styles.normal))
+
+        doc = ar.AutoDocTemplate(
+            os.path.join(__examples__, "test_buildstats.pdf"),
+            onFirstPage=(ar.drawFirstPortrait, 0),
+            onLaterPages=(ar.drawLaterPortrait, 0))
+        doc.pageInfos = {}
+        fname = os.path.join(__examples__, "test_buildstats.json")
+        stats = doc.instrument(fname)
+        passes = doc.multiBuild(contents)
+
+        self.assertEqual(stats.passes, passes)
+        self.assertEqual(sorted(stats.byPass), list(range(1, passes + 1)))
+        self.assertEqual(sorted(stats.byPage), list(range(1, doc.page + 1)))
+        self.assertEqual(stats.byPass[passes]["onPage"][0], doc.page)
+        self.assertEqual(stats.byPass[passes]["addPlugin"][0], doc.page)
+        paragraphs = stats.byClass["flowable"]["Paragraph"][0]
+        self.assertGreaterEqual(paragraphs, passes * 10)
+        self.assertGreaterEqual(stats.byClass["wrap"]["Paragraph"][0], paragraphs)
+        self.assertEqual(stats.top("handle", 1)[0][0], "Paragraph")
+
+        with open(fname) as fp:
+            self.assertEqual(json.load(fp)["passes"], passes)
+        os.remove(fname)
+
+
+class Test_LayoutCache(unittest.TestCase):
+    """
+    layout results of a former run are taken from the cache
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeContents(self):
+        fake = Faker()
+        Faker.seed(4711)
+
+        styles = ar.Styles()
+        styles.registerStyles()
+
+        contents = []
+        for i in range(5):
+            contents.append(ar.Paragraph(fake.text(max_nb_chars=2000),
+                                         styles.normal))
+            table = ar.StyledTable(gridded=True)
+            for row in range(60):
+                table.addTableLine(["%d" % row, fake.word()])
+            contents.append(table.layoutStyledTable())
+        return contents
+
+    def build(self, name, cache=None):
+        from pdfrw import PdfReader
+        doc = portraitDoc(name, layoutCache=cache)
+        fname = doc.filename
+        doc.build(self.makeContents())
+        return [page.Contents.stream for page in PdfReader(fname).pages]
+
+    def test_build(self):
+        """
+        same pages with a cold and a warm cache
+        """
+        pages = self.build("test_layoutcache_0.pdf")
+
+        cache = ar.LayoutCache(self.directory)
+        self.assertEqual(self.build("test_layoutcache_1.pdf", cache), pages)
+        self.assertEqual(cache.hits, 0)
+
+        cache = ar.LayoutCache(self.directory)
+        self.assertEqual(self.build("test_layoutcache_2.pdf", cache), pages)
+        self.assertGreater(cache.hits, 0)
+        self.assertEqual(cache.misses, 0)
+
+    def test_tableHeight(self):
+        """
+        measured table heights and eviction
+        """
+        doc = portraitDoc()
+        frame, pagesize = doc.getFrame("First")
+        self.assertEqual(frame.id, doc.getFrame("First")[0].id)
+
+        table = ar.StyledTable(gridded=True)
+        for row in range(40):
+            table.addTableLine(["%d" % row, "x" * row])
+        height = table.getTableHeight(frame)
+
+        cache = ar.LayoutCache(self.directory)
+        self.assertEqual(table.getTableHeight(frame, cache), height)
+        self.assertEqual(table.getTableHeight(frame, cache), height)
+        self.assertEqual(cache.hits, 1)
+
+        table.addTableLine(["40", "x"])
+        self.assertGreater(table.getTableHeight(frame, cache), height)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+        cache = ar.LayoutCache(self.directory, maxSize=1)
+        cache.put("x", height)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_signed(self):
+        """
+        files not signed with the secret are ignored, the memory is bounded
+        """
+        import pickle
+
+        secret = b"k" * 32
+        cache = ar.LayoutCache(self.directory, maxMemory=200, secret=secret)
+        cache.put("a", (1.5, 2.0))
+        cache.put("b", [1.0, 2.5])
+        cache = ar.LayoutCache(self.directory, secret=secret)
+        self.assertEqual(cache.get("a"), (1.5, 2.0))
+        self.assertEqual(cache.get("b"), [1.0, 2.5])
+
+        with open(os.path.join(self.directory, "a.cache"), "wb") as fp:
+            fp.write(b"\0" * 32 + b"p" + pickle.dumps(42))
+        self.assertIsNone(ar.LayoutCache(self.directory, secret=secret).get("a"))
+        self.assertIsNone(ar.LayoutCache(self.directory, secret=b"x" * 32).get("b"))
+
+        cache = ar.LayoutCache(self.directory, maxMemory=200, secret=secret)
+        for i in range(50):
+            cache.put("m%d" % i, [float(i)] * 10)
+        self.assertLessEqual(cache._memorySize, 200)
+        self.assertEqual(cache.get("m0"), [0.] * 10)
+
+
+def makeBatchStory(doc, data, resources):
+    """
+    story of one document of Test_ReportBatch
+    """
+    if data is None:
+        raise ValueError("no data")
+    return [ar.Paragraph(u"Customer %d " % data * 200, resources["styles"].normal)]
+
+
+def warmBatch():
+    """
+    shared resources of Test_ReportBatch
+    """
+    styles = ar.Styles()
+    styles.registerStyles()
+    return dict(styles=styles)
+
+
+class Test_ReportBatch(unittest.TestCase):
+    """
+    many documents rendered with warmed resources
+    """
+
+    def test_run(self):
+        """
+        documents, failures and timing of a batch
+        """
+        from autobasedoc.reportbatch import ReportBatch
+
+        jobs = [(os.path.join(__examples__, "test_batch_%d.pdf" % i), i)
+                for i in range(6)]
+        jobs.append((os.path.join(__examples__, "test_batch_x.pdf"), None))
+
+        with ReportBatch(makeBatchStory, warm=warmBatch, processes=2,
+                         docKwds=dict(onFirstPage=(drawFirstPortrait, 0),
+                                      onLaterPages=(drawLaterPortrait, 0))) as batch:
+            report = batch.run(jobs)
+
+        self.assertEqual([d[0] for d in report.documents], [j[0] for j in jobs])
+        self.assertEqual([d[0] for d in report.failed], [jobs[-1][0]])
+        for fname, seconds, pages, error in report.documents[:-1]:
+            self.assertTrue(os.path.exists(fname))
+            self.assertEqual(pages, 1)
+        self.assertGreater(report.throughput, 0)
+        self.assertLessEqual(report.latency(0.5), report.latency(0.95))
+
+
+class Test_AsyncBuild(unittest.TestCase):
+    """
+    build in an executor with progress events and cancellation
+    """
+
+    def setUp(self):
+        fake = Faker()
+        Faker.seed(4711)
+
+        styles = ar.Styles()
+        styles.registerStyles()
+
+        self.contents = [ar.doTabelOfContents(), ar.PageBreak()]
+        for i in range(10):
+            self.contents.extend(ar.doHeading(fake.word(), styles.h1))
+            self.contents.append(ar.Paragraph(fake.text(max_nb_chars=3000),
+                                              styles.normal))
+
+        self.doc = portraitDoc("test_async.pdf")
+
+    def test_progress(self):
+        """
+        one event per page and pass
+        """
+        import asyncio
+
+        events = []
+        passes = asyncio.run(self.doc.asyncBuild(self.contents,
+                                                 progress=events.append))
+
+        self.assertEqual(passes, 2)
+        self.assertEqual(len(events), 2 * self.doc.page)
+        self.assertEqual(events[-1], ar.BuildProgress(2, self.doc.page, 0))
+        self.assertEqual([e.page for e in events if e.passes == 2],
+                         list(range(1, self.doc.page + 1)))
+
+    def test_cancel(self):
+        """
+        the layout stops at the end of a page
+        """
+        import asyncio
+
+        events = []
+        tasks = []
+
+        def progress(event):
+            events.append(event)
+            if len(events) == 2:
+                tasks[0].cancel()
+
+        async def build():
+            tasks.append(asyncio.current_task())
+            await self.doc.asyncBuild(self.contents, progress=progress)
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(build())
+        self.assertLess(len(events), 4)
+
+
+class Test_SplitTable(unittest.TestCase):
+    """
+    page sized parts of a long table
+    """
+
+    def test_pages(self):
+        """
+        every part fits, the header is repeated and backgrounds are moved
+        """
+        doc = portraitDoc("test_splittable.pdf")
+        frame, pagesize = doc.getFrame("First")
+
+        table = ar.StyledTable(gridded=True)
+        for row in range(300):
+            table.addTableLine(["%d" % row, "x" * (row % 20)])
+        table.addTableHeader(["row", "text"])
+        table.addTableStyleCommand(("BACKGROUND", (0, 0), (-1, 0), ar.colors.pink))
+        table.addTableStyleCommand(("BACKGROUND", (0, 5), (-1, 120), ar.colors.beige))
+
+        parts = table.split_table_pages(frame, availableHeight=200)
+        self.assertGreater(len(parts), 3)
+        self.assertLessEqual(parts[0].getTableHeight(frame), 200)
+        rows = []
+        for part in parts:
+            self.assertLessEqual(part.getTableHeight(frame), frame._aH)
+            self.assertEqual(part.tableData[0], ["row", "text"])
+            rows.extend(part.tableData[1:])
+        self.assertEqual(rows, table.tableData[1:])
+
+        # beige rows 5..120 of the table start in the first row of the second part
+        first = len(parts[0].tableData)
+        backgrounds = [cmd for cmd in parts[1].tableStyleCommands
+                       if cmd[0] == "BACKGROUND"]
+        self.assertEqual(backgrounds[0], ("BACKGROUND", (0, 0), (-1, 0), ar.colors.pink))
+        last = min(120 - first + 1, len(parts[1].tableData) - 1)
+        self.assertEqual(backgrounds[1][1:3], ((0, 1), (-1, last)))
+
+        up, down = table.split_table_iterative(frame, frame._aH)
+        self.assertLessEqual(up.getTableHeight(frame), frame._aH)
+        self.assertEqual(len(up.tableData) + len(down.tableData), len(table.tableData) + 1)
+
+        doc.build([part.as_flowable for part in parts])
+
+    def test_views(self):
+        """
+        split parts share the cells and the style commands of their table
+        """
+        styles = ar.Styles()
+        styles.registerStyles()
+        table = ar.StyledTable(gridded=True)
+        for row in range(100):
+            table.addTableLine(["%d" % row, ar.Paragraph("cell %d" % row, styles.normal)])
+        commands = list(table.tableStyleCommands)
+
+        up, down = table.split_table(40)
+        self.assertEqual(up.linesCount(), 40)
+        self.assertEqual(down.linesCount(), 61)
+        self.assertEqual(down.colsCount(), 2)
+        self.assertIs(down.tableData[0], table.tableData[0])
+        self.assertIs(down.tableData[1][1], table.tableData[40][1])
+
+        middle, rest = down.split_table(30)
+        self.assertEqual(rest.tableData[0], table.tableData[0])
+        self.assertIs(rest.tableData[1], table.tableData[69])
+
+        up.addTableStyleCommand(("BACKGROUND", (0, 0), (-1, 0), ar.colors.pink))
+        self.assertIs(down.tableStyleCommands, table.tableStyleCommands)
+        self.assertEqual(table.tableStyleCommands, commands)
+        self.assertEqual(len(up.tableStyleCommands), len(commands) + 1)
+
+    def test_measure(self):
+        """
+        sizes are measured once until the table is changed
+        """
+        doc = portraitDoc()
+        frame, pagesize = doc.getFrame("First")
+        table = ar.StyledTable(gridded=True)
+        for row in range(50):
+            table.addTableLine(["%d" % row, "text"])
+        count = len(table.tableStyleCommands)
+
+        layouts = []
+        layoutTable = table.layoutTable
+        table.layoutTable = lambda *args: layouts.append(args) or layoutTable(*args)
+        height = table.getTableHeight(frame)
+        self.assertEqual(table.getTableHeight(frame), height)
+        self.assertEqual(sum(table.rowHeights(frame)), height)
+        self.assertEqual(len(layouts), 1)
+        table.as_flowable
+        self.assertEqual(len(table.tableStyleCommands), count)
+
+        table.addTableLine(["50", "text"])
+        longer = table.getTableHeight(frame)
+        self.assertGreater(longer, height)
+        table.tableData[0][1] = "text\nin two lines"
+        table.invalidateLayout()
+        self.assertGreater(table.getTableHeight(frame), longer)
+        self.assertEqual(len(layouts), 4)
+
+    def test_fixed_rows(self):
+        """
+        uniform rows are laid out without measuring the cells
+        """
+        doc = portraitDoc("test_fixedrows.pdf")
+        frame, pagesize = doc.getFrame("First")
+        table = ar.StyledTable(gridded=True)
+        table.addTableHeader(["row", "text"])
+        for row in range(500):
+            table.addTableLine(["%d" % row, "text %d" % row])
+        measured = table.rowHeights(frame)
+        pages = [len(part.tableData) for part in table.split_table_pages(frame)]
+
+        table.setFixedRowHeight()
+        self.assertEqual(table.rowHeights(frame), measured)
+        self.assertEqual(table.getTableHeight(frame), sum(measured))
+        parts = table.split_table_pages(frame)
+        self.assertEqual([len(part.tableData) for part in parts], pages)
+        self.assertEqual(parts[0].as_flowable._argH, measured[:pages[0]])
+
+        streamed = table.streamingTable(["%d" % row, "more"] for row in range(300))
+        doc.build([part.as_flowable for part in parts] + [streamed])
+
+    def test_direct_draw(self):
+        """
+        plain tables are drawn by a DirectTable of the same size
+        """
+        doc = portraitDoc("test_directtable.pdf")
+        frame, pagesize = doc.getFrame("First")
+        table = ar.StyledTable(gridded=True)
+        table.addTableHeader(["row", "text", "value"])
+        for row in range(400):
+            table.addTableLine([row, "text %d" % row + "\nmore" * (row % 9 == 0), row * 1.5])
+        table.addTableStyleCommand(("ALIGN", (2, 0), (2, -1), "RIGHT"))
+        table.addTableStyleCommand(("ROWBACKGROUNDS", (0, 1), (-1, -1),
+                                    [ar.colors.white, ar.colors.beige]))
+        table.addTableStyleCommand(("FONT", (1, 5), (1, 9), "Helvetica-Oblique", 12))
+        reference = table.as_flowable
+        reference.wrap(frame._aW, frame._aH)
+
+        table.directDraw = True
+        flowable = table.as_flowable
+        self.assertIsInstance(flowable, ar.DirectTable)
+        self.assertEqual(flowable.wrap(frame._aW, frame._aH),
+                         (reference._width, reference._height))
+        self.assertEqual(flowable._rowHeights, reference._rowHeights)
+        upper, lower = flowable.split(frame._aW, 300)
+        self.assertEqual(upper.rowCount() + lower.rowCount(), 401)
+        self.assertEqual(upper._rowHeights + lower._rowHeights, reference._rowHeights)
+
+        table.addTableLine([ar.Paragraph("paragraph", ar.ParagraphStyle("cell")),
+                            "", ""])
+        self.assertNotIsInstance(table.as_flowable, ar.DirectTable)
+        table.tableData.pop()
+
+        # the main path of the tables of a story
+        styled = table.layoutStyledTable(spaceBefore=0.5)
+        self.assertIsInstance(styled, ar.DirectTable)
+        self.assertEqual(styled.getSpaceBefore(), 0.5 * ar.cm)
+        table.fixedColWidths = [40, 150, 60]
+        self.assertEqual(table.layoutStyledTable()._argW, [40, 150, 60])
+        doc.build([table.as_flowable, styled])
+
+    def test_columns(self):
+        """
+        a wide table is cut into bands of the frame width repeating the key columns
+        """
+        doc = portraitDoc("test_columnbands.pdf")
+        frame, pagesize = doc.getFrame("First")
+        table = ar.StyledTable(gridded=True, leftTablePadding=20)
+        table.addTableHeader(["name"] + ["column %d" % col for col in range(40)])
+        for row in range(200):
+            table.addTableLine(["row %d" % row] + [row * col for col in range(40)])
+        table.addTableStyleCommand(("BACKGROUND", (5, 1), (30, 3), ar.colors.beige))
+
+        bands = table.split_table_columns(frame)
+        self.assertGreater(len(bands), 2)
+        columns = []
+        for band in bands:
+            self.assertLessEqual(sum(band.fixedColWidths), frame._aW)
+            self.assertEqual(band.tableData[0][:2], table.tableData[0][:2])
+            self.assertEqual(band.wrapTable(frame._aW, frame._aH)[0], sum(band.fixedColWidths))
+            columns.extend(band.tableData[0][2:])
+        self.assertEqual(columns, table.tableData[0][2:])
+        backgrounds = [cmd for cmd in bands[1].tableStyleCommands if cmd[0] == "BACKGROUND"]
+        self.assertEqual(backgrounds[0][1][1], 1)
+
+        parts = table.split_table_grid(frame)
+        self.assertEqual(len(parts) % len(bands), 0)
+        self.assertEqual(parts[len(bands)].tableData[0][2:], bands[0].tableData[0][2:])
+        for part in parts:
+            self.assertLessEqual(part.getTableHeight(frame), frame._aH)
+        doc.build([part.as_flowable for part in parts])
+
+    def test_style_index(self):
+        """
+        commands on rows are found by row range and moved to the parts
+        """
+        table = ar.StyledTable(gridded=False)
+        for row in range(100):
+            table.addTableLine(["%d" % row, "text"])
+        table.addTableHeader(["row", "text"])
+        commands = [("LINEBELOW", (0, 0), (-1, 0), 1, ar.colors.black),
+                    ("FONT", (0, 10), (0, 60), "Helvetica-Bold"),
+                    ("TEXTCOLOR", (0, -1), (-1, -1), ar.colors.red),
+                    ("ROWBACKGROUNDS", (0, 1), (-1, -1), [ar.colors.white, ar.colors.grey])]
+        for command in commands:
+            table.addTableStyleCommand(command)
+
+        index = ar.StyleIndex(commands, table.linesCount())
+        self.assertEqual(index.find(0, 5), [0, 3])
+        self.assertEqual(index.find(61, 100), [2, 3])
+
+        part = table._table_part(50, 80, 1)
+        for command in [("LINEBELOW", (0, 0), (-1, 0), 1, ar.colors.black),
+                        ("FONT", (0, 1), (0, 11), "Helvetica-Bold"),
+                        ("ROWBACKGROUNDS", (0, 1), (-1, 30), [ar.colors.grey, ar.colors.white])]:
+            self.assertIn(command, part.tableStyleCommands)
+        self.assertNotIn("TEXTCOLOR", [cmd[0] for cmd in part.tableStyleCommands])
+        last = table._table_part(80, 101, 1)
+        self.assertIn(("TEXTCOLOR", (0, 21), (-1, 21), ar.colors.red),
+                      last.tableStyleCommands)
+
+    def test_streaming(self):
+        """
+        rows pulled from a generator while the frames are filled
+        """
+        doc = portraitDoc("test_streamingtable.pdf")
+        table = ar.StyledTable(gridded=True)
+        table.addTableHeader(["row", "text"])
+        table.addTableStyleCommand(("BACKGROUND", (0, 0), (-1, 0), ar.colors.pink))
+        held = []
+
+        def rows():
+            for row in range(1000):
+                held.append(len(stream._pending))
+                yield row, "x" * (row % 20)
+
+        stream = table.streamingTable(rows())
+        doc.build([stream])
+
+        self.assertEqual(len(held), 1000)
+        self.assertGreater(doc.page, 10)
+        self.assertLess(max(held), 3 * 1000 // doc.page)
+
+    def test_streaming_multiBuild(self):
+        """
+        every pass of a multiBuild lays out all rows, iterators are refused
+        """
+        styles = ar.Styles()
+        styles.registerStyles()
+        table = ar.StyledTable(gridded=True)
+        table.addTableHeader(["row", "text"])
+
+        def rows():
+            return ((row, "x" * (row % 20)) for row in range(300))
+
+        def story(stream):
+            return ([ar.doTabelOfContents(), ar.PageBreak()] + list(ar.doHeading("Rows", styles.h1))
+                    + [stream] + list(ar.doHeading("After", styles.h1)))
+
+        doc = portraitDoc("test_streamingtoc.pdf")
+        contents = story(table.streamingTable(rows))
+        doc.multiBuild(contents)
+        pages = doc.page
+        self.assertGreater(pages, 5)
+        self.assertEqual([e[:3] for e in contents[0]._entries][-1][1:], ("After", pages))
+
+        doc = portraitDoc("test_streamingtoc.pdf")
+        with self.assertRaises(ValueError):
+            doc.multiBuild(story(table.streamingTable(rows())))
+
+    def test_columnar(self):
+        """
+        columns formatted for the rows of the parts only
+        """
+        import numpy as np
+
+        doc = portraitDoc("test_columnartable.pdf")
+        frame, pagesize = doc.getFrame("First")
+        formatted = []
+
+        def name(value):
+            formatted.append(value)
+            return "item %d" % value
+
+        table = ar.ColumnarTable(gridded=True)
+        table.setColumns({"item": np.arange(500), "price": np.linspace(0., 99.5, 500),
+                          "count": np.arange(500) * 3},
+                         formats={"item": name}, header=True)
+        table.columns[1][2] = np.nan
+        self.assertEqual(table.linesCount(), 501)
+        self.assertEqual(table.colsCount(), 3)
+        self.assertEqual(table.rows(1, 3), [["item 1", "0.20", "3"], ["item 2", "", "6"]])
+        self.assertIn(("ALIGN", (1, 0), (1, -1), "RIGHT"), table.tableStyleCommands)
+        del formatted[:]
+
+        up, down = table.split_table(100)
+        self.assertEqual(up.tableData[-1], ["item 98", "19.54", "294"])
+        self.assertEqual(len(formatted), 99)
+
+        widths = table.columnWidthEstim()
+        self.assertEqual(widths[1:], table.columnWidthEstim(table.tableData)[1:])
+
+        parts = table.split_table_pages(frame)
+        self.assertEqual(parts[1].tableData[0], ["item", "price", "count"])
+        doc.build([part.as_flowable for part in parts])
+
+
+class Test_ColumnWidths(unittest.TestCase):
+    """
+    column widths estimated per distinct cell
+    """
+
+    def test_estimate(self):
+        """
+        the same widths as widthEstim of every cell
+        """
+        table = ar.StyledTable()
+        data = [["%d" % row, "item %d" % (row % 7), row * 0.25, None]
+                for row in range(100)]
+        data += [["", u"\u00fcber \u2603 snow", 7, ar.Spacer(40, 1)],
+                ["two\nlines here", "x", True, "\n"],
+                ["short"]]
+        expected = [max(table.widthEstim(line[i]) if i < len(line) else 0 for line in data)
+                    for i in range(4)]
+        self.assertEqual(table.columnWidthEstim(data), expected)
+        self.assertEqual(table.columnWidthEstim(data * 1000), expected)
+        # equal numbers of other types are measured separately
+        self.assertEqual(table.columnWidthEstim([[1], [1.0], [True]]),
+                         table.columnWidthEstim([[True], [1.0], [1]]))
+        self.assertEqual(table.columnWidthEstim([[1], [1.0]]), [table.widthEstim(1.0)])
+
+    def test_widths(self):
+        """
+        the widths of texts measured at once, empty texts anywhere
+        """
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        from autobasedoc.styledtable import textWidths
+
+        texts = ["WWWW", "", u"\u00fcber", "a b", ""]
+        np.testing.assert_allclose(textWidths(texts, "Helvetica", 10),
+                                   [stringWidth(text, "Helvetica", 10) for text in texts])
+
+
+class Test_StyleCommands(unittest.TestCase):
+    """
+    style commands merged into ranges
+    """
+
+    def test_compile(self):
+        """
+        per row and per cell commands become one command per style
+        """
+        table = ar.StyledTable(gridded=True)
+        for row in range(300):
+            table.addTableLine(["%d" % row, "x", "y"])
+            table.setFontSizeColor(12, ar.colors.red, row, 1)
+            table.addTableStyleCommand(("BACKGROUND", (0, row), (-1, row),
+                                        [ar.colors.beige, ar.colors.white][row % 2]))
+        table.addHorizontalLines()
+        table.addTableExtraStyleCommand(("FONTSIZE", (1, 10), (1, 10), 8))
+
+        commands = table.compileStyleCommands()
+        self.assertLess(len(commands), 20)
+        self.assertIn(("ROWBACKGROUNDS", (0, 0), (-1, 299), [ar.colors.beige, ar.colors.white]),
+                      commands)
+        self.assertIn(("LINEBELOW", (0, 0), (-1, 299), 0.4, ar.color_dict().get("blue")),
+                      commands)
+        self.assertIn(("FONTSIZE", (1, 0), (1, 299), 12), commands)
+        # applied after the merged range
+        self.assertEqual(commands.index(("FONTSIZE", (1, 10), (1, 10), 8)),
+                         len(commands) - 1)
+
+        self.assertEqual(ar.compileStyleCommands([("FONT", (0, 0), (0, 0), "a"),
+                                                  ("FONT", (0, 1), (0, 1), "b"),
+                                                  ("FONT", (0, 1), (0, 1), "a")]),
+                         [("FONT", (0, 0), (0, 0), "a"), ("FONT", (0, 1), (0, 1), "b"),
+                          ("FONT", (0, 1), (0, 1), "a")])
+        table.layoutStyledTable().wrap(500, 10000)
+
+        # the paddings of the layouts are not stored in the table
+        count = len(table.tableStyleCommands), len(table.tableExtraStyleCommands)
+        for _ in range(3):
+            table.layoutStyledTable(rightPadding=0.2)
+            table.layoutFullWidthTable(ar.Frame(0, 0, 500, 700))
+        self.assertEqual((len(table.tableStyleCommands),
+                          len(table.tableExtraStyleCommands)), count)
+
+
+class Test_ConditionalFormat(unittest.TestCase):
+    """
+    cells colored by their values
+    """
+
+    def test_rules(self):
+        """
+        threshold rules become one command per area of a color
+        """
+        values = [[1, 5, 20], [2, 6, None], [3, 7, 30]]
+        indices, palette = ar.heatmapColors(values, rules=[(5, "red"), (0, ar.colors.white)])
+        self.assertEqual(indices.tolist(), [[0, 1, 1], [0, 1, -1], [0, 1, 1]])
+        self.assertEqual(palette, [ar.colors.white, ar.color_dict().get("red")])
+
+        table = ar.StyledTable(leftTablePadding=1)
+        table.addTableHeader(["a", "b", "c"])
+        for line in values:
+            table.addTableLine(["%s" % value for value in line])
+        table.addConditionalFormat(values, rules=[(5, "red"), (0, ar.colors.white)])
+        self.assertEqual(sorted(table.tableExtraStyleCommands, key=lambda cmd: cmd[1:3]), [
+            ("BACKGROUND", (1, 1), (1, 3), ar.colors.white),
+            ("BACKGROUND", (2, 1), (3, 1), ar.color_dict().get("red")),
+            ("BACKGROUND", (2, 2), (2, 2), ar.color_dict().get("red")),
+            ("BACKGROUND", (2, 3), (3, 3), ar.color_dict().get("red"))])
+
+        indices, palette = ar.heatmapColors(values, levels=3)
+        self.assertEqual(len(palette), 3)
+        self.assertEqual(palette[indices[0, 0]], ar.colors.white)
+        self.assertEqual(palette[indices[2, 2]], ar.colors.red)
+
+    def test_layer(self):
+        """
+        the background layer is painted by the table and follows its splits
+        """
+        doc = portraitDoc("test_heatmap.pdf")
+        values = np.add.outer(np.arange(200), np.arange(20)) % 17
+        table = ar.StyledTable(gridded=True)
+        table.addTableHeader(["%d" % col for col in range(20)])
+        for line in values:
+            table.addTableLine(["%d" % value for value in line])
+        table.addConditionalFormat(values, colormap=[ar.colors.white, ar.colors.green],
+                                   layer=True)
+        count = len(table.tableExtraStyleCommands)
+
+        self.assertIsInstance(table.as_flowable, ar.LayeredTable)
+        flowable = table.layoutStyledTable()
+        self.assertIsInstance(flowable, ar.LayeredTable)
+        self.assertEqual(len(table.tableExtraStyleCommands), count)
+        upper, lower = flowable.split(500, 400)
+        rows = len(upper._cellvalues)
+        row, col, indices, palette = lower.backgroundLayers[0]
+        self.assertEqual(row, 0)
+        # the layer starts below the header, in row 1 of the table
+        self.assertEqual(indices[0].tolist(),
+                         flowable.backgroundLayers[0][2][rows - 1].tolist())
+
+        parts = table.split_table_pages(doc.getFrame("First")[0])
+        self.assertEqual(parts[1].backgroundLayers[0][0], 1)
+        doc.build([part.layoutStyledTable() for part in parts])
+
+
+def savePdfFigure(values):
+    """
+    returns a pdf buffer of a plot of values
+    """
+    fig, ax = ap.plt.subplots(figsize=(3, 2))
+    ax.plot(values)
+    buf = ap.BytesIO()
+    fig.savefig(buf, format="pdf", metadata={"Title": "%r" % id(fig)})
+    ap.plt.close(fig)
+    return buf
+
+
+class Test_PdfImage(unittest.TestCase):
+    """
+    pdf pages embedded as form XObjects
+    """
+
+    def test_registry(self):
+        """
+        identical images are written once per document
+        """
+        first, second = savePdfFigure([1, 3, 2]), savePdfFigure([1, 3, 2])
+        self.assertNotEqual(first.getvalue(), second.getvalue())
+        images = [ap.PdfImage(first), ap.PdfImage(second), ap.PdfImage(first)]
+        self.assertEqual(len(set(image.digest for image in images)), 1)
+        other = ap.PdfImage(savePdfFigure([2, 1]))
+        self.assertNotEqual(other.digest, images[0].digest)
+
+        doc = portraitDoc("test_pdfimage.pdf")
+        fname = doc.filename
+        story = []
+        for image in images + [other]:
+            story.extend([image, ar.PageBreak()])
+        doc.build(story)
+        with open(fname, "rb") as fp:
+            self.assertEqual(fp.read().count(b"/Subtype /Form"), 2)
+
+
+    def test_cache(self):
+        """
+        sources are parsed once while they are not changed
+        """
+        from autobasedoc.pdfimage import pdfCache, PdfCache
+
+        buf = savePdfFigure([4, 1, 2])
+        misses, hits = pdfCache.misses, pdfCache.hits
+        image = ap.PdfImage(buf)
+        self.assertIs(ap.PdfImage(ap.BytesIO(buf.getvalue())).xobj, image.xobj)
+        self.assertEqual((pdfCache.misses - misses, pdfCache.hits - hits), (1, 1))
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, "figure.pdf")
+            with open(fname, "wb") as fp:
+                fp.write(buf.getvalue())
+            cache = PdfCache(maxSize=2 * len(buf.getvalue()))
+            page, xobj = cache.load(fname)
+            self.assertIs(cache.load(fname)[1], xobj)
+            with open(fname, "wb") as fp:
+                fp.write(savePdfFigure([1, 2, 3, 4]).getvalue())
+            self.assertIsNot(cache.load(fname)[1], xobj)
+            cache.load(buf)
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+            self.assertLessEqual(len(cache), 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def test_release(self):
+        """
+        cached images do not keep the documents they were drawn into alive
+        """
+        import gc
+        import weakref
+
+        buf = savePdfFigure([5, 2, 4])
+        documents = []
+        for i in range(3):
+            doc = portraitDoc("test_release.pdf")
+            image = ap.PdfImage(buf)
+            doc.build([image])
+            documents.append(weakref.ref(doc.canv._doc))
+            del doc
+        gc.collect()
+        self.assertEqual([ref() for ref in documents], [None] * 3)
+        self.assertFalse(vars(image.xobj).get("derived_rl_obj"))
+
+    def test_lazy(self):
+        """
+        lazy images have the size of the page and parse it only to draw it
+        """
+        class CountedPdfImage(ap.LazyPdfImage):
+            parsed = 0
+
+            def _parse(self):
+                CountedPdfImage.parsed += 1
+                return super()._parse()
+
+        buf = savePdfFigure([3, 1, 2])
+        image = ap.PdfImage(buf, width=4 * ar.cm, height=3 * ar.cm, kind="bound")
+        lazy = CountedPdfImage(buf, width=4 * ar.cm, height=3 * ar.cm, kind="bound")
+        self.assertEqual(CountedPdfImage.parsed, 1)
+        self.assertEqual(lazy.wrap(500, 500), image.wrap(500, 500))
+        self.assertNotIn("xobj", vars(lazy))
+        self.assertIsNone(lazy._digest)
+
+        doc = portraitDoc("test_lazyimage.pdf")
+        fname = doc.filename
+        doc.build([lazy, ar.PageBreak(), lazy, image])
+        # parsed once more for the first draw, the second one reuses the form
+        self.assertEqual(CountedPdfImage.parsed, 2)
+        self.assertNotIn("page", vars(lazy))
+        self.assertNotIn("xobj", vars(lazy))
+        self.assertEqual(lazy._digest, image.digest)
+        with open(fname, "rb") as fp:
+            self.assertEqual(fp.read().count(b"/Subtype /Form"), 1)
+
 
 if __name__ == "__main__":
 